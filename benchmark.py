@@ -3,13 +3,12 @@
 # Now I will use a more robust method that checks for the presence of the 'B' icon in the header.
 
 import cv2
-import numpy as np
-import pandas as pd
-from tqdm import tqdm
 import os
 
-import cv2
-import os
+import data_preprocessing.config as config
+from data_preprocessing.benchmark_detector import BenchmarkDetector, get_detector
+from data_preprocessing.matrix_store import DatasetWriter, load_dataset
+from data_preprocessing.shards import image_lookup
 
 def crop_benchmark_template(image_path, output_path, coords):
     """
@@ -34,6 +33,7 @@ def crop_benchmark_template(image_path, output_path, coords):
 def detect_benchmark_b(image_path, template_path, threshold=0.8, debug=False, debug_output_dir="debug_benchmark"):
     """
     Detects whether an image contains the yellow benchmark 'B' using template matching.
+    The template is loaded once per process (see `BenchmarkDetector`).
 
     Parameters:
     - image_path: path to the input image.
@@ -47,47 +47,50 @@ def detect_benchmark_b(image_path, template_path, threshold=0.8, debug=False, de
     """
 
     image = cv2.imread(image_path)
-    template = cv2.imread(template_path)
-    if image is None or template is None:
+    detector = get_detector(template_path, threshold=threshold)
+    if image is None or detector is None:
         print(f"⚠️ The image or template couldn't be loaded: {image_path}")
         return False
 
-    gray_img = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray_template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
-
-    res = cv2.matchTemplate(gray_img, gray_template, cv2.TM_CCOEFF_NORMED)
-    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-
-    if max_val >= threshold:
-        if debug:
-            os.makedirs(debug_output_dir, exist_ok=True)
-            h, w = gray_template.shape
-            top_left = max_loc
-            bottom_right = (top_left[0] + w, top_left[1] + h)
-            cv2.rectangle(image, top_left, bottom_right, (0, 255, 0), 2)
-            debug_path = os.path.join(debug_output_dir, os.path.basename(image_path))
-            cv2.imwrite(debug_path, image)
-        return True
-    else:
-        return False
-    
-df = pd.read_csv("final_data.csv")
-
-# Loading the benchmark template
-template = "template_benchmark.png"
+    debug_path = os.path.join(debug_output_dir, os.path.basename(image_path)) if debug else None
+    return detector.detect(image, debug_path=debug_path)
 
-# Routes to the images
-image_dir = "data/headers/" 
-
-# Processing and adding the benchmark column
-benchmark_flags = []
-for filename in tqdm(df["filename"], desc="Detectando benchmark"):
-    image_path = os.path.join(image_dir, filename)
-    is_benchmark = detect_benchmark_b(image_path, template)
-    benchmark_flags.append(is_benchmark)
-
-df["benchmark"] = benchmark_flags
+def main(csv_path=None, output_csv=None, header_dir=None, template=None):
+    """
+    Adds the 'benchmark' column to an existing final_data.csv.
+    New datasets already get it from `extract_metadata`, in the same pass as the stars.
+    The new dataset is written with its packed matrices (see `matrix_store.DatasetWriter`), one
+    row per screenshot (the last one of incremental runs).
 
-# Saves the new CSV
-df.to_csv("final_data_with_benchmark.csv", index=False)
-print("✅ Nueva columna 'benchmark' añadida y guardada en final_data_with_benchmark.csv")
\ No newline at end of file
+    Parameters:
+    - csv_path: dataset CSV (default config.FINAL_CSV)
+    - output_csv: where the new dataset is saved (default <csv>_with_benchmark.csv); may be
+      `csv_path` to update the dataset in place
+    - header_dir: cropped headers, a directory or shard set (default config.HEADERS_DIR)
+    - template: benchmark 'B' template (default config.BENCHMARK_TEMPLATE)
+    """
+    csv_path = csv_path or config.FINAL_CSV
+    output_csv = output_csv or os.path.splitext(csv_path)[0] + "_with_benchmark.csv"
+    # Read into memory (no memory map), so the dataset can be rewritten in place
+    df, matrices = load_dataset(csv_path, mmap=False)
+
+    # Loading the benchmark template
+    template = template or config.BENCHMARK_TEMPLATE
+
+    # Routes to the images
+    image_dir = header_dir or config.HEADERS_DIR
+
+    # Processing and adding the benchmark column, in parallel
+    detector = BenchmarkDetector(template)
+    images = image_lookup(image_dir)
+    image_paths = [images.get(filename, os.path.join(image_dir, filename)) for filename in df["filename"]]
+    print(f"🔎 Detectando benchmark en {len(image_paths)} headers...")
+    df["benchmark"] = detector.detect_files(image_paths)
+
+    # Saves the new dataset, metadata and matrices
+    with DatasetWriter(output_csv, list(df.columns), append=False, aggregates=True) as writer:
+        writer.write(df.to_dict("records"), matrices)
+    print(f"✅ Nueva columna 'benchmark' añadida y guardada en {output_csv}")
+
+if __name__ == "__main__":
+    main()
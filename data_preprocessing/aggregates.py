@@ -0,0 +1,294 @@
+import os
+import argparse
+
+import numpy as np
+
+import data_preprocessing.config as config
+from data_preprocessing.matrix_store import (MATRIX_SHAPE, HOLD, START, END, matrices_path, unpack_matrices,
+                                             _read_header)
+from data_preprocessing.manifest import config_version
+
+ROWS, COLUMNS = MATRIX_SHAPE[:2]
+CELLS = ROWS * COLUMNS
+MAX_STARS = 5
+MAX_HOLDS = 40  # routes with more holds are counted in the last bin
+
+def aggregates_path(csv_path):
+    """
+    Returns the path of the aggregates of a dataset (final_data.csv -> final_data.agg.npz).
+    """
+    return os.path.splitext(csv_path)[0] + ".agg.npz"
+
+def _version():
+    # The grade of a row depends on the vocabulary and on the OCR corrections
+    return config_version(config.GRADE_VOCABULARY, config.GRADE_CORRECTIONS, config.GRADE_CONFUSIONS, MATRIX_SHAPE,
+                          MAX_STARS, MAX_HOLDS)
+
+class AggregateStore:
+    """
+    Running statistics of a dataset, kept up to date as rows are written (see
+    `matrix_store.DatasetWriter`), so summaries are read without rescanning the matrices.
+    With G = len(config.GRADE_VOCABULARY) + 1 grades (the last one for unknown grades):
+    - routes (G, 2): number of routes per grade, non-benchmark / benchmark
+    - holds (G, 2, 18, 11, 3): routes using each cell as a hold, start or end hold
+    - stars (G, 2, MAX_STARS + 1): histogram of the stars
+    - hold_counts (G, MAX_HOLDS + 1): histogram of the number of holds per route
+    - cooccurrence (G, 198, 198): routes using both holds i and j (cell = row * 11 + column)
+
+    A small record per route (dataset row, grade, benchmark, stars) lets an incremental run
+    replace a route it processed again: its previous row is subtracted before the new one is added.
+    The store is saved with `save` and caught up from the dataset files when it is opened behind
+    them (e.g. after an interrupted run or for a dataset written before it existed).
+
+    Parameters:
+    - csv_path: dataset CSV (default config.FINAL_CSV)
+    - reset: start from empty aggregates (the dataset is being rewritten)
+    """
+
+    def __init__(self, csv_path=None, reset=False):
+        self.csv_path = csv_path or config.FINAL_CSV
+        self.path = aggregates_path(self.csv_path)
+        self.labels = list(config.GRADE_VOCABULARY) + ["other"]
+        self._clear()
+        if not reset and os.path.exists(self.path):
+            self._load()
+        if not reset:
+            self.sync()
+
+    def _clear(self):
+        g = len(self.labels)
+        self.routes = np.zeros((g, 2), dtype=np.int64)
+        self.holds = np.zeros((g, 2, *MATRIX_SHAPE), dtype=np.int64)
+        self.stars = np.zeros((g, 2, MAX_STARS + 1), dtype=np.int64)
+        self.hold_counts = np.zeros((g, MAX_HOLDS + 1), dtype=np.int64)
+        self.cooccurrence = np.zeros((g, CELLS, CELLS), dtype=np.int32)
+        self.rows = 0
+        self.tail = b""
+        # Per route: filename -> (dataset row, grade code, benchmark, stars)
+        self.index = {}
+
+    def _load(self):
+        with np.load(self.path) as data:
+            if str(data["version"]) != _version() or list(data["labels"]) != self.labels:
+                return  # Other grades or shape: rebuilt from the dataset by `sync`
+            for name in ("routes", "holds", "stars", "hold_counts", "cooccurrence"):
+                setattr(self, name, data[name].copy())
+            self.rows = int(data["rows"])
+            self.tail = data["tail"].tobytes()
+            self.index = {str(f): (int(r), int(g), int(b), int(s)) for f, r, g, b, s in zip(
+                data["route_files"], data["route_rows"], data["route_grades"], data["route_benchmark"],
+                data["route_stars"])}
+
+    def save(self):
+        """
+        Writes the store next to the dataset (replacing the previous file at once).
+        """
+        files = list(self.index)
+        records = np.array(list(self.index.values()), dtype=np.int64).reshape(-1, 4)
+        tmp = self.path + ".tmp.npz"
+        np.savez_compressed(
+            tmp, version=_version(), labels=np.array(self.labels), rows=self.rows,
+            tail=np.frombuffer(self.tail, dtype=np.uint8), routes=self.routes, holds=self.holds, stars=self.stars,
+            hold_counts=self.hold_counts, cooccurrence=self.cooccurrence,
+            route_files=np.array(files, dtype=str), route_rows=records[:, 0],
+            route_grades=records[:, 1].astype(np.int8), route_benchmark=records[:, 2].astype(np.int8),
+            route_stars=records[:, 3].astype(np.int8))
+        os.replace(tmp, self.path)
+
+    def _packed_rows(self, rows):
+        """
+        Packed matrices of the given dataset rows, read from the .bits file.
+        """
+        bits_path = matrices_path(self.csv_path)
+        row_bytes = _read_header(bits_path)["row_bytes"]
+        raw = np.memmap(bits_path, dtype=np.uint8, mode="r")
+        return np.asarray(raw[: len(raw) // row_bytes * row_bytes].reshape(-1, row_bytes)[rows])
+
+    def _grade_codes(self, rows):
+        import pandas as pd
+        from data_preprocessing.grades import dataset_grade_codes
+
+        codes = dataset_grade_codes(pd.DataFrame(rows), self.labels[:-1]).astype(np.int64)
+        codes[codes < 0] = len(self.labels) - 1
+        return codes
+
+    def _apply(self, codes, benchmark, stars, matrices, sign):
+        """
+        Adds (sign 1) or removes (sign -1) routes from every aggregate.
+        """
+        matrices = np.asarray(matrices, dtype=np.uint8).reshape(len(codes), *MATRIX_SHAPE)
+        np.add.at(self.routes, (codes, benchmark), sign)
+        np.add.at(self.holds, (codes, benchmark), sign * matrices.astype(np.int64))
+        valid = (stars >= 0) & (stars <= MAX_STARS)
+        np.add.at(self.stars, (codes[valid], benchmark[valid], stars[valid]), sign)
+
+        holds = matrices[..., HOLD].reshape(len(codes), CELLS)
+        np.add.at(self.hold_counts, (codes, np.minimum(holds.sum(axis=1), MAX_HOLDS)), sign)
+        for code in np.unique(codes):
+            # Float32 products are exact for the counts of one chunk
+            h = holds[codes == code].astype(np.float32)
+            self.cooccurrence[code] += sign * np.rint(h.T @ h).astype(np.int32)
+
+    def update(self, rows, matrices, first_row=None):
+        """
+        Adds a chunk of rows just written to the dataset.
+
+        Parameters:
+        - rows: list of dicts with 'filename', 'grade', 'benchmark' and 'stars'
+        - matrices: their (N, 18, 11, 3) matrices
+        - first_row: dataset row of the first one (default: right after the rows already aggregated)
+        """
+        if not rows:
+            return
+        first_row = self.rows if first_row is None else first_row
+        codes = self._grade_codes(rows)
+        benchmark = np.array([str(row.get("benchmark")) == "True" for row in rows], dtype=np.int64)
+        stars = np.array([int(row["stars"]) if str(row.get("stars")).lstrip("-").isdigit() else -1
+                          for row in rows], dtype=np.int64)
+
+        replaced = []
+        for i, row in enumerate(rows):
+            previous = self.index.get(row["filename"])
+            if previous is not None:
+                replaced.append(previous)
+            self.index[row["filename"]] = (first_row + i, int(codes[i]), int(benchmark[i]), int(stars[i]))
+
+        if replaced:
+            old = np.array(replaced, dtype=np.int64)
+            old_matrices = unpack_matrices(self._packed_rows(old[:, 0]))
+            self._apply(old[:, 1], old[:, 2], old[:, 3], old_matrices, -1)
+        self._apply(codes, benchmark, stars, matrices, 1)
+
+        self.rows = first_row + len(rows)
+        self.tail = self._packed_rows([self.rows - 1]).tobytes()
+
+    def sync(self):
+        """
+        Catches up with the rows the dataset has beyond the store, rebuilding it from scratch
+        when the dataset was rewritten since.
+
+        Returns:
+        - number of rows added
+        """
+        import pandas as pd
+
+        bits_path = matrices_path(self.csv_path)
+        if not os.path.exists(bits_path) or not os.path.exists(self.csv_path):
+            if self.rows:
+                self._clear()
+            return 0
+        row_bytes = _read_header(bits_path)["row_bytes"]
+        total = os.path.getsize(bits_path) // row_bytes
+
+        if self.rows > total or (self.rows and self._packed_rows([self.rows - 1]).tobytes() != self.tail):
+            self._clear()
+        if self.rows == total:
+            return 0
+
+        start = self.rows
+        df = pd.read_csv(self.csv_path, skiprows=range(1, start + 1), nrows=total - start)
+        matrices = unpack_matrices(self._packed_rows(slice(start, start + len(df))))
+        for chunk in range(0, len(df), 10000):
+            self.update(df.iloc[chunk:chunk + 10000].to_dict("records"), matrices[chunk:chunk + 10000],
+                        first_row=start + chunk)
+        return len(df)
+
+    # Queries: all of them read the aggregates only
+
+    def _grades(self, grade):
+        if grade is None:
+            return slice(None)
+        grades = [grade] if isinstance(grade, str) else list(grade)
+        return [self.labels.index(g) for g in grades]
+
+    def _benchmark(self, benchmark):
+        return slice(None) if benchmark is None else int(bool(benchmark))
+
+    def route_counts(self, benchmark=None):
+        """
+        Number of routes per grade (all, or only benchmarks / non-benchmarks).
+
+        Returns:
+        - pandas Series indexed by grade
+        """
+        import pandas as pd
+
+        counts = self.routes[:, self._benchmark(benchmark)]
+        return pd.Series(counts.sum(axis=1) if counts.ndim == 2 else counts, index=self.labels, name="routes")
+
+    def heatmap(self, grade=None, benchmark=None, channel=HOLD, normalize=True):
+        """
+        How often each cell is used (as a hold, or as a start/end hold with `channel`).
+
+        Parameters:
+        - grade: grade label, list of labels, or None for all the routes
+        - benchmark: True / False to count only benchmarks / non-benchmarks
+        - normalize: fraction of the routes instead of counts
+
+        Returns:
+        - (18, 11) array, row 0 is the top of the board
+        """
+        g, b = self._grades(grade), self._benchmark(benchmark)
+        counts = self.holds[g][:, b][..., channel].reshape(-1, ROWS, COLUMNS).sum(axis=0)
+        if not normalize:
+            return counts
+        return counts / max(1, int(self.routes[g][:, b].sum()))
+
+    def cooccurrence_matrix(self, grade=None):
+        """
+        Routes using both holds: entry [r1, c1, r2, c2] counts the routes with holds at (r1, c1)
+        and (r2, c2); the diagonal is the usage of each hold.
+
+        Returns:
+        - (18, 11, 18, 11) int64 array
+        """
+        counts = self.cooccurrence[self._grades(grade)].astype(np.int64)
+        return counts.reshape(-1, CELLS, CELLS).sum(axis=0).reshape(ROWS, COLUMNS, ROWS, COLUMNS)
+
+    def star_histogram(self, grade=None, benchmark=None):
+        """
+        Number of routes with 0 to MAX_STARS stars.
+        """
+        stars = self.stars[self._grades(grade)][:, self._benchmark(benchmark)]
+        return stars.reshape(-1, MAX_STARS + 1).sum(axis=0)
+
+    def hold_count_histogram(self, grade=None):
+        """
+        Number of routes with 0 to MAX_HOLDS holds (the last bin counts longer routes too).
+        """
+        return self.hold_counts[self._grades(grade)].reshape(-1, MAX_HOLDS + 1).sum(axis=0)
+
+    def summary(self):
+        """
+        One row per grade: routes, benchmarks, mean stars, mean number of holds, start and end holds.
+
+        Returns:
+        - pandas DataFrame indexed by grade (grades without routes are left out)
+        """
+        import pandas as pd
+
+        routes = self.routes.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stars = self.stars.sum(axis=1)
+            mean_stars = (stars * np.arange(MAX_STARS + 1)).sum(axis=1) / stars.sum(axis=1)
+            per_channel = self.holds.sum(axis=(1, 2, 3)) / routes[:, None]
+        df = pd.DataFrame({"routes": routes, "benchmarks": self.routes[:, 1], "mean_stars": mean_stars.round(2),
+                           "mean_holds": per_channel[:, HOLD].round(2), "mean_starts": per_channel[:, START].round(2),
+                           "mean_ends": per_channel[:, END].round(2)}, index=pd.Index(self.labels, name="grade"))
+        return df[df["routes"] > 0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precomputed statistics of a dataset")
+    parser.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the aggregates from the whole dataset")
+    parser.add_argument("--grade", default=None, help="print the hold heatmap of this grade")
+    args = parser.parse_args()
+
+    store = AggregateStore(args.csv, reset=args.rebuild)
+    if args.rebuild:
+        store.sync()
+    store.save()
+    print(store.summary().to_string())
+    if args.grade:
+        print(f"\n🔥 Hold usage of {args.grade} routes (% of the routes, top of the board first):")
+        print(np.array2string(np.round(store.heatmap(args.grade) * 100).astype(int), max_line_width=120))
@@ -0,0 +1,126 @@
+import os
+import cv2
+import numpy as np
+from functools import partial
+
+import data_preprocessing.config as config
+
+_detectors = {}
+
+class BenchmarkDetector:
+    """
+    Detects the yellow benchmark 'B' icon in header images using template matching.
+    The template is read and converted to grayscale once, and matching is restricted to the
+    region of the header where the icon is shown.
+
+    Parameters:
+    - template_path: path to the cropped 'B' template (default config.BENCHMARK_TEMPLATE)
+    - region: (y1, y2, x1, x2) fractions of the header height/width where the icon is searched
+      (default config.BENCHMARK_ICON_REGION)
+    - threshold: minimum correlation to accept a match (default config.BENCHMARK_THRESHOLD)
+    - scale: the headers are read at 1/scale of their size (see `parallel_cropper.read_image`),
+      the template is shrunk the same way
+    """
+
+    def __init__(self, template_path=None, region=None, threshold=None, scale=1):
+        self.template_path = template_path or config.BENCHMARK_TEMPLATE
+        self.region = region or config.BENCHMARK_ICON_REGION
+        self.threshold = config.BENCHMARK_THRESHOLD if threshold is None else threshold
+        self.scale = scale
+
+        self.template = cv2.imread(self.template_path, cv2.IMREAD_GRAYSCALE)
+        if self.template is None:
+            raise ValueError(f"The benchmark template couldn't be loaded: {self.template_path}")
+        if scale > 1:
+            th, tw = self.template.shape
+            self.template = cv2.resize(self.template, (max(1, tw // scale), max(1, th // scale)),
+                                       interpolation=cv2.INTER_AREA)
+
+    def _search_area(self, header):
+        """
+        Returns the icon region of a header (grayscale) and its top-left offset.
+        Falls back to the whole header if the region is smaller than the template.
+        """
+        h, w = header.shape[:2]
+        fy1, fy2, fx1, fx2 = self.region
+        y1, y2, x1, x2 = int(fy1 * h), int(fy2 * h), int(fx1 * w), int(fx2 * w)
+        th, tw = self.template.shape
+        if y2 - y1 < th or x2 - x1 < tw:
+            y1, y2, x1, x2 = 0, h, 0, w
+
+        area = header[y1:y2, x1:x2]
+        if area.ndim == 3:
+            area = cv2.cvtColor(area, cv2.COLOR_BGR2GRAY)
+        return area, (x1, y1)
+
+    def match(self, header):
+        """
+        Returns (score, top-left location in header coordinates) of the best match.
+        """
+        area, (ox, oy) = self._search_area(header)
+        if area.shape[0] < self.template.shape[0] or area.shape[1] < self.template.shape[1]:
+            return 0.0, (0, 0)
+        res = cv2.matchTemplate(area, self.template, cv2.TM_CCOEFF_NORMED)
+        _, max_val, _, max_loc = cv2.minMaxLoc(res)
+        return float(max_val), (max_loc[0] + ox, max_loc[1] + oy)
+
+    def detect(self, header, debug_path=None):
+        """
+        Returns True if the benchmark 'B' is detected in a header image (BGR format).
+        If `debug_path` is given and the icon is found, saves the header with the match highlighted.
+        """
+        score, top_left = self.match(header)
+        found = score >= self.threshold
+
+        if found and debug_path:
+            os.makedirs(os.path.dirname(debug_path) or ".", exist_ok=True)
+            th, tw = self.template.shape
+            vis = header.copy()
+            cv2.rectangle(vis, top_left, (top_left[0] + tw, top_left[1] + th), (0, 255, 0), 2)
+            cv2.imwrite(debug_path, vis)
+        return found
+
+    def detect_batch(self, headers):
+        """
+        Detects the icon in a list of header images.
+
+        Returns:
+        - numpy bool array with one flag per header
+        """
+        return np.array([self.detect(header) for header in headers], dtype=bool)
+
+    def detect_files(self, image_paths, backend=None, max_workers=None):
+        """
+        Detects the icon in header files in parallel (see `executor.run_parallel`).
+        Every worker builds its own detector once, unreadable images count as not benchmark.
+
+        Returns:
+        - list of flags in the same order as `image_paths`
+        """
+        from data_preprocessing.executor import run_parallel
+
+        detect = partial(_detect_file, template_path=self.template_path,
+                         region=self.region, threshold=self.threshold)
+        results = run_parallel(detect, image_paths, backend=backend, max_workers=max_workers, ordered=True)
+        return [bool(flag) for _, flag, _ in results]
+
+def get_detector(template_path=None, region=None, threshold=None, scale=1):
+    """
+    Returns a detector cached for the lifetime of the process, or None if the template is missing.
+    """
+    key = (template_path or config.BENCHMARK_TEMPLATE, region, threshold, scale)
+    if key not in _detectors:
+        try:
+            _detectors[key] = BenchmarkDetector(template_path, region, threshold, scale)
+        except ValueError as e:
+            print(f"⚠️ {e}")
+            _detectors[key] = None
+    return _detectors[key]
+
+def _detect_file(image_path, template_path=None, region=None, threshold=None):
+    from data_preprocessing.parallel_cropper import read_image
+
+    image = read_image(image_path)
+    if image is None:
+        return False
+    return get_detector(template_path, region, threshold).detect(image)
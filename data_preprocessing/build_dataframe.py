@@ -1,46 +1,123 @@
 import os
 import pandas as pd
-import numpy as np
 from tqdm import tqdm
 
-def build_csv(image_dir, metadata_csv, image_to_matrix_func, output_csv):
+from data_preprocessing.executor import run_parallel
+from data_preprocessing.matrix_store import DatasetWriter, MATRIX_SHAPE
+from data_preprocessing.manifest import append_rows
+from data_preprocessing.shards import image_lookup
+from data_preprocessing.grades import normalize_grades
+
+# Metadata columns of the final CSV, the matrices are stored packed next to it
+# (the grade columns are described in ocr_parallel_extractor.METADATA_COLUMNS)
+FINAL_COLUMNS = ["filename", "grade", "benchmark", "stars", "grade_code", "grade_flag", "raw_grade"]
+
+# Rows written (and recorded in the manifest) at once
+FLUSH_EVERY = 500
+
+REJECT_COLUMNS = ["filename", "reason", "detail"]
+
+def rejects_path(output_csv):
+    """
+    Returns the path of the rejects file of a dataset (final_data.csv -> final_data_rejects.csv).
     """
-    Process images from the directory, applies `image_to_matrix_func`,
-    And save them in a new csv with columns: filename, grade, matrix (como string), benchmark, stars.
+    return os.path.splitext(output_csv)[0] + "_rejects.csv"
+
+def build_csv(image_dir, metadata_csv, image_to_matrix_func, output_csv, backend=None, max_workers=None, manifest=None,
+              metrics=None, exclude=None, rejects_csv=None):
+    """
+    Process images from the directory (or shard set), applies `image_to_matrix_func` in parallel,
+    And save them in a new csv with columns: filename, grade, benchmark, stars, grade_code, grade_flag, raw_grade.
+    The matrices are bit-packed in a binary file next to the CSV (see `matrix_store.load_dataset`).
+
+    The directory is listed once and joined to the metadata, and the rows are written in
+    input order every FLUSH_EVERY rows, so memory does not grow with the corpus.
+    Rows that cannot be built (missing image, unreadable image, invalid matrix) are written to
+    `rejects_csv` (default `rejects_path(output_csv)`) with the reason.
+
+    `image_to_matrix_func` must be picklable (a module-level function) for the process backend.
+    With a `Manifest`, only boards (or metadata rows) that are new or changed are processed and
+    appended to the dataset; without it, the dataset is rewritten from scratch.
+    Timings and errors are recorded in `metrics` (an `instrumentation.StageMetrics`) if given.
+    Files in `exclude` (e.g. duplicates found by `dedup.dedup_boards`) are left out of the dataset.
     """
 
+    # Rejected rows are retried on the next run, so the file only lists the last run's rejects
+    rejects_csv = rejects_csv or rejects_path(output_csv)
+    if os.path.exists(rejects_csv):
+        os.remove(rejects_csv)
+
     metadata = pd.read_csv(metadata_csv)
+    for column in FINAL_COLUMNS:
+        if column not in metadata:
+            metadata[column] = None
+    # Incremental runs append to the metadata CSV, the last row of a file wins
+    metadata = metadata[FINAL_COLUMNS].drop_duplicates("filename", keep="last")
+    # Metadata extracted before the grades were normalized at extraction time
+    old = metadata["grade_flag"].isna()
+    if old.any():
+        metadata.loc[old, "raw_grade"] = metadata.loc[old, "grade"]
+        metadata.loc[old, ["grade", "grade_code", "grade_flag"]] = normalize_grades(metadata.loc[old, "grade"])
+    if exclude:
+        metadata = metadata[~metadata["filename"].isin(exclude)]
+
+    # One directory listing (or shard index) joined to the metadata, instead of a stat per row
+    images = image_lookup(image_dir)
+    present = metadata["filename"].isin(images.keys())
+    missing = metadata.loc[~present, "filename"]
+    if len(missing):
+        print(f"❌ {len(missing)} images not found in {image_dir}, see: {rejects_csv}")
+        append_rows(rejects_csv, [(f, "missing_image", image_dir) for f in missing], columns=REJECT_COLUMNS)
+        if metrics is not None:
+            for filename in missing:
+                metrics.add_error(filename, "missing_image")
+    metadata = metadata[present]
+
+    image_paths = [images[filename] for filename in metadata["filename"]]
+    if manifest is not None:
+        values = metadata[FINAL_COLUMNS[1:]].itertuples(index=False, name=None)
+        extra = dict(zip(image_paths, values))
+        todo = manifest.pending(image_paths, extra=extra)
+        metadata = metadata[pd.Series(image_paths, index=metadata.index).isin(set(todo))]
+        image_paths = [images[filename] for filename in metadata["filename"]]
+        print(f"⏭️ {len(manifest)} boards already in the dataset, {len(image_paths)} new or changed.")
+
+    outputs = run_parallel(image_to_matrix_func, image_paths, backend=backend, max_workers=max_workers, ordered=True,
+                           metrics=metrics)
+
+    writer = DatasetWriter(output_csv, FINAL_COLUMNS, append=manifest is not None, aggregates=True)
     data = []
+    rejects = []
+
+    def flush():
+        writer.write([entry for _, entry, _ in data], [matrix for _, _, matrix in data])
+        append_rows(rejects_csv, rejects, columns=REJECT_COLUMNS)
+        if manifest is not None:
+            for path, _, _ in data:
+                manifest.mark_done(path)
+            manifest.flush()
+        data.clear()
+        rejects.clear()
+
+    rows = metadata.itertuples(index=False, name=None)
+    for row, (image_path, matrix, error) in tqdm(zip(rows, outputs), total=len(image_paths)):
+        entry = dict(zip(FINAL_COLUMNS, row))
+        filename = entry["filename"]
+        if error:
+            print(f"⚠️ Error con {filename}: {error}")
+            rejects.append((filename, type(error).__name__, str(error)))
+        elif matrix is None or matrix.shape != MATRIX_SHAPE:
+            shape = None if matrix is None else matrix.shape
+            print(f"⚠️ {filename} returned a matrix of shape {shape}")
+            rejects.append((filename, "invalid_matrix", f"shape {shape}"))
+            if metrics is not None:
+                metrics.add_error(filename, "invalid_matrix", f"shape {shape}")
+        else:
+            data.append((image_path, entry, matrix))
+
+        if len(data) + len(rejects) >= FLUSH_EVERY:
+            flush()
 
-    for _, row in tqdm(metadata.iterrows(), total=len(metadata)):
-        filename = row['filename']
-        grade = row['grade']
-        benchmark_val = row.get('benchmark')
-        stars_val = row.get('stars')
-        image_path = os.path.join(image_dir, filename)
-
-        if not os.path.exists(image_path):
-            print(f"❌ Image not found: {image_path}")
-            continue
-        
-        try:
-            matrix = image_to_matrix_func(image_path)
-            if matrix.shape != (18, 11):
-                print(f"⚠️ {filename} returned a matrix of shape {matrix.shape}")
-                raise ValueError(f"Invalid matrix for {filename}")
-            matrix_str = matrix.astype(int).tolist()  # Save as list for better readability
-            data.append({
-                "filename": filename,
-                "grade": grade,
-                "matrix": matrix_str,
-                "benchmark": benchmark_val,
-                "stars": stars_val
-            })
-
-        except Exception as e:
-            print(f"⚠️ Error con {filename}: {e}")
-    
-    # Convert to Dataframe and save to CSV
-    df = pd.DataFrame(data)
-    df.to_csv(output_csv, index=False)
-    print(f"✅ CSV guardado en: {output_csv}")
\ No newline at end of file
+    flush()
+    writer.close()
+    print(f"✅ CSV guardado en: {output_csv}")
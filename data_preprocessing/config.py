@@ -5,6 +5,57 @@ HEADER_COORDS = (175, 300, 500, 1100)
 BOARD_COORDS = (460, 2260, 290, 1390)
 #BOARD_COORDS = (450, 2270, 537, 637)
 
+# HSV range for colors (in OpenCV: H: 0-179, S,V: 0-255), as (lower, upper)
+HOLD_HSV_RANGES = {
+    "green": ([50, 100, 100], [85, 255, 255]),
+    "blue":  ([100, 100, 100], [130, 255, 255]),
+    "red1":  ([0, 100, 100], [10, 255, 255]),
+    "red2":  ([160, 100, 100], [180, 255, 255])
+}
+
+# Minimum fraction of a grid cell a hold colour must cover to mark the cell
+HOLD_MIN_CELL_FRACTION = 0.02
+
+# Yellow used by the stars and the benchmark icon in the header
+YELLOW_HSV_RANGE = ((20, 100, 100), (35, 255, 255))
+
+# Font grades shown by the app, easiest to hardest
+GRADE_VOCABULARY = ["6B+", "6C", "6C+", "7A", "7A+", "7B", "7B+", "7C", "7C+", "8A", "8A+", "8B", "8B+", "8C"]
+
+# Grades the models are trained on (6B and 8A+ routes are too few), and the OCR misreads
+# corrected when cleaning the metadata
+TRAINING_GRADES = ["6B+", "6C", "6C+", "7A", "7A+", "7B", "7B+", "7C", "7C+"]
+GRADE_CORRECTIONS = {"TAt": "7A+", "TA+": "7A+", "TAIV6": "7A", "6Bt": "6B+"}
+
+# Characters the OCR confuses, by position in the grade (number, letter, '+'): a string that is
+# not a grade, even after GRADE_CORRECTIONS, is read through them ("T8t" -> "7B+") and flagged
+# "confusion" in the metadata (see grades.normalize_grade)
+GRADE_CONFUSIONS = {
+    "number": {"T": "7", "S": "5", "G": "6", "b": "6", "B": "8", "g": "9", "q": "9"},
+    "letter": {"8": "B", "0": "C", "O": "C", "G": "C", "4": "A"},
+    "plus": {"t": "+", "T": "+", "4": "+", "*": "+", "#": "+", "f": "+"},
+}
+
+# Position of the grade word in the header: line 2 ("Grade: User 7A+/V7 ..."), word 2
+GRADE_LINE_INDEX = 2
+GRADE_WORD_INDEX = 2
+
+# Cached grade templates and the correlation needed to trust them (else tesseract is used).
+# No templates ship with the repo: build them from the headers of a first OCR run with
+# `python main.py templates` (config.METADATA_CSV + config.HEADERS_DIR); without them every
+# header goes to tesseract
+GRADE_TEMPLATES = "grade_templates.npz"
+GRADE_MATCH_THRESHOLD = 0.85
+GRADE_MATCH_MARGIN = 0.05
+
+# Raw tesseract output, cached by image hash and tesseract options (SQLite; None = no cache)
+OCR_CACHE = "ocr_cache.sqlite"
+
+# Benchmark 'B' icon: template, header region (fractions y1, y2, x1, x2) and match threshold
+BENCHMARK_TEMPLATE = "template_benchmark.png"
+BENCHMARK_ICON_REGION = (0.0, 0.33, 0.4, 0.95)
+BENCHMARK_THRESHOLD = 0.8
+
 # Base directory
 BASE_IMAGE_DIR = "data"
 
@@ -18,4 +69,88 @@ HEADERS_TEST_DIR = f"{BASE_IMAGE_DIR}/headers_test"
 BOARDS_DIR  = f"{BASE_IMAGE_DIR}/moonboards"
 
 # Metadata CSV file
-METADATA_CSV = "metadata.csv"
\ No newline at end of file
+METADATA_CSV = "metadata.csv"
+
+# Final dataset (filename, grade, matrix, benchmark, stars)
+FINAL_CSV = "final_data.csv"
+
+# Nearest-neighbour index over the hold matrices (similarity_index.py)
+SIMILARITY_INDEX = "final_data.simidx"
+
+# Record of the inputs each stage already processed (incremental runs)
+MANIFEST_PATH = f"{BASE_IMAGE_DIR}/manifest.jsonl"
+
+# Repeated captures (failed swipe, app lag): index of board/matrix hashes, report of the dropped
+# boards, max Hamming distance (of 256 bits) between near-identical boards and how many
+# previous captures each board is compared with
+DEDUP_INDEX = f"{BASE_IMAGE_DIR}/dedup_index.jsonl"
+DEDUP_REPORT = f"{BASE_IMAGE_DIR}/dedup_report.csv"
+DEDUP_MAX_DISTANCE = 4
+DEDUP_WINDOW = 50
+
+# Per-image timings, errors and the Prometheus snapshot of each run
+METRICS_DIR = f"{BASE_IMAGE_DIR}/metrics"
+SLOWEST_IMAGES = 20  # slowest images reported per stage
+
+# Device capture (data_scrapper.py): adb command line, device serial (None = the only one),
+# frames buffered between capture and disk write, consumer tasks and wait after each swipe
+ADB_COMMAND = "adb"
+ADB_SERIAL = None
+CAPTURE_QUEUE_SIZE = 8
+CAPTURE_WRITERS = 2
+CAPTURE_SETTLE_SECONDS = 0.0
+# Attempts of a screencap or swipe before the route is skipped (adb fails now and then)
+CAPTURE_ATTEMPTS = 3
+
+# Image storage: any image directory can be replaced by a shard set, a directory with a few large
+# append-only .tar shards of up to SHARD_MAX_BYTES and an index.jsonl with the offset of every
+# image (shards.py). Every stage reads either kind; `python -m data_preprocessing.shards pack`
+# converts a directory. With SHARDED_CROPS the crop stage writes the headers/boards as shard sets
+SHARD_MAX_BYTES = 1 << 30
+SHARDED_CROPS = False
+
+# Headers and boards are analysed at 1/scale of their size (1, 2, 4 or 8); the crop coords and the
+# star/benchmark pixel thresholds are scaled to match. The board work (HSV conversion, hash)
+# dominates, while the grade text needs a sharp header. `python main.py calibrate` compares a
+# sample of CALIBRATION_SAMPLE screenshots with full resolution and picks both scales
+HEADER_DECODE_SCALE = 1
+BOARD_DECODE_SCALE = 1
+CALIBRATION_SAMPLE = 50
+
+# Parallel execution ("thread" or "process")
+EXECUTOR_BACKEND = "thread"
+NUM_WORKERS = None  # None = one worker per core
+CHUNK_SIZE = 16     # images sent to a worker at once
+
+# Autotuner (executor.ConcurrencyController): with EXECUTOR_BACKEND = "auto" the thread and process
+# pools are measured side by side, with NUM_WORKERS = "auto" (or --backend/--workers auto) the
+# number of workers follows the throughput measured every AUTOTUNE_WINDOW seconds, up to
+# AUTOTUNE_MAX_WORKERS (None = 4 per core, at least 32). The settings each stage ended with are
+# printed at the end of the run and can be pinned in STAGE_EXECUTORS, e.g.
+# {"crop_header": ("thread", 12), "ocr": ("process", 4)}
+AUTOTUNE_WINDOW = 2.0
+AUTOTUNE_TOLERANCE = 0.05
+AUTOTUNE_MAX_WORKERS = None
+STAGE_EXECUTORS = {}
+
+# Grade prediction without TensorFlow (modeling/inference.py, modeling/serve.py): exported model,
+# routes per forward pass, and the micro-batching of the server (largest batch, longest wait
+# for more requests before running one) and its port
+GRADE_MODEL = "grade_cnn.npz"
+INFERENCE_BATCH_SIZE = 64  # small batches stay in cache, faster than large ones
+SERVE_MAX_BATCH = 64
+SERVE_MAX_WAIT_MS = 2
+SERVE_PORT = 8000
+
+# Training harness (modeling/train.py): folds of the cross-validation, threads of every training
+# job (jobs run side by side, cores // TRAIN_THREADS_PER_JOB at a time) and the result table
+CV_FOLDS = 5
+TRAIN_THREADS_PER_JOB = 2
+TRAIN_RESULTS = "training_results.csv"
+
+# Contact sheets of the hold matrices (render.py): output directory, routes per sheet,
+# routes per sheet row and size of a board cell in pixels
+CONTACT_SHEETS_DIR = f"{BASE_IMAGE_DIR}/contact_sheets"
+SHEET_ROUTES = 100
+SHEET_COLUMNS = 10
+RENDER_CELL_PX = 16
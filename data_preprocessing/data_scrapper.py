@@ -1,10 +1,14 @@
 import os
 import time
-import config
+import shlex
+import asyncio
+import argparse
+import threading
+
+import data_preprocessing.config as config
 
 # Folder where images will be saved
 SAVE_DIR = config.RAW_DIR
-os.makedirs(SAVE_DIR, exist_ok=True)
 
 # Number of captures to perform
 NUM_CAPTURES = 50000
@@ -15,25 +19,254 @@ SWIPE_X1, SWIPE_Y1 = 900, 800
 SWIPE_X2, SWIPE_Y2 = 200, 800
 SWIPE_DURATION_MS = 10 # duration in miliseconds
 
-def capture_and_pull(i):
-    # Screencap on the device
-    os.system("adb shell screencap -p /sdcard/screen.png")
-    
-    # Download the image to the local machine
-    local_path = os.path.join(SAVE_DIR, f"moonboard_{i:04}.png")
-    os.system(f"adb pull /sdcard/screen.png {local_path}")
-    print(f"[✓] Imagen guardada: {local_path}")
-
-def swipe_left():
-    os.system(f"adb shell input swipe {SWIPE_X1} {SWIPE_Y1} {SWIPE_X2} {SWIPE_Y2} {SWIPE_DURATION_MS}")
-
-def main():
-    for i in range(1, NUM_CAPTURES + 1):
-        print(f"[{i}] Capturando ruta...")
-        capture_and_pull(i)
-        time.sleep(0.0001)  # Wait for the image to be saved
-        swipe_left()
-        time.sleep(0.0001)  # Wait for the swipe to complete
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+class AdbDevice:
+    """
+    Runs adb commands asynchronously.
+
+    Parameters:
+    - adb: adb command line (default config.ADB_COMMAND); any program accepting the same
+      arguments works, e.g. the fake device of `fake_adb.py`
+    - serial: device serial, when several devices are connected (default config.ADB_SERIAL)
+    """
+
+    def __init__(self, adb=None, serial=None):
+        self.command = shlex.split(adb or config.ADB_COMMAND)
+        serial = serial or config.ADB_SERIAL
+        if serial:
+            self.command += ["-s", serial]
+
+    async def run(self, *args):
+        process = await asyncio.create_subprocess_exec(
+            *self.command, *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            message = stderr.decode(errors="replace").strip()
+            raise RuntimeError(f"adb {' '.join(args)} failed ({process.returncode}): {message}")
+        return stdout
+
+    async def screencap(self):
+        """
+        Streams a screenshot straight into host memory (`adb exec-out screencap -p`),
+        without going through the device storage.
+
+        Returns:
+        - the PNG file content (bytes)
+        """
+        png = await self.run("exec-out", "screencap", "-p")
+        if not png.startswith(PNG_SIGNATURE):
+            raise RuntimeError(f"screencap did not return a PNG ({len(png)} bytes)")
+        return png
+
+    async def swipe(self):
+        await self.run("shell", "input", "swipe", str(SWIPE_X1), str(SWIPE_Y1),
+                       str(SWIPE_X2), str(SWIPE_Y2), str(SWIPE_DURATION_MS))
+
+async def _attempt(stats, label, call):
+    """
+    Runs an adb call up to config.CAPTURE_ATTEMPTS times; transient adb failures are counted in
+    stats["errors"] instead of stopping the capture.
+
+    Returns:
+    - the result of the call, or None if every attempt failed
+    """
+    for attempt in range(1, config.CAPTURE_ATTEMPTS + 1):
+        try:
+            return await call()
+        except RuntimeError as e:
+            stats["errors"] += 1
+            print(f"⚠️ {label} failed (attempt {attempt}/{config.CAPTURE_ATTEMPTS}): {e}")
+    return None
+
+def capture_filename(i, start, count):
+    """
+    File name of route i, zero-padded to the widest index of the run (at least 4 digits), so
+    the names sort in capture order.
+    """
+    return f"moonboard_{i:0{max(4, len(str(start + count - 1)))}}.png"
+
+def _write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+async def capture_routes(device, count, start=1, save_dir=None, on_frame=None, queue_size=None,
+                         writers=None, settle=None):
+    """
+    Captures `count` routes, swiping left after each one.
+    A producer captures route i and swipes to route i+1 while consumer tasks write route i
+    to disk and/or hand it to `on_frame`, so the device never waits for the host.
+    The queue is bounded: when the host falls behind, capturing pauses instead of piling up frames.
+    A screencap or swipe that fails config.CAPTURE_ATTEMPTS times is counted in the errors and
+    the route is skipped.
+
+    Parameters:
+    - device: `AdbDevice`
+    - count: number of routes to capture
+    - start: index of the first route, used in the file names
+    - save_dir: if given, the PNGs are saved there as they were received
+    - on_frame: optional function (filename, png bytes) run on every frame in a worker thread,
+      e.g. a `FrameProcessor`
+    - queue_size: frames buffered between capture and consumers (default config.CAPTURE_QUEUE_SIZE)
+    - writers: number of consumer tasks (default config.CAPTURE_WRITERS)
+    - settle: seconds to wait after a swipe before the next capture (default config.CAPTURE_SETTLE_SECONDS)
+
+    Returns:
+    - dictionary with the counts and the time spent capturing, swiping and consuming
+    """
+
+    queue = asyncio.Queue(maxsize=queue_size or config.CAPTURE_QUEUE_SIZE)
+    writers = writers or config.CAPTURE_WRITERS
+    settle = config.CAPTURE_SETTLE_SECONDS if settle is None else settle
+    stats = {"captured": 0, "saved": 0, "processed": 0, "errors": 0,
+             "capture_seconds": 0.0, "swipe_seconds": 0.0, "consume_seconds": 0.0}
+
+    async def producer():
+        try:
+            for i in range(start, start + count):
+                t0 = time.perf_counter()
+                png = await _attempt(stats, f"screencap of route {i}", device.screencap)
+                t1 = time.perf_counter()
+                stats["capture_seconds"] += t1 - t0
+                if png is not None:
+                    stats["captured"] += 1
+                    await queue.put((i, png))
+
+                t2 = time.perf_counter()
+                await _attempt(stats, f"swipe after route {i}", device.swipe)
+                if settle:
+                    await asyncio.sleep(settle)
+                stats["swipe_seconds"] += time.perf_counter() - t2
+        finally:
+            for _ in range(writers):
+                await queue.put(None)
+
+    async def consumer():
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            i, png = entry
+            filename = capture_filename(i, start, count)
+            t0 = time.perf_counter()
+            try:
+                if save_dir:
+                    await asyncio.to_thread(_write_file, os.path.join(save_dir, filename), png)
+                    stats["saved"] += 1
+                if on_frame:
+                    await asyncio.to_thread(on_frame, filename, png)
+                    stats["processed"] += 1
+            except Exception as e:
+                stats["errors"] += 1
+                print(f"⚠️ Error con {filename}: {e}")
+            stats["consume_seconds"] += time.perf_counter() - t0
+
+    start_time = time.perf_counter()
+    await asyncio.gather(producer(), *(consumer() for _ in range(writers)))
+    stats["seconds"] = time.perf_counter() - start_time
+    stats["captures_per_sec"] = stats["captured"] / stats["seconds"] if stats["seconds"] else None
+    return stats
+
+class FrameProcessor:
+    """
+    Sends captured frames directly into the fused pipeline: each PNG is decoded in memory,
+    processed with `process_frame` and appended to the final dataset, without reading the
+    screenshot back from disk.
+
+    Parameters:
+    - output_csv: dataset to append the rows to (see `matrix_store.load_dataset`)
+    - dedup: optional `dedup.DedupIndex`; repeated captures (e.g. a swipe that did not
+      register) are not added to the dataset
+    """
+
+    def __init__(self, output_csv, dedup=None):
+        from data_preprocessing.build_dataframe import FINAL_COLUMNS
+        from data_preprocessing.matrix_store import DatasetWriter
+
+        self.columns = FINAL_COLUMNS
+        self.writer = DatasetWriter(output_csv, FINAL_COLUMNS, append=True, aggregates=True)
+        self.buffer = []
+        self.dedup = dedup
+        self.lock = threading.RLock()
+
+    def __call__(self, filename, png):
+        import cv2
+        import numpy as np
+        from data_preprocessing.build_dataframe import FLUSH_EVERY
+        from data_preprocessing.fused_pipeline import process_frame
+
+        image = cv2.imdecode(np.frombuffer(png, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("frame could not be decoded")
+        row = process_frame(image, filename, config.HEADER_COORDS, config.BOARD_COORDS)
+
+        with self.lock:
+            if self.dedup is not None:
+                from data_preprocessing.dedup import matrix_hash
+
+                duplicate = self.dedup.check(filename, row["board_hash"], matrix_hash(row["matrix"]))
+                if duplicate:
+                    print(f"🧬 {filename} is a repeated capture of {duplicate[0]}, skipped")
+                    return
+            self.buffer.append(row)
+            if len(self.buffer) >= FLUSH_EVERY:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.buffer:
+                self.writer.write([{c: row[c] for c in self.columns} for row in self.buffer],
+                                  [row["matrix"] for row in self.buffer])
+                self.buffer.clear()
+                # Statistics stay current while the scraper runs
+                self.writer.aggregates.save()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if self.dedup is not None:
+            self.dedup.close()
+
+def main(count=NUM_CAPTURES, start=1, save_dir=SAVE_DIR, adb=None, serial=None, output_csv=None):
+    """
+    Captures the routes from the device and saves them in `save_dir`.
+    If `output_csv` is given, the frames are also processed on the fly and appended to that dataset.
+    """
+
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+    processor = None
+    if output_csv:
+        from data_preprocessing.dedup import DedupIndex
+        processor = FrameProcessor(output_csv, dedup=DedupIndex())
+
+    print(f"📱 Capturing {count} routes...")
+    try:
+        stats = asyncio.run(capture_routes(AdbDevice(adb, serial), count, start=start,
+                                           save_dir=save_dir, on_frame=processor))
+    finally:
+        if processor is not None:
+            processor.close()
+
+    print(f"[✓] {stats['captured']} routes captured in {stats['seconds']:.1f}s "
+          f"({stats['captures_per_sec']:.2f} captures/sec), {stats['errors']} errors")
+    print(f"    capture {stats['capture_seconds']:.1f}s, swipe {stats['swipe_seconds']:.1f}s, "
+          f"write/process {stats['consume_seconds']:.1f}s (overlapped)")
+    return stats
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Capture MoonBoard routes from an Android device")
+    parser.add_argument("--count", type=int, default=NUM_CAPTURES, help="number of routes to capture")
+    parser.add_argument("--start", type=int, default=1, help="index of the first route in the file names")
+    parser.add_argument("--output-dir", default=SAVE_DIR, help="where the screenshots are saved")
+    parser.add_argument("--no-save", action="store_true", help="do not save the screenshots (use with --process)")
+    parser.add_argument("--process", metavar="CSV", default=None,
+                        help="also run the fused pipeline on every frame and append the rows to this dataset")
+    parser.add_argument("--adb", default=None, help="adb command (default: config.ADB_COMMAND)")
+    parser.add_argument("--serial", default=None, help="device serial (default: config.ADB_SERIAL)")
+    args = parser.parse_args()
+    main(count=args.count, start=args.start, save_dir=None if args.no_save else args.output_dir,
+         adb=args.adb, serial=args.serial, output_csv=args.process)
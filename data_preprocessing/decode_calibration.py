@@ -0,0 +1,152 @@
+import time
+import random
+import argparse
+
+import numpy as np
+
+import data_preprocessing.config as config
+from data_preprocessing.fused_pipeline import process_raw_image
+from data_preprocessing.parallel_cropper import DECODE_SCALES
+from data_preprocessing.shards import list_images, image_name
+
+# Fields read from each region of the screenshot
+HEADER_FIELDS = ("grade", "stars", "benchmark")
+BOARD_FIELDS = ("matrix",)
+
+def _process_sample(paths, header_coords, board_coords, header_scale, board_scale):
+    """
+    Processes the sample with the fused pipeline, in this thread.
+    Raises the first error if every screenshot fails (e.g. tesseract is not installed).
+
+    Returns:
+    - (rows by path, None for the failed ones; mean seconds per image; errors by path)
+    """
+    errors = {}
+    # Warm-up: the templates and the benchmark detector of each scale are loaded once per process
+    try:
+        process_raw_image(paths[0], header_coords, board_coords, header_scale=header_scale, board_scale=board_scale)
+    except Exception as e:
+        errors[paths[0]] = e
+
+    rows = {}
+    start = time.perf_counter()
+    for path in paths:
+        if path in errors:
+            rows[path] = None
+            continue
+        try:
+            rows[path] = process_raw_image(path, header_coords, board_coords,
+                                           header_scale=header_scale, board_scale=board_scale)
+        except Exception as e:
+            errors[path] = e
+            rows[path] = None
+    seconds = (time.perf_counter() - start) / len(paths)
+
+    if len(errors) == len(paths):
+        error = next(iter(errors.values()))
+        raise RuntimeError(f"Every screenshot failed with the header at 1/{header_scale} and the board at "
+                           f"1/{board_scale}: {type(error).__name__}: {error}") from error
+    return rows, seconds, errors
+
+def _print_errors(label, errors):
+    if errors:
+        path, error = next(iter(errors.items()))
+        print(f"⚠️ {label}: {len(errors)} screenshots failed, "
+              f"e.g. {image_name(path)}: {type(error).__name__}: {error}")
+
+def _agreement(rows, reference, fields):
+    """
+    Fraction of the screenshots whose fields all equal the full-resolution ones.
+    """
+    same = 0
+    for path, ref in reference.items():
+        row = rows[path]
+        same += row is not None and all(np.array_equal(row[field], ref[field]) for field in fields)
+    return same / len(reference)
+
+def calibrate_decode_scale(input_dir=None, sample=None, scales=None, header_coords=None, board_coords=None,
+                           min_agreement=1.0, seed=0):
+    """
+    Picks the decode scales of the headers and the boards: the smallest images that still give
+    the results of full resolution. A random sample of raw screenshots is processed by the fused
+    pipeline at every scale, and its grades, stars and benchmark flags (header) and matrices
+    (board) are compared with scale 1.
+
+    Parameters:
+    - input_dir: directory or shard set with raw screenshots (default config.RAW_DIR)
+    - sample: number of screenshots compared (default config.CALIBRATION_SAMPLE)
+    - scales: decode scales to try (default all, 1, 2, 4 and 8)
+    - header_coords / board_coords: crop coords at full size (default config.HEADER_COORDS / BOARD_COORDS)
+    - min_agreement: fraction of the screenshots that must give the same results
+    - seed: seed of the sample
+
+    Returns:
+    - ((header scale, board scale), list of dicts with the scale, the ms per image and the number
+      of failed screenshots with only the header or only the board at that scale, and the
+      agreement of every field)
+    """
+    input_dir = input_dir or config.RAW_DIR
+    sample = sample or config.CALIBRATION_SAMPLE
+    scales = sorted(set(scales or DECODE_SCALES) | {1})
+    header_coords = header_coords or config.HEADER_COORDS
+    board_coords = board_coords or config.BOARD_COORDS
+
+    paths = list_images(input_dir)
+    if not paths:
+        raise ValueError(f"No screenshots in {input_dir}")
+    paths = random.Random(seed).sample(paths, min(sample, len(paths)))
+
+    print(f"📏 Calibrating the decode scales on {len(paths)} screenshots...")
+    reference, full_seconds, full_errors = _process_sample(paths, header_coords, board_coords, 1, 1)
+    _print_errors("Full resolution", full_errors)
+    reference = {path: row for path, row in reference.items() if row is not None}
+    if not reference:
+        raise ValueError("None of the sampled screenshots could be processed at full resolution")
+    paths = list(reference)
+
+    # Each region is reduced on its own, the other one stays at full resolution
+    results = []
+    for scale in scales:
+        result = {"scale": scale}
+        for region, fields in (("header", HEADER_FIELDS), ("board", BOARD_FIELDS)):
+            scales_of_run = (scale, 1) if region == "header" else (1, scale)
+            rows, seconds, errors = (reference, full_seconds, {}) if scale == 1 else \
+                _process_sample(paths, header_coords, board_coords, *scales_of_run)
+            _print_errors(f"{region.capitalize()} at 1/{scale}", errors)
+            result[f"{region}_ms"] = seconds * 1000
+            result[f"{region}_errors"] = len(errors)
+            result[region] = _agreement(rows, reference, fields)
+            for field in fields:
+                result[field] = _agreement(rows, reference, (field,))
+        results.append(result)
+
+    # Fewer pixels always cost less once decoded, so the largest accurate scale is the cheapest
+    header_scale = max(r["scale"] for r in results if r["header"] >= min_agreement)
+    board_scale = max(r["scale"] for r in results if r["board"] >= min_agreement)
+
+    columns = HEADER_FIELDS + BOARD_FIELDS
+    print(f"{'scale':>6} {'header ms':>10} {'board ms':>9} " + " ".join(f"{field:>9}" for field in columns)
+          + f" {'errors h / b':>13}")
+    for r in results:
+        print(f"{'1/' + str(r['scale']):>6} {r['header_ms']:10.1f} {r['board_ms']:9.1f} "
+              + " ".join(f"{r[field]:9.1%}" for field in columns)
+              + f" {r['header_errors']:>6} / {r['board_errors']:<4}")
+
+    if (header_scale, board_scale) != (1, 1):
+        _, seconds, _ = _process_sample(paths, header_coords, board_coords, header_scale, board_scale)
+        print(f"⏱️ Header at 1/{header_scale}, board at 1/{board_scale}: {seconds * 1000:.1f} ms per image "
+              f"({full_seconds / seconds:.1f}x faster than full resolution)")
+    print(f"✅ Recommended in config.py: HEADER_DECODE_SCALE = {header_scale}, BOARD_DECODE_SCALE = {board_scale} "
+          f"(currently {config.HEADER_DECODE_SCALE} and {config.BOARD_DECODE_SCALE})")
+    return (header_scale, board_scale), results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the decode scales that match full resolution")
+    parser.add_argument("--input-dir", default=None,
+                        help="raw screenshots, directory or shard set (default: config.RAW_DIR)")
+    parser.add_argument("--sample", type=int, default=None, help="default: config.CALIBRATION_SAMPLE")
+    parser.add_argument("--scales", type=int, nargs="+", choices=DECODE_SCALES, default=None)
+    parser.add_argument("--min-agreement", type=float, default=1.0,
+                        help="fraction of the screenshots that must give the same results (default: 1.0)")
+    args = parser.parse_args()
+    calibrate_decode_scale(args.input_dir, args.sample, args.scales, min_agreement=args.min_agreement)
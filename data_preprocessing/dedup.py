@@ -0,0 +1,207 @@
+import os
+import json
+import hashlib
+from collections import deque
+
+import cv2
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import data_preprocessing.config as config
+from data_preprocessing.executor import run_parallel
+from data_preprocessing.image_to_matrix import board_to_matrix
+from data_preprocessing.matrix_store import pack_matrices
+from data_preprocessing.manifest import config_version
+from data_preprocessing.instrumentation import phase
+from data_preprocessing.parallel_cropper import read_image
+from data_preprocessing.shards import list_images, image_name
+
+# Size of the difference hash: 16 rows of 16 comparisons = 256 bits
+HASH_SIZE = (16, 16)  # (width, height)
+
+REPORT_COLUMNS = ["filename", "duplicate_of", "reason", "distance"]
+
+def board_hash(board):
+    """
+    Perceptual (difference) hash of a board crop: the grayscale board is shrunk to 17x16 and
+    every pixel is compared with its right neighbour. Re-captures of the same screen give the
+    same or a very close hash, whatever small noise or brightness change there is.
+
+    Returns:
+    - the hash as an int of HASH_SIZE[0] * HASH_SIZE[1] bits
+    """
+    gray = cv2.cvtColor(board, cv2.COLOR_BGR2GRAY) if board.ndim == 3 else board
+    width, height = HASH_SIZE
+    small = cv2.resize(gray, (width + 1, height), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), "big")
+
+def matrix_hash(matrix):
+    """
+    Canonical hash of a hold matrix (of its packed bits), equal for equal routes.
+    """
+    return hashlib.blake2b(pack_matrices(matrix[None]).tobytes(), digest_size=8).hexdigest()
+
+def hash_board_file(image_path):
+    """
+    Reads a board crop and returns (board hash, matrix hash).
+    """
+    with phase("decode"):
+        board = read_image(image_path)
+    if board is None:
+        raise ValueError(f"Image could not be read: {image_path}")
+    with phase("hash"):
+        return board_hash(board), matrix_hash(board_to_matrix(board))
+
+class DedupIndex:
+    """
+    On-disk index of the boards seen so far, stored as JSON lines {"version", "file", "board", "matrix"}.
+    A board is a duplicate when:
+    - its perceptual hash is within `max_distance` bits of one of the last `window` boards and
+      their hold matrices are equal ("near_identical": the swipe did not register or the app
+      lagged). The perceptual hash alone is not enough: every screenshot shows the same board
+      behind the hold rings, so different routes get close hashes, or
+    - its hold matrix was already seen anywhere in the corpus ("same_matrix").
+
+    Only the hashes are stored; the decisions are replayed on load, so changing the thresholds
+    takes effect without hashing the images again. Entries of another config version
+    (board crop or hold colours) are ignored.
+
+    Parameters:
+    - path: index file (default config.DEDUP_INDEX)
+    - max_distance: Hamming distance under which two boards are near-identical (default config.DEDUP_MAX_DISTANCE)
+    - window: how many previous captures a board is compared with (default config.DEDUP_WINDOW)
+    """
+
+    def __init__(self, path=None, max_distance=None, window=None):
+        self.path = path or config.DEDUP_INDEX
+        self.max_distance = config.DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+        self.version = config_version("dedup", config.BOARD_COORDS, config.HOLD_HSV_RANGES,
+                                      config.HOLD_MIN_CELL_FRACTION)
+        self.decisions = {}
+        self._recent = deque(maxlen=window or config.DEDUP_WINDOW)
+        self._matrices = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Truncated last line after a crash
+                    if entry.get("version") == self.version and entry["file"] not in self.decisions:
+                        self._decide(entry["file"], int(entry["board"], 16), entry["matrix"])
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def __contains__(self, filename):
+        return filename in self.decisions
+
+    def __len__(self):
+        return len(self.decisions)
+
+    def _decide(self, filename, board, matrix):
+        decision = None
+        for other, other_board, other_matrix in reversed(self._recent):
+            distance = bin(board ^ other_board).count("1")
+            if distance <= self.max_distance and other_matrix == matrix:
+                decision = (other, "near_identical", distance)
+                break
+        if decision is None and matrix in self._matrices:
+            decision = (self._matrices[matrix], "same_matrix", None)
+
+        self._recent.append((filename, board, matrix))
+        if decision is None:
+            self._matrices[matrix] = filename
+        self.decisions[filename] = decision
+        return decision
+
+    def check(self, filename, board, matrix):
+        """
+        Adds a board to the index.
+
+        Parameters:
+        - filename: board (screenshot) file name
+        - board: perceptual hash from `board_hash`
+        - matrix: hash from `matrix_hash`
+
+        Returns:
+        - None if the board is new, else (duplicate_of, reason, distance)
+        """
+        if filename in self.decisions:
+            return self.decisions[filename]
+        decision = self._decide(filename, board, matrix)
+        self._file.write(json.dumps({
+            "version": self.version, "file": filename, "board": format(board, "x"), "matrix": matrix,
+        }) + "\n")
+        return decision
+
+    def duplicates(self):
+        """
+        Returns {filename: (duplicate_of, reason, distance)} of every duplicate in the index.
+        """
+        return {filename: decision for filename, decision in self.decisions.items() if decision}
+
+    def write_report(self, report_path=None):
+        """
+        Saves the list of dropped boards as a CSV (default config.DEDUP_REPORT).
+        """
+        report_path = report_path or config.DEDUP_REPORT
+        rows = [(filename, *decision) for filename, decision in self.duplicates().items()]
+        pd.DataFrame(rows, columns=REPORT_COLUMNS).to_csv(report_path, index=False)
+        return report_path
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def dedup_boards(board_dir, index=None, report_path=None, backend=None, max_workers=None, metrics=None):
+    """
+    Hashes the board crops not yet in the index (in capture order) and flags repeated captures,
+    so they can be skipped before OCR.
+
+    Parameters:
+    - board_dir: directory or shard set with the cropped boards
+    - index: `DedupIndex` (default: one at config.DEDUP_INDEX)
+    - report_path: CSV listing the dropped boards (default config.DEDUP_REPORT)
+    - backend: "thread" or "process" (default config.EXECUTOR_BACKEND)
+    - max_workers: number of workers (default config.NUM_WORKERS)
+    - metrics: optional `instrumentation.StageMetrics` to record timings and errors in
+
+    Returns:
+    - set of the file names to skip
+    """
+
+    own_index = index is None
+    index = DedupIndex() if own_index else index
+
+    paths = [item for item in list_images(board_dir) if image_name(item) not in index]
+    print(f"🧬 Hashing {len(paths)} new boards ({len(index)} already indexed)...")
+
+    # Ordered, so "near_identical" compares each capture with the ones right before it
+    outputs = run_parallel(hash_board_file, paths, backend=backend, max_workers=max_workers, ordered=True,
+                           metrics=metrics)
+    for path, hashes, error in tqdm(outputs, total=len(paths), desc="Dedup"):
+        if error:
+            print(f"⚠️ Error con {image_name(path)}: {error}")
+            continue
+        index.check(image_name(path), *hashes)
+    index.flush()
+
+    duplicates = index.duplicates()
+    report_path = index.write_report(report_path)
+    if own_index:
+        index.close()
+
+    print(f"✅ {len(duplicates)} duplicate boards skipped, report saved in: {report_path}")
+    return set(duplicates)
@@ -0,0 +1,350 @@
+import os
+import time
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+import data_preprocessing.config as config
+import data_preprocessing.instrumentation as instrumentation
+
+BACKENDS = ("thread", "process")
+
+# Backend or number of workers chosen at runtime by `ConcurrencyController`
+AUTO = "auto"
+
+def resolve_workers(max_workers=None):
+    """
+    Returns the number of workers to use: `max_workers`, else config.NUM_WORKERS, else one per core
+    ("auto" counts as one per core, the starting point of the autotuner).
+    """
+    workers = max_workers or config.NUM_WORKERS
+    if not workers or workers == AUTO:
+        workers = os.cpu_count() or 1
+    return max(1, int(workers))
+
+def stage_executor(stage, backend=None, max_workers=None):
+    """
+    Backend and number of workers of a pipeline stage: the given ones, else the settings pinned
+    for the stage in config.STAGE_EXECUTORS; None leaves the defaults of `run_parallel`.
+
+    Returns:
+    - (backend, max_workers)
+    """
+    pinned_backend, pinned_workers = config.STAGE_EXECUTORS.get(stage, (None, None))
+    return backend or pinned_backend, max_workers or pinned_workers
+
+class ConcurrencyController:
+    """
+    Chooses the parallelism of a `run_parallel` call while it runs, from the measured throughput
+    (images/sec) and per-image latency of every window of `window` seconds.
+
+    - With several backends, each one is tried for a window first ("placement" probe) and the
+      fastest one is kept; the other pool gets no more work.
+    - With `adapt`, the number of images in flight (the busy workers) then climbs or falls:
+      the step doubles in the same direction while throughput improves by more than `tolerance`,
+      turns back and halves when it drops, and halves towards fewer workers when it is flat.
+      An I/O-bound stage ends with many workers, a CPU-bound one near the number of cores.
+
+    Parameters:
+    - backends: backends to try, in order
+    - initial: starting number of workers
+    - maximum: largest number of workers (size of the pools)
+    - adapt: if False, the number of workers stays `initial`
+    - window: seconds per measurement (default config.AUTOTUNE_WINDOW)
+    - tolerance: relative change of throughput treated as noise (default config.AUTOTUNE_TOLERANCE)
+    """
+
+    def __init__(self, backends, initial, maximum, adapt=True, window=None, tolerance=None):
+        self.backends = list(backends)
+        self.backend = self.backends[0]
+        self.initial = max(1, min(initial, maximum))
+        self.limit = self.initial
+        self.maximum = maximum
+        self.adapt = adapt
+        self.window = window or config.AUTOTUNE_WINDOW
+        self.tolerance = config.AUTOTUNE_TOLERANCE if tolerance is None else tolerance
+        self.history = []
+        self.retired = []
+        self._best = {}
+        self._last_rate = None
+        self._direction = 1
+        self._step = max(1, self.initial // 2)
+        self._reset()
+
+    def _reset(self):
+        # The window starts at the first image finished with the new settings
+        self._start = None
+        self._count = 0
+        self._latencies = []
+
+    def record(self, count, seconds):
+        """
+        Records a chunk of `count` images finished `seconds` after it was submitted.
+        """
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = now
+            return
+        self._count += count
+        self._latencies.append(seconds / max(1, count))
+        if now - self._start >= self.window and self._count >= self.limit:
+            self._next(self._count / (now - self._start))
+
+    def _next(self, rate):
+        self.history.append({"backend": self.backend, "workers": self.limit, "images_per_sec": rate,
+                             "p50_ms": float(np.median(self._latencies)) * 1000})
+        best = self._best.get(self.backend)
+        if best is None or rate > best[0]:
+            self._best[self.backend] = (rate, self.limit)
+        self._reset()
+
+        untried = [backend for backend in self.backends if backend not in self._best]
+        if untried:
+            self.backend, self.limit = untried[0], self.initial
+            return
+        if len(self.backends) > 1 and not self.retired:
+            self.backend = max(self._best, key=lambda backend: self._best[backend][0])
+            self.retired = [backend for backend in self.backends if backend != self.backend]
+            self.limit = self._best[self.backend][1]
+            self._last_rate = self._best[self.backend][0]
+            return
+        if not self.adapt:
+            return
+
+        if self._last_rate is not None:
+            if rate < self._last_rate * (1 - self.tolerance):
+                self._direction, self._step = -self._direction, max(1, self._step // 2)
+            elif rate < self._last_rate * (1 + self.tolerance):
+                self._direction, self._step = -1, max(1, self._step // 2)
+            else:
+                # At most +50% / -33% per window, so one noisy window cannot undo the climb
+                self._step = min(2 * self._step, max(1, self.limit // 2))
+        self._last_rate = rate
+        limit = min(self.maximum, max(1, self.limit + self._direction * self._step))
+        if limit == self.limit:
+            self._direction, self._step = -self._direction, max(1, self._step // 2)
+            limit = min(self.maximum, max(1, self.limit + self._direction * self._step))
+        self.limit = limit
+
+    def settings(self):
+        """
+        The best measured settings.
+
+        Returns:
+        - dict with backend, workers, images_per_sec and p50_ms, or None before the first window
+        """
+        if not self._best:
+            return None
+        backend = max(self._best, key=lambda backend: self._best[backend][0])
+        rate, workers = self._best[backend]
+        p50 = next(h["p50_ms"] for h in self.history
+                   if h["backend"] == backend and h["workers"] == workers and h["images_per_sec"] == rate)
+        return {"backend": backend, "workers": workers, "images_per_sec": rate, "p50_ms": p50}
+
+# Environment variables read by OpenMP (tesseract)
+_THREAD_VARIABLES = ("OMP_THREAD_LIMIT", "OMP_NUM_THREADS")
+
+def pin_native_threads(threads):
+    """
+    Limits the internal threading of OpenCV and tesseract (OpenMP) for the current process.
+    Tesseract runs as a subprocess, so the limit is passed through the environment.
+
+    Parameters:
+    - threads: number of threads each library may use
+
+    Returns:
+    - the previous settings, for `restore_native_threads`
+    """
+    import cv2
+
+    previous = ({name: os.environ.get(name) for name in _THREAD_VARIABLES}, cv2.getNumThreads())
+    threads = str(max(1, int(threads)))
+    for name in _THREAD_VARIABLES:
+        os.environ[name] = threads
+    cv2.setNumThreads(int(threads))
+    return previous
+
+def restore_native_threads(previous):
+    """
+    Undoes `pin_native_threads` with the settings it returned.
+    """
+    import cv2
+
+    variables, cv2_threads = previous
+    for name, value in variables.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+    cv2.setNumThreads(cv2_threads)
+
+def _init_worker(threads, profile=False):
+    pin_native_threads(threads)
+    if profile:
+        instrumentation.start_profiler()
+
+def _run_chunk(func, chunk, submitted_at=None):
+    """
+    Applies `func` to every (index, item) of a chunk inside a worker.
+    Errors are returned instead of raised so one bad image does not abort the whole chunk.
+
+    When `submitted_at` (wall clock time of the submission) is given, every item is also
+    instrumented: its time, queue wait and phases (see `instrumentation.phase`) are returned
+    as a fifth element, and the profiler samples taken by the worker are returned with the chunk.
+    """
+    results = []
+    for index, item in chunk:
+        timing = None
+        if submitted_at is not None:
+            wait = time.time() - submitted_at
+            instrumentation.begin_record()
+            start = time.perf_counter()
+        try:
+            result, error = func(item), None
+        except Exception as e:
+            result, error = None, e
+        if submitted_at is not None:
+            timing = (time.perf_counter() - start, wait, instrumentation.end_record())
+        results.append((index, item, result, error, timing))
+
+    samples = instrumentation.take_samples() if submitted_at is not None else None
+    return results, samples
+
+def _chunks(items, chunk_size):
+    iterator = enumerate(items)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def run_parallel(func, items, backend=None, max_workers=None, chunk_size=None, max_pending=None, ordered=False,
+                 metrics=None):
+    """
+    Applies `func` to every item using a thread or process pool with bounded, chunked submission.
+    Only `max_pending` chunks are in flight at any time, so memory stays flat regardless of
+    how many items there are, and `items` may be a lazy iterator.
+
+    Parameters:
+    - func: picklable function of one argument (use functools.partial for extra arguments)
+    - items: iterable of inputs
+    - backend: "thread", "process", or "auto" to measure both and keep the faster one
+      (default config.EXECUTOR_BACKEND)
+    - max_workers: number of workers, or "auto" to adapt it to the measured throughput (see
+      `ConcurrencyController`; default config.NUM_WORKERS or one per core)
+    - chunk_size: items sent to a worker at once (default config.CHUNK_SIZE, 1 with "auto" workers)
+    - max_pending: chunks in flight (default twice the number of workers)
+    - ordered: if True, results are yielded in input order
+    - metrics: optional `instrumentation.StageMetrics`; every item is timed (total, queue wait
+      and phases) and recorded there, with profiler samples if `metrics.profile` is set
+
+    Yields:
+    - (item, result, error) tuples; `error` is the raised exception or None
+    """
+
+    backend = backend or config.EXECUTOR_BACKEND
+    if backend not in BACKENDS and backend != AUTO:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS + (AUTO,)}")
+
+    auto_workers = (max_workers or config.NUM_WORKERS) == AUTO
+    workers = resolve_workers(max_workers)
+    chunk_size = max(1, chunk_size or (1 if auto_workers else config.CHUNK_SIZE))
+    max_pending = max(1, max_pending or 2 * workers)
+    profile = metrics is not None and metrics.profile
+
+    # Every worker gets its share of the cores, so workers x native threads ~= cores
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    controller = None
+    if auto_workers or backend == AUTO:
+        # Pools sized for the largest setting; the controller decides how many chunks are in flight
+        maximum = max(workers, config.AUTOTUNE_MAX_WORKERS or max(32, 4 * (os.cpu_count() or 1))) if auto_workers \
+            else workers
+        controller = ConcurrencyController(BACKENDS if backend == AUTO else (backend,), workers, maximum,
+                                           adapt=auto_workers)
+        workers = maximum
+
+    executors = {}
+    pinned = []
+
+    def executor_for(name):
+        if name not in executors:
+            if name == "process":
+                executors[name] = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                      initargs=(threads_per_worker, profile))
+            else:
+                # Threads share the process, so OpenCV/tesseract are pinned here until the run ends
+                pinned.append(pin_native_threads(threads_per_worker))
+                if profile:
+                    instrumentation.start_profiler()
+                executors[name] = ThreadPoolExecutor(max_workers=workers)
+        return executors[name]
+
+    def collect(chunk_results):
+        results, samples = chunk_results
+        if metrics is not None:
+            for _, item, _, error, (seconds, wait, phases) in results:
+                metrics.record(item, seconds, wait, phases, error)
+            metrics.add_samples(samples)
+        return results
+
+    chunks = _chunks(items, chunk_size)
+    pending = {}
+    finished = {}
+    submitted = 0
+    next_chunk = 0
+
+    try:
+        while True:
+            # Keep at most `max_pending` chunks in flight (or buffered, when ordered)
+            limit = controller.limit if controller is not None else max_pending
+            current = controller.backend if controller is not None else backend
+            in_window = submitted - next_chunk if ordered else len(pending)
+            while in_window < limit:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                submitted_at = time.time() if metrics is not None else None
+                future = executor_for(current).submit(_run_chunk, func, chunk, submitted_at)
+                pending[future] = (submitted, time.perf_counter(), len(chunk))
+                submitted += 1
+                in_window += 1
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk_id, started, count = pending.pop(future)
+                finished[chunk_id] = collect(future.result())
+                if controller is not None:
+                    controller.record(count, time.perf_counter() - started)
+            if controller is not None:
+                for name in controller.retired:
+                    # The losing pool finishes its chunks in flight and takes no new ones
+                    if name in executors:
+                        executors.pop(name).shutdown(wait=False)
+
+            if ordered:
+                while next_chunk in finished:
+                    for index, item, result, error, _ in finished.pop(next_chunk):
+                        yield item, result, error
+                    next_chunk += 1
+            else:
+                for chunk_id in list(finished):
+                    for index, item, result, error, _ in finished.pop(chunk_id):
+                        yield item, result, error
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+        if pinned:
+            restore_native_threads(pinned[0])
+
+    if controller is not None:
+        settings = controller.settings()
+        if metrics is not None:
+            metrics.executor = settings
+        if settings is not None:
+            print(f"🎛️ Autotune: {settings['backend']} backend with {settings['workers']} workers, "
+                  f"{settings['images_per_sec']:.1f} images/s (p50 {settings['p50_ms']:.1f} ms)")
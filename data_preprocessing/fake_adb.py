@@ -0,0 +1,60 @@
+# Fake adb device serving canned screenshots, to test the capture engine without a phone:
+#
+#   python -m data_preprocessing.data_scrapper --count 100 \
+#       --adb "python -m data_preprocessing.fake_adb --frames perf_corpus/raw"
+#
+# `exec-out screencap -p` writes the current frame to stdout and `shell input swipe ...`
+# moves to the next one. The current frame index is kept in a small state file.
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+
+def _state_path(frames_dir):
+    key = hashlib.md5(os.path.abspath(frames_dir).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"fake_adb_{key}.state")
+
+def _read_index(state):
+    try:
+        with open(state) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake adb device serving canned PNGs")
+    parser.add_argument("--frames", required=True, help="directory with the PNGs served as screenshots")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every command takes")
+    parser.add_argument("--reset", action="store_true", help="go back to the first frame")
+    parser.add_argument("-s", dest="serial", default=None, help="ignored, accepted like adb")
+    args, command = parser.parse_known_args(argv)
+
+    frames = sorted(f for f in os.listdir(args.frames) if f.lower().endswith(".png"))
+    if not frames:
+        print(f"no PNG in {args.frames}", file=sys.stderr)
+        return 1
+    state = _state_path(args.frames)
+    if args.reset:
+        with open(state, "w") as f:
+            f.write("0")
+    if args.latency:
+        time.sleep(args.latency)
+
+    index = _read_index(state)
+    if command[:3] == ["exec-out", "screencap", "-p"]:
+        with open(os.path.join(args.frames, frames[index % len(frames)]), "rb") as f:
+            sys.stdout.buffer.write(f.read())
+        sys.stdout.buffer.flush()
+    elif command[:3] == ["shell", "input", "swipe"]:
+        with open(state, "w") as f:
+            f.write(str(index + 1))
+    elif command:
+        print(f"fake adb: unsupported command: {' '.join(command)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
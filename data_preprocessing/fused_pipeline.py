@@ -0,0 +1,167 @@
+import os
+import cv2
+import pandas as pd
+from functools import partial
+from tqdm import tqdm
+
+import data_preprocessing.config as config
+from data_preprocessing.executor import run_parallel
+from data_preprocessing.parallel_cropper import crop_region, read_image, reduce_image, scale_coords
+from data_preprocessing.ocr_parallel_extractor import analyze_header, print_grade_flags
+from data_preprocessing.image_to_matrix import board_to_matrix
+from data_preprocessing.build_dataframe import FINAL_COLUMNS, FLUSH_EVERY
+from data_preprocessing.matrix_store import DatasetWriter, MATRIX_SHAPE
+from data_preprocessing.instrumentation import phase
+from data_preprocessing.dedup import board_hash, matrix_hash
+from data_preprocessing.shards import list_images, image_name
+
+def process_raw_image(image_path, header_coords, board_coords, header_dir=None, board_dir=None,
+                      header_scale=None, board_scale=None):
+    """
+    Decodes one raw screenshot a single time and extracts a full dataset row from it.
+    The header and board regions are sliced as views of the decoded image, so no
+    intermediate PNG is written or read back.
+
+    Parameters:
+    - image_path: path to the raw screenshot, or `shards.ShardRecord`
+    - header_coords: tuple (y1, y2, x1, x2) of the header region
+    - board_coords: tuple (y1, y2, x1, x2) of the board region
+    - header_dir: if given, the header crop is also saved there (debug output)
+    - board_dir: if given, the board crop is also saved there (debug output)
+    - header_scale / board_scale: the regions are analysed at 1/scale of their size (default
+      config.HEADER_DECODE_SCALE / BOARD_DECODE_SCALE); the screenshot is decoded at the
+      smaller of the two scales and the other region is shrunk further
+
+    Returns:
+    - A dictionary with the FINAL_COLUMNS ('filename', 'grade', 'benchmark', 'stars', 'grade_code',
+      'grade_flag', 'raw_grade'), 'matrix' (numpy array of shape [18, 11, 3]) and 'board_hash' (see `dedup.board_hash`),
+      or None if the image could not be read
+    """
+
+    header_scale = header_scale or config.HEADER_DECODE_SCALE
+    board_scale = board_scale or config.BOARD_DECODE_SCALE
+    scale = min(header_scale, board_scale)
+    with phase("decode"):
+        image = read_image(image_path, scale)
+    if image is None:
+        print(f"⚠️ Could not load image: {image_name(image_path)}")
+        return None
+
+    return process_frame(image, image_name(image_path), header_coords, board_coords, header_dir, board_dir,
+                         scale, header_scale, board_scale)
+
+def process_frame(image, filename, header_coords, board_coords, header_dir=None, board_dir=None, image_scale=1,
+                  header_scale=None, board_scale=None):
+    """
+    Same as `process_raw_image` for a screenshot already decoded in memory (e.g. a frame
+    streamed from the device by `data_scrapper`). The coords are those of the full-size
+    screenshot and `image_scale` tells how much `image` was already reduced. The saved crops
+    are at the scale they are analysed at.
+    """
+
+    header_scale = max(header_scale or config.HEADER_DECODE_SCALE, image_scale)
+    board_scale = max(board_scale or config.BOARD_DECODE_SCALE, image_scale)
+    with phase("resize"):
+        header = reduce_image(crop_region(image, scale_coords(header_coords, image_scale)),
+                              header_scale // image_scale)
+        board = reduce_image(crop_region(image, scale_coords(board_coords, image_scale)),
+                             board_scale // image_scale)
+
+    with phase("write"):
+        if header_dir:
+            cv2.imwrite(os.path.join(header_dir, filename), header)
+        if board_dir:
+            cv2.imwrite(os.path.join(board_dir, filename), board)
+
+    row = analyze_header(header, filename, header_scale)
+    matrix = board_to_matrix(board)
+    if matrix.shape != MATRIX_SHAPE:
+        raise ValueError(f"Invalid matrix for {filename}: shape {matrix.shape}")
+
+    row["matrix"] = matrix
+    row["board_hash"] = board_hash(board)
+    return row
+
+def run_fused_pipeline(input_dir, output_csv, header_coords, board_coords, header_dir=None, board_dir=None,
+                       backend=None, max_workers=None, manifest=None, metrics=None, dedup=None):
+    """
+    Runs the whole pipeline (crop, OCR, stars, benchmark, matrix) in a single pass over
+    the raw screenshots and saves the final dataset CSV.
+
+    Parameters:
+    - input_dir: directory or shard set with original screenshots
+    - output_csv: path of the final CSV (same columns and packed matrices as `build_csv`)
+    - header_coords: tuple (y1, y2, x1, x2) of the header region
+    - board_coords: tuple (y1, y2, x1, x2) of the board region
+    - header_dir: optional directory to also save header crops (debugging only)
+    - board_dir: optional directory to also save board crops (debugging only)
+    - backend: "thread" or "process" (default config.EXECUTOR_BACKEND)
+    - max_workers: number of workers (default config.NUM_WORKERS)
+    - manifest: optional `Manifest`; screenshots already in `output_csv` are skipped and new
+      rows are appended, otherwise the dataset is rewritten
+    - metrics: optional `instrumentation.StageMetrics` to record timings and errors in
+    - dedup: optional `dedup.DedupIndex`; repeated captures are left out of the dataset
+
+    Returns:
+    - pandas.DataFrame with the rows processed in this run (without the matrices)
+    """
+
+    for directory in (header_dir, board_dir):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    image_paths = list_images(input_dir)
+
+    if manifest is not None:
+        image_paths = manifest.pending(image_paths)
+        print(f"⏭️ {len(manifest)} screenshots already processed, {len(image_paths)} new or changed.")
+
+    print(f"⚡ Processing {len(image_paths)} screenshots in a single pass...")
+
+    process = partial(
+        process_raw_image,
+        header_coords=header_coords,
+        board_coords=board_coords,
+        header_dir=header_dir,
+        board_dir=board_dir,
+    )
+
+    writer = DatasetWriter(output_csv, FINAL_COLUMNS, append=manifest is not None, aggregates=True)
+    data = []
+    buffer = []
+
+    def flush():
+        writer.write([row for _, row in buffer], [row["matrix"] for _, row in buffer])
+        if manifest is not None:
+            for path, _ in buffer:
+                manifest.mark_done(path)
+            manifest.flush()
+        buffer.clear()
+
+    # Ordered, so the dedup window sees the captures in sequence and the rows keep capture order
+    outputs = run_parallel(process, image_paths, backend=backend, max_workers=max_workers, ordered=True,
+                           metrics=metrics)
+    for path, row, error in tqdm(outputs, total=len(image_paths), desc="Fused"):
+        if error:
+            print(f"⚠️ Error con {image_name(path)}: {error}")
+        elif row and dedup is not None and dedup.check(row["filename"], row["board_hash"], matrix_hash(row["matrix"])):
+            # Repeated capture: nothing to write, but done for the manifest
+            if manifest is not None:
+                manifest.mark_done(path)
+        elif row:
+            buffer.append((path, row))
+            data.append({column: row[column] for column in FINAL_COLUMNS})
+            if len(buffer) >= FLUSH_EVERY:
+                flush()
+        elif metrics is not None:
+            metrics.add_error(image_name(path), "unreadable")
+    flush()
+    writer.close()
+    if dedup is not None:
+        dedup.flush()
+        print(f"🧬 {len(dedup.duplicates())} duplicate captures skipped, report saved in: {dedup.write_report()}")
+
+    print(f"✅ CSV guardado en: {output_csv}")
+    data = pd.DataFrame(data, columns=FINAL_COLUMNS)
+    print_grade_flags(data)
+    return data
@@ -0,0 +1,252 @@
+import os
+import re
+import cv2
+import numpy as np
+
+import data_preprocessing.config as config
+from data_preprocessing.instrumentation import phase
+from data_preprocessing.ocr_cache import ocr_data, cached_ocr_data
+
+# Size every grade word is normalized to before matching
+TEMPLATE_SIZE = (96, 24)  # (width, height)
+
+# Tesseract options of the header OCR (part of the cache key, see `ocr_cache.ocr_data`)
+TESSERACT_HEADER_CONFIG = ""
+
+_templates = None
+
+def binarize(header):
+    """
+    Returns a binary image of the header where text pixels are 255, whatever the theme.
+    """
+    gray = cv2.cvtColor(header, cv2.COLOR_BGR2GRAY) if header.ndim == 3 else header
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Text is the minority class; invert light-on-dark headers
+    if cv2.countNonZero(binary) > binary.size // 2:
+        binary = cv2.bitwise_not(binary)
+    return binary
+
+def text_lines(binary, min_height=4):
+    """
+    Finds the text lines of a binary image with a horizontal projection.
+
+    Returns:
+    - list of (y1, y2) row bands, top to bottom
+    """
+    ink = np.count_nonzero(binary, axis=1) > 0
+    lines = []
+    start = None
+    for y, has_ink in enumerate(ink):
+        if has_ink and start is None:
+            start = y
+        elif not has_ink and start is not None:
+            if y - start >= min_height:
+                lines.append((start, y))
+            start = None
+    if start is not None and len(ink) - start >= min_height:
+        lines.append((start, len(ink)))
+    return lines
+
+def line_words(binary, line):
+    """
+    Splits one text line into words with a vertical projection. The blank column runs are
+    split in two groups (letter gaps and word gaps) at the largest jump between their widths.
+
+    Returns:
+    - list of (x1, y1, x2, y2) boxes, left to right
+    """
+    y1, y2 = line
+    ink = np.count_nonzero(binary[y1:y2], axis=0) > 0
+    columns = np.flatnonzero(ink)
+    if len(columns) == 0:
+        return []
+
+    # Blank runs between inked columns
+    gaps = np.diff(columns) - 1
+    widths = np.unique(gaps[gaps > 0])
+    if len(widths) >= 2:
+        jump = np.argmax(np.diff(widths))
+        threshold = (widths[jump] + widths[jump + 1]) / 2
+    else:
+        threshold = np.inf
+
+    breaks = np.flatnonzero(gaps > threshold)
+    starts = np.concatenate(([columns[0]], columns[breaks + 1]))
+    ends = np.concatenate((columns[breaks], [columns[-1]])) + 1
+    return [(int(x1), y1, int(x2), y2) for x1, x2 in zip(starts, ends)]
+
+def grade_word(header, binary=None):
+    """
+    Locates the grade word ("7A+/V7") of a header: word config.GRADE_WORD_INDEX of
+    text line config.GRADE_LINE_INDEX, the same line tesseract used to return as `lines[2]`.
+
+    Returns:
+    - (word image, line box) as binary crops, or (None, line box) / (None, None) when not found
+    """
+    binary = binarize(header) if binary is None else binary
+    lines = text_lines(binary)
+    if len(lines) <= config.GRADE_LINE_INDEX:
+        return None, None
+
+    line = lines[config.GRADE_LINE_INDEX]
+    words = line_words(binary, line)
+    if len(words) <= config.GRADE_WORD_INDEX:
+        return None, line
+
+    x1, y1, x2, y2 = words[config.GRADE_WORD_INDEX]
+    return binary[y1:y2, x1:x2], line
+
+def normalize_word(word):
+    """
+    Resizes a binary word crop to TEMPLATE_SIZE as float32 in [0, 1].
+    """
+    return cv2.resize(word, TEMPLATE_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+
+def load_templates(path=None):
+    """
+    Loads (and caches for the lifetime of the process) the grade templates built by
+    `build_grade_templates`.
+
+    Returns:
+    - (labels, templates) with templates of shape (G, height, width), or None if missing
+    """
+    global _templates
+    path = path or config.GRADE_TEMPLATES
+    if _templates is None or _templates[0] != path:
+        if os.path.exists(path):
+            data = np.load(path)
+            _templates = (path, ([str(label) for label in data["labels"]], data["templates"].astype(np.float32)))
+        else:
+            _templates = (path, None)
+    return _templates[1]
+
+def match_grade(word, templates):
+    """
+    Matches a grade word against the templates with normalized correlation.
+
+    Returns:
+    - (grade, confidence) where confidence is the best correlation, or 0 when there are no
+      templates or the second best candidate is within config.GRADE_MATCH_MARGIN
+    """
+    if word is None or templates is None:
+        return None, 0.0
+
+    labels, stack = templates
+    sample = normalize_word(word)
+    sample = sample - sample.mean()
+    refs = stack - stack.mean(axis=(1, 2), keepdims=True)
+    denom = np.sqrt((refs ** 2).sum(axis=(1, 2)) * (sample ** 2).sum()) + 1e-6
+    scores = (refs * sample).sum(axis=(1, 2)) / denom
+
+    order = np.argsort(scores)[::-1]
+    best = float(scores[order[0]])
+    margin = best - float(scores[order[1]]) if len(order) > 1 else best
+    confidence = best if margin >= config.GRADE_MATCH_MARGIN else 0.0
+    return labels[order[0]], confidence
+
+def parse_grade(text):
+    """
+    Keeps the Font grade of a recognized word ("7A+/V7" -> "7A+").
+    """
+    return re.sub(r"/.*", "", text.strip().replace(" ", ""))
+
+def grade_from_ocr(result):
+    """
+    Picks the grade of a header from the tesseract output (see `ocr_cache.ocr_data`): word
+    config.GRADE_WORD_INDEX of line config.GRADE_LINE_INDEX ("Grade: User 7A+/V7 ..." -> "7A+"),
+    or the whole line when it has fewer words. Cheap, so it is redone from the cache by
+    `ocr_parallel_extractor.rederive_metadata` when the choice changes.
+
+    Returns:
+    - the raw grade text, "unknown" when the header has too few lines
+    """
+    lines = result["lines"]
+    if len(lines) <= config.GRADE_LINE_INDEX:
+        return "unknown"
+    text = lines[config.GRADE_LINE_INDEX]["text"]
+    words = text.split()
+    return parse_grade(words[config.GRADE_WORD_INDEX]) if len(words) > config.GRADE_WORD_INDEX else text
+
+def recognize_grade(header):
+    """
+    Recognizes the grade of a header without running tesseract when possible:
+    1. the grade word is located and matched against the cached templates;
+    2. if the confidence is low, tesseract reads the whole header and the grade is picked from
+       its lines (`grade_from_ocr`). The tesseract output of every header is cached by the
+       hash of the header (see `ocr_cache.ocr_data`), so it runs once per header.
+
+    Parameters:
+    - header: header image (BGR format)
+
+    Returns:
+    - (grade, confidence, method) with method "template" or "tesseract"
+    """
+    binary = binarize(header)
+    word, _ = grade_word(header, binary)
+
+    grade, confidence = match_grade(word, load_templates())
+    if grade is not None and confidence >= config.GRADE_MATCH_THRESHOLD:
+        return grade, confidence, "template"
+
+    return grade_from_ocr(ocr_data(header, TESSERACT_HEADER_CONFIG)), confidence, "tesseract"
+
+def rederive_grade(header):
+    """
+    Picks the grade again from the cached tesseract output of a header, without running tesseract.
+
+    Returns:
+    - the raw grade text, or None if the header was never read by tesseract
+    """
+    result = cached_ocr_data(header, TESSERACT_HEADER_CONFIG)
+    return None if result is None else grade_from_ocr(result)
+
+def build_grade_templates(header_dir, metadata_csv, output_path=None, per_grade=50):
+    """
+    Builds the grade templates from headers whose grade is already known (e.g. a metadata CSV
+    produced with tesseract): the grade words of up to `per_grade` headers per grade are averaged.
+
+    Parameters:
+    - header_dir: directory or shard set with the cropped headers
+    - metadata_csv: CSV with 'filename' and 'grade' columns
+    - output_path: where to save the templates (default config.GRADE_TEMPLATES)
+    - per_grade: maximum number of samples averaged per grade
+
+    Returns:
+    - list of grades that got a template
+    """
+    import pandas as pd
+    from data_preprocessing.parallel_cropper import read_image
+    from data_preprocessing.shards import image_lookup
+
+    output_path = output_path or config.GRADE_TEMPLATES
+    metadata = pd.read_csv(metadata_csv)
+    grades = (
+        metadata["grade"].astype(str)
+        .str.replace("Grade: User ", "", regex=False)
+        .str.replace(r" Setter.*", "", regex=True)
+        .map(parse_grade)
+    )
+
+    images = image_lookup(header_dir)
+    samples = {}
+    for filename, grade in zip(metadata["filename"], grades):
+        if grade not in config.GRADE_VOCABULARY or len(samples.get(grade, [])) >= per_grade:
+            continue
+        header = read_image(images[filename]) if filename in images else None
+        if header is None:
+            continue
+        word, _ = grade_word(header)
+        if word is not None:
+            samples.setdefault(grade, []).append(normalize_word(word))
+
+    labels = [grade for grade in config.GRADE_VOCABULARY if grade in samples]
+    if not labels:
+        raise ValueError(f"No header in {metadata_csv} has a valid grade to build templates from")
+    templates = np.stack([np.mean(samples[grade], axis=0) for grade in labels])
+    np.savez_compressed(output_path, labels=np.array(labels), templates=templates)
+
+    global _templates
+    _templates = None
+    print(f"✅ {len(labels)} grade templates saved in: {output_path}")
+    return labels
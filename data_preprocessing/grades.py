@@ -0,0 +1,145 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import data_preprocessing.config as config
+from data_preprocessing.manifest import config_version
+
+# Fontainebleau-style grades (e.g. 6A, 7B+, 8C)
+VALID_GRADE_PATTERN = r'^[4-9][A-Ca-c]\+?$'
+
+# How a grade was read: in config.GRADE_VOCABULARY as is, fixed by config.GRADE_CORRECTIONS or by
+# uppercasing its letter, fixed by config.GRADE_CONFUSIONS, a valid grade outside of the vocabulary
+# (e.g. "6B"), or not a grade
+GRADE_FLAGS = ("exact", "corrected", "confusion", "unlisted", "invalid")
+
+# Part of the OCR stage version: bumped when `normalize_grade` changes, so the metadata is normalized again
+NORMALIZATION_VERSION = 2
+
+_VALID_GRADE = re.compile(VALID_GRADE_PATTERN)
+
+def _strip_grade(text):
+    # "Grade: User 7A+/V7 Setter 7A/V6" -> "7A+"
+    text = text.replace('Grade: User ', '')
+    text = re.sub(r' Setter.*', '', text).strip()
+    return re.sub(r'/.*', '', text)
+
+def _fix_confusions(text):
+    """
+    Reads a grade through the OCR confusions of config.GRADE_CONFUSIONS: the first character
+    as a number, the second as a letter and the third, if any, as a '+'. Characters after
+    the grade (a misread "/V6") are dropped.
+    """
+    confusions = config.GRADE_CONFUSIONS
+    if len(text) < 2:
+        return None
+    grade = confusions["number"].get(text[0], text[0]) + confusions["letter"].get(text[1], text[1]).upper()
+    if len(text) > 2 and confusions["plus"].get(text[2], text[2]) == "+":
+        grade += "+"
+    return grade if grade in config.GRADE_VOCABULARY else None
+
+def _settings_version():
+    # The normalization depends on these config values: a cached result is only reused while they are the same
+    return config_version(config.GRADE_VOCABULARY, config.GRADE_CORRECTIONS, config.GRADE_CONFUSIONS)
+
+def normalize_grade(raw):
+    """
+    Normalizes one raw grade string of the OCR ("Grade: User 7A+/V7 Setter ...", "7A+", "TAt").
+    Memoized per version of config.GRADE_VOCABULARY, GRADE_CORRECTIONS and GRADE_CONFUSIONS: a
+    corpus has few distinct strings, each one is parsed once per process and configuration.
+
+    Only grades of config.GRADE_VOCABULARY are "exact", "corrected" or "confusion"; other valid
+    grades are kept uppercased with code -1 and flagged "unlisted".
+
+    Returns:
+    - (grade or None, code in config.GRADE_VOCABULARY or -1, flag in GRADE_FLAGS)
+    """
+    return _normalize_grade(raw, _settings_version())
+
+@lru_cache(maxsize=None)
+def _normalize_grade(raw, version):
+    vocabulary = config.GRADE_VOCABULARY
+    text = _strip_grade(str(raw))
+    corrected = config.GRADE_CORRECTIONS.get(text, text.upper())
+    confused = _fix_confusions(text)
+    if text in vocabulary:
+        grade, flag = text, "exact"
+    elif corrected in vocabulary:
+        grade, flag = corrected, "corrected"
+    elif confused:
+        grade, flag = confused, "confusion"
+    elif _VALID_GRADE.match(text):
+        return text.upper(), -1, "unlisted"
+    else:
+        return None, -1, "invalid"
+    return grade, vocabulary.index(grade), flag
+
+def normalize_grades(grades):
+    """
+    Vectorized `normalize_grade`: every distinct string is normalized once.
+
+    Parameters:
+    - grades: pandas Series (or list) of raw grades
+
+    Returns:
+    - pandas DataFrame with the columns grade (None when invalid), grade_code (int8 index in
+      config.GRADE_VOCABULARY, -1 outside of it) and grade_flag, on the index of `grades`
+    """
+    grades = pd.Series(grades, dtype=object)
+    codes, uniques = pd.factorize(grades.astype(str), use_na_sentinel=False)
+    version = _settings_version()
+    table = pd.DataFrame([_normalize_grade(raw, version) for raw in uniques],
+                         columns=["grade", "grade_code", "grade_flag"])
+    result = table.iloc[codes].set_index(grades.index)
+    result["grade_code"] = result["grade_code"].astype(np.int8)
+    return result
+
+def clean_grades(grades):
+    """
+    Cleans the raw grade strings of the metadata, as done in the notebook:
+    "Grade: User 7A+/V7 Setter ..." -> "7A+", then the OCR misreads of config.GRADE_CORRECTIONS
+    and config.GRADE_CONFUSIONS are fixed. Strings that are still not a valid grade become NaN.
+
+    Parameters:
+    - grades: pandas Series (or list) of raw grades
+
+    Returns:
+    - pandas Series of cleaned grades
+    """
+    return normalize_grades(grades)["grade"].fillna(np.nan)
+
+def grade_codes(grades, vocabulary=None):
+    """
+    Maps cleaned grades to their index in `vocabulary` (default config.TRAINING_GRADES),
+    -1 for grades outside of it.
+
+    Returns:
+    - numpy int8 array
+    """
+    vocabulary = vocabulary or config.TRAINING_GRADES
+    codes = pd.Categorical(grades, categories=vocabulary).codes
+    return np.asarray(codes, dtype=np.int8)
+
+def dataset_grade_codes(df, vocabulary=None):
+    """
+    Grade codes of dataset rows in `vocabulary` (default config.TRAINING_GRADES), read from the
+    grade_code column written at extraction time; rows without it (datasets built before it
+    existed) are normalized from their grade string.
+
+    Returns:
+    - numpy int8 array, -1 for grades outside of `vocabulary`
+    """
+    vocabulary = list(vocabulary or config.TRAINING_GRADES)
+    # GRADE_VOCABULARY index -> vocabulary index, the last entry for -1
+    remap = np.array([vocabulary.index(g) if g in vocabulary else -1 for g in config.GRADE_VOCABULARY] + [-1],
+                     dtype=np.int8)
+
+    stored = pd.to_numeric(df["grade_code"], errors="coerce") if "grade_code" in df else \
+        pd.Series(np.nan, index=df.index)
+    codes = np.array(stored.fillna(-1), dtype=np.int64)
+    missing = stored.isna().to_numpy()
+    if missing.any():
+        codes[missing] = normalize_grades(df["grade"][missing])["grade_code"].to_numpy()
+    return remap[np.where(codes >= 0, codes, len(config.GRADE_VOCABULARY))]
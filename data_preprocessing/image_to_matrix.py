@@ -1,12 +1,106 @@
-import cv2
-import numpy as np
-import pandas as pd
-
 import cv2
 import numpy as np
 import os
 
-def image_to_matrix(image_path, debug_path=None):
+import data_preprocessing.config as config
+from data_preprocessing.instrumentation import phase
+
+# Labels of the classified pixels, and the colours they come from
+NONE, START, HOLD, END = 0, 1, 2, 3
+COLOR_LABELS = {"green": START, "blue": HOLD, "red1": END, "red2": END}
+
+_hue_lut = None
+
+def _build_hue_lut():
+    """
+    Builds the hue -> label lookup table and the common saturation/value bounds from
+    config.HOLD_HSV_RANGES. All colours share the same S/V bounds, so a pixel can be
+    classified with one table lookup on H plus one S/V range check.
+    """
+    ranges = config.HOLD_HSV_RANGES
+    sv_bounds = {(tuple(lower[1:]), tuple(upper[1:])) for lower, upper in ranges.values()}
+    if len(sv_bounds) != 1:
+        raise ValueError("HOLD_HSV_RANGES must share the same saturation/value bounds")
+    (sv_lower, sv_upper), = sv_bounds
+
+    lut = np.zeros(256, dtype=np.uint8)
+    for key, (lower, upper) in ranges.items():
+        lut[lower[0]:upper[0] + 1] = COLOR_LABELS[key]
+    return lut, sv_lower, sv_upper
+
+def classify_pixels(img_hsv):
+    """
+    Classifies every pixel of an HSV image into a single label image:
+    NONE, START (green), HOLD (blue) or END (red).
+    Stacks of boards can be classified at once by passing them stacked vertically.
+    """
+    global _hue_lut
+    if _hue_lut is None:
+        _hue_lut = _build_hue_lut()
+    lut, sv_lower, sv_upper = _hue_lut
+
+    valid = cv2.inRange(img_hsv, np.array((0, *sv_lower)), np.array((255, *sv_upper)))
+    labels = cv2.LUT(cv2.extractChannel(img_hsv, 0), lut)
+    return cv2.bitwise_and(labels, valid)
+
+def labels_to_matrices(labels, n=1):
+    """
+    Computes the per-cell occupancy of `n` label images stacked vertically.
+    Each board is split into the 18x11 grid and, for every label, an area resize gives the
+    fraction of each cell covered by that colour, without looking at individual contours.
+    A cell is marked when a colour covers at least config.HOLD_MIN_CELL_FRACTION of it.
+
+    Parameters:
+    - labels: array of shape (n * H, W) from `classify_pixels`
+    - n: number of stacked boards
+
+    Returns:
+    - matrices (numpy array of shape [n, 18, 11, 3])
+    """
+    height, width = labels.shape[0] // n, labels.shape[1]
+    cell_h, cell_w = height // 18, width // 11
+
+    # Drop the pixels left over below/right of the grid, if any
+    if height != 18 * cell_h or width != 11 * cell_w:
+        labels = labels.reshape(n, height, width)[:, :18 * cell_h, :11 * cell_w]
+        labels = np.ascontiguousarray(labels).reshape(n * 18 * cell_h, 11 * cell_w)
+
+    min_coverage = config.HOLD_MIN_CELL_FRACTION * 255
+    present = {}
+    for label in (START, HOLD, END):
+        mask = cv2.compare(labels, label, cv2.CMP_EQ)
+        coverage = cv2.resize(mask, (11, n * 18), interpolation=cv2.INTER_AREA)
+        present[label] = coverage.reshape(n, 18, 11) >= min_coverage
+
+    matrices = np.zeros((n, 18, 11, 3), dtype=np.uint8)
+    matrices[..., 0] = present[START] | present[HOLD] | present[END]  # isHold
+    matrices[..., 1] = present[START]  # isStart
+    matrices[..., 2] = present[END]  # isEnd
+    return matrices
+
+def image_to_matrix(image_path, debug_path=None, scale=None):
+    """
+    Reads a cropped MoonBoard image from disk and converts it with `board_to_matrix`.
+    The grid works on cell fractions, so a board read at a reduced size gives the same matrix.
+
+    Parameters:
+    - image_path: path to the input image
+    - debug_path: if specified, saves a debug image with detections over the grid
+    - scale: read the image at 1/scale of its size (default config.BOARD_DECODE_SCALE)
+
+    Returns:
+    - matrix (numpy array of shape [18, 11, 3])
+    """
+
+    from data_preprocessing.parallel_cropper import read_image
+
+    with phase("decode"):
+        img = read_image(image_path, scale or config.BOARD_DECODE_SCALE)
+    if img is None:
+        raise ValueError(f"Image could not be read: {image_path}")
+    return board_to_matrix(img, debug_path=debug_path)
+
+def board_to_matrix(img, debug_path=None):
     """
     Detects green, blue, and red circles in a cropped image of the MoonBoard
     and maps them to coordinates in an 18x11 matrix, generating a binary multi-channel matrix:
@@ -15,53 +109,20 @@ def image_to_matrix(image_path, debug_path=None):
     - Channel 2: isEnd (1 if it's a top hold)
 
     Parameters:
-    - image_path: path to the input image
+    - img: board image (BGR format), may be a view into a larger screenshot
     - debug_path: if specified, saves a debug image with detections over the grid
 
     Returns:
     - matrix (numpy array of shape [18, 11, 3])
     """
-    
-    # Read Image
-    img = cv2.imread(image_path)
-    img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
     height, width = img.shape[:2]
     cell_h, cell_w = height // 18, width // 11
 
-    # HSV range for colors(in OpenCV: H: 0-179, S,V: 0-255)
-    ranges = {
-        "green": ([50, 100, 100], [85, 255, 255]),
-        "blue":  ([100, 100, 100], [130, 255, 255]),
-        "red1":  ([0, 100, 100], [10, 255, 255]),
-        "red2":  ([160, 100, 100], [180, 255, 255])
-    }
-
-    # Masks
-    masks = {}
-    for key, (lower, upper) in ranges.items():
-        masks[key] = cv2.inRange(img_hsv, np.array(lower), np.array(upper))
-
-    # Combining red masks
-    masks["red"] = cv2.bitwise_or(masks["red1"], masks["red2"])
-
-    # Matrix Initialization
-    matrix = np.zeros((18, 11), dtype=np.uint8)
-
-    # Center detection
-    for idx, (color, mask) in enumerate([("green", masks["green"]), ("blue", masks["blue"]), ("red", masks["red"])]):
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        for cnt in contours:
-            M = cv2.moments(cnt)
-            if M["m00"] == 0:
-                continue
-            cx, cy = int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"])
-            row, col = cy // cell_h, cx // cell_w
-            if 0 <= row < 18 and 0 <= col < 11:
-                matrix[row, col] = 1  # isHold
-                # if color == "green":
-                #     matrix[row, col, 1] = 1  # isStart
-                # elif color == "red":
-                #     matrix[row, col, 2] = 1  # isEnd
+    with phase("mask"):
+        labels = classify_pixels(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+    with phase("cells"):
+        matrix = labels_to_matrices(labels)[0]
 
     # Debug
     if debug_path:
@@ -82,7 +143,29 @@ def image_to_matrix(image_path, debug_path=None):
                     continue
                 center = (int((col + 0.5) * cell_w), int((row + 0.5) * cell_h))
                 cv2.circle(debug_img, center, 10, color, 2)
-        os.makedirs(os.path.dirname(debug_path), exist_ok=True)
+        os.makedirs(os.path.dirname(debug_path) or ".", exist_ok=True)
         cv2.imwrite(debug_path, debug_img)
 
-    return matrix
\ No newline at end of file
+    return matrix
+
+def boards_to_matrices(boards):
+    """
+    Batch version of `board_to_matrix` for a stack of board crops of the same size.
+    The whole stack is converted to HSV with a single cvtColor call.
+
+    Parameters:
+    - boards: array of shape (N, H, W, 3) in BGR format, or a list of equally sized crops
+
+    Returns:
+    - matrices (numpy array of shape [N, 18, 11, 3])
+    """
+    boards = np.ascontiguousarray(np.asarray(boards))
+    n, height, width = boards.shape[:3]
+    if n == 0:
+        return np.zeros((0, 18, 11, 3), dtype=np.uint8)
+
+    # Stacking the boards vertically lets OpenCV process them as one image
+    with phase("mask"):
+        labels = classify_pixels(cv2.cvtColor(boards.reshape(n * height, width, 3), cv2.COLOR_BGR2HSV))
+    with phase("cells"):
+        return labels_to_matrices(labels, n=n)
@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import time
+import heapq
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+
+# Files whose frames are never blamed by the profiler (the plumbing around the real work)
+_PLUMBING = ("executor.py", "instrumentation.py")
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_local = threading.local()
+_profiler = None
+
+@contextmanager
+def phase(name):
+    """
+    Times a phase of the work done on the current image ("decode", "ocr", "mask", ...).
+    Does nothing unless the image is being instrumented (see `run_parallel(metrics=...)`),
+    so it can stay in the hot paths. Phases may nest: "tesseract" is part of "ocr".
+    """
+    record = getattr(_local, "record", None)
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record[name] = record.get(name, 0.0) + time.perf_counter() - start
+
+def begin_record():
+    _local.record = {}
+
+def end_record():
+    record = getattr(_local, "record", None)
+    _local.record = None
+    return record or {}
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread of the process at a fixed interval and counts, for each
+    sample, the innermost line of this package and the Python function actually running.
+    OpenCV calls have no Python frame, so PNG decode shows up as the line calling cv2.imread
+    ("image_to_matrix.image_to_matrix:94"), while tesseract shows up as the line calling it
+    followed by the subprocess function it waits in ("grade_recognizer.recognize_grade:183 -> _communicate").
+    Idle threads (waiting in the executor, or with no frame of this package) are ignored.
+
+    Parameters:
+    - interval: seconds between samples
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.take()
+
+    def take(self):
+        """
+        Returns the counts sampled since the last call and resets them.
+        """
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    key = self._blame(frame)
+                    if key:
+                        with self._lock:
+                            self.counts[key] += 1
+
+    @staticmethod
+    def _blame(frame):
+        leaf = frame.f_code.co_name
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(_PACKAGE_DIR):
+                # A thread waiting inside the executor is idle, not working
+                if os.path.basename(filename) in _PLUMBING:
+                    return None
+                module = os.path.splitext(os.path.basename(filename))[0]
+                owner = f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+                return owner if frame.f_code.co_name == leaf else f"{owner} -> {leaf}"
+            frame = frame.f_back
+        return None
+
+def start_profiler(interval=0.005):
+    """
+    Starts the sampling profiler of the current process (once) and returns it.
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(interval).start()
+    return _profiler
+
+def take_samples():
+    """
+    Returns the samples taken in this process since the last call, if the profiler is running.
+    """
+    return _profiler.take() if _profiler is not None else Counter()
+
+class StageMetrics:
+    """
+    Metrics of one pipeline stage: wall time, per-image time split in phases, queue wait,
+    errors by kind, the slowest images and, when profiling, the sampled hot functions.
+    Filled by `run_parallel` and by the stages themselves (`add_error`).
+
+    Parameters:
+    - name: stage name
+    - sink: optional open file; every image record is written to it as a JSON line
+    - top_n: number of slowest images kept
+    - profile: if True, `run_parallel` runs the sampling profiler in the workers
+    """
+
+    def __init__(self, name, sink=None, top_n=20, profile=False):
+        self.name = name
+        self.sink = sink
+        self.top_n = top_n
+        self.profile = profile
+        self.started = None
+        self.wall = 0.0
+        self.durations = []
+        self.queue_wait = 0.0
+        self.phases = Counter()
+        self.errors = Counter()
+        self.samples = Counter()
+        self.executor = None
+        self._slowest = []
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def stop(self):
+        if self.started is not None:
+            self.wall += time.perf_counter() - self.started
+            self.started = None
+
+    def record(self, item, seconds, wait=0.0, phases=None, error=None):
+        """
+        Records one processed image.
+        """
+        item = str(item)
+        phases = phases or {}
+        self.durations.append(seconds)
+        self.queue_wait += wait
+        self.phases.update(phases)
+        if error is not None:
+            self.errors[type(error).__name__] += 1
+
+        entry = (seconds, item)
+        if len(self._slowest) < self.top_n:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+        if self.sink is not None:
+            self.sink.write(json.dumps({
+                "type": "image",
+                "stage": self.name,
+                "item": item,
+                "seconds": round(seconds, 6),
+                "wait": round(wait, 6),
+                "phases": {key: round(value, 6) for key, value in phases.items()},
+                "error": None if error is None else f"{type(error).__name__}: {error}",
+            }) + "\n")
+
+    def add_error(self, item, kind, message=None):
+        """
+        Counts a failure that did not raise (unreadable image, missing file, bad matrix...).
+        """
+        self.errors[kind] += 1
+        if self.sink is not None:
+            self.sink.write(json.dumps({
+                "type": "error", "stage": self.name, "item": str(item), "kind": kind, "message": message,
+            }) + "\n")
+
+    def add_samples(self, samples):
+        self.samples.update(samples)
+
+    def slowest(self):
+        """
+        Returns the slowest images as (seconds, item), slowest first.
+        """
+        return sorted(self._slowest, reverse=True)
+
+    def summary(self):
+        durations = np.asarray(self.durations) if self.durations else np.zeros(1)
+        return {
+            "type": "stage",
+            "stage": self.name,
+            "wall_seconds": self.wall,
+            "images": len(self.durations),
+            "images_per_sec": len(self.durations) / self.wall if self.wall else None,
+            "p50_seconds": float(np.percentile(durations, 50)),
+            "p99_seconds": float(np.percentile(durations, 99)),
+            "max_seconds": float(durations.max()),
+            "queue_wait_seconds": self.queue_wait,
+            "phase_seconds": dict(self.phases),
+            "errors": dict(self.errors),
+            "slowest": [{"item": item, "seconds": seconds} for seconds, item in self.slowest()],
+            "hot_functions": dict(self.samples.most_common(self.top_n)),
+            "executor": self.executor,
+        }
+
+class RunMetrics:
+    """
+    Collects the metrics of every stage of a run and writes them to `output_dir`:
+    - metrics.jsonl: one line per image (and per error), then one summary line per stage
+    - metrics.prom: Prometheus text snapshot of the stage summaries
+
+    Usage:
+        with RunMetrics("data/metrics") as run:
+            with run.stage("ocr") as metrics:
+                extract_metadata(..., metrics=metrics)
+
+    Parameters:
+    - output_dir: directory for the metric files
+    - profile: if True, the sampling profiler runs during the stages
+    - top_n: number of slowest images (and hot functions) reported per stage
+    """
+
+    def __init__(self, output_dir, profile=False, top_n=20):
+        self.output_dir = output_dir
+        self.profile = profile
+        self.top_n = top_n
+        self.stages = []
+        os.makedirs(output_dir, exist_ok=True)
+        self.jsonl_path = os.path.join(output_dir, "metrics.jsonl")
+        self.prom_path = os.path.join(output_dir, "metrics.prom")
+        self._sink = open(self.jsonl_path, "w", encoding="utf-8")
+
+    @contextmanager
+    def stage(self, name):
+        metrics = StageMetrics(name, sink=self._sink, top_n=self.top_n, profile=self.profile)
+        self.stages.append(metrics)
+        metrics.start()
+        try:
+            yield metrics
+        finally:
+            metrics.stop()
+
+    def close(self):
+        if self._sink.closed:
+            return
+        for metrics in self.stages:
+            self._sink.write(json.dumps(metrics.summary()) + "\n")
+        self._sink.close()
+
+        with open(self.prom_path, "w", encoding="utf-8") as f:
+            f.write(to_prometheus(self.stages))
+
+        self.report()
+        print(f"📈 Metrics saved in: {self.jsonl_path} and {self.prom_path}")
+
+    def report(self):
+        """
+        Prints a short report: wall time, phases and slowest images of every stage.
+        """
+        for metrics in self.stages:
+            summary = metrics.summary()
+            errors = ", ".join(f"{kind}={count}" for kind, count in summary["errors"].items()) or "none"
+            print(f"⏱️ {metrics.name}: {summary['images']} images in {summary['wall_seconds']:.1f}s, "
+                  f"p50 {summary['p50_seconds'] * 1000:.1f} ms, p99 {summary['p99_seconds'] * 1000:.1f} ms, "
+                  f"errors: {errors}")
+            for name, seconds in sorted(summary["phase_seconds"].items(), key=lambda p: -p[1]):
+                print(f"   {name:<12}{seconds:10.2f}s")
+            for entry in summary["slowest"][:5]:
+                print(f"   🐢 {entry['seconds'] * 1000:8.1f} ms  {entry['item']}")
+            for function, count in list(summary["hot_functions"].items())[:5]:
+                print(f"   🔥 {count:6d}  {function}")
+
+        # Settings picked by the autotuner, ready to be pinned
+        tuned = {m.name: (m.executor["backend"], m.executor["workers"]) for m in self.stages if m.executor}
+        if tuned:
+            print(f"🎛️ Autotuned settings, to pin them in config.py: STAGE_EXECUTORS = {tuned}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+def to_prometheus(stages, prefix="moonboard"):
+    """
+    Renders stage metrics in the Prometheus text exposition format.
+    """
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for labels, value in samples:
+            text = ",".join(f'{key}="{_label(val)}"' for key, val in labels.items())
+            lines.append(f"{prefix}_{name}{{{text}}} {value}")
+
+    metric("stage_duration_seconds", "gauge", "Wall time of the stage.",
+           [({"stage": m.name}, m.wall) for m in stages])
+    metric("stage_images_total", "counter", "Images processed by the stage.",
+           [({"stage": m.name}, len(m.durations)) for m in stages])
+    metric("stage_queue_wait_seconds_total", "counter", "Time images waited for a worker.",
+           [({"stage": m.name}, m.queue_wait) for m in stages])
+    metric("stage_phase_seconds_total", "counter", "Time spent in each phase of the per-image work.",
+           [({"stage": m.name, "phase": p}, s) for m in stages for p, s in sorted(m.phases.items())])
+    metric("stage_errors_total", "counter", "Failed images by kind of error.",
+           [({"stage": m.name, "kind": k}, c) for m in stages for k, c in sorted(m.errors.items())])
+
+    samples = []
+    for m in stages:
+        durations = np.asarray(m.durations) if m.durations else np.zeros(1)
+        for quantile in (0.5, 0.9, 0.99):
+            samples.append(({"stage": m.name, "quantile": quantile}, float(np.quantile(durations, quantile))))
+    metric("image_duration_seconds", "summary", "Per-image processing time.", samples)
+    for m in stages:
+        lines.append(f'{prefix}_image_duration_seconds_sum{{stage="{_label(m.name)}"}} {sum(m.durations)}')
+        lines.append(f'{prefix}_image_duration_seconds_count{{stage="{_label(m.name)}"}} {len(m.durations)}')
+
+    return "\n".join(lines) + "\n"
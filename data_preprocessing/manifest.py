@@ -0,0 +1,240 @@
+import os
+import json
+import hashlib
+
+import data_preprocessing.config as config
+from data_preprocessing.shards import ShardRecord, image_name
+
+def file_hash(path):
+    """
+    Returns the content hash (blake2b, hex) of a file.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def config_version(*values):
+    """
+    Returns a short hash of the given configuration values (crop coords, HSV ranges, ...).
+    Changing any of them produces a new version, so the affected stage is recomputed.
+    """
+    return hashlib.blake2b(repr(values).encode(), digest_size=8).hexdigest()
+
+def _grade_settings():
+    from data_preprocessing.grades import NORMALIZATION_VERSION
+
+    templates = config.GRADE_TEMPLATES
+    templates_hash = file_hash(templates) if os.path.exists(templates) else None
+    return (config.GRADE_LINE_INDEX, config.GRADE_WORD_INDEX, config.GRADE_MATCH_THRESHOLD,
+            config.GRADE_MATCH_MARGIN, templates_hash, config.GRADE_VOCABULARY, config.GRADE_CORRECTIONS,
+            config.GRADE_CONFUSIONS, NORMALIZATION_VERSION)
+
+def _benchmark_settings():
+    template = config.BENCHMARK_TEMPLATE
+    template_hash = file_hash(template) if os.path.exists(template) else None
+    return (config.BENCHMARK_ICON_REGION, config.BENCHMARK_THRESHOLD, template_hash)
+
+def stage_version(stage):
+    """
+    Returns the configuration version of a pipeline stage.
+
+    Parameters:
+    - stage: "crop_header", "crop_board", "ocr", "matrix" or "fused"
+    """
+    versions = {
+        "crop_header": (config.HEADER_COORDS,),
+        "crop_board": (config.BOARD_COORDS,),
+        "ocr": (config.HEADER_DECODE_SCALE, config.YELLOW_HSV_RANGE, _grade_settings(), _benchmark_settings()),
+        "matrix": (config.BOARD_DECODE_SCALE, config.HOLD_HSV_RANGES, config.HOLD_MIN_CELL_FRACTION),
+        "fused": (config.HEADER_DECODE_SCALE, config.BOARD_DECODE_SCALE, config.HEADER_COORDS, config.BOARD_COORDS,
+                  config.YELLOW_HSV_RANGE, _grade_settings(), _benchmark_settings(), config.HOLD_HSV_RANGES,
+                  config.HOLD_MIN_CELL_FRACTION),
+    }
+    return config_version(stage, *versions[stage])
+
+class Manifest:
+    """
+    Append-only record of the inputs a stage has already processed, stored as JSON lines:
+    {"stage", "version", "file", "hash", "key", "size", "mtime"}.
+
+    An input is skipped when its key (content hash, plus any extra inputs of the stage) was
+    recorded for the same stage and config version.
+    The file size/mtime are kept as a shortcut so unchanged files are not re-hashed on every run.
+    Images of a shard set (`shards.ShardRecord`) come with their content hash, so they are never
+    hashed here, and an image keeps its entries when it is packed into a shard set.
+    Entries are appended right after their output is written, so an interrupted run resumes
+    where it stopped.
+    """
+
+    def __init__(self, path, stage, version=None):
+        self.path = path
+        self.stage = stage
+        self.version = version or stage_version(stage)
+        self.entries = {}
+        self._keys = {}
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Truncated last line after a crash
+                    if entry.get("stage") == self.stage and entry.get("version") == self.version:
+                        self.entries[entry["file"]] = entry
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _content_hashes(self, paths):
+        """
+        Returns path -> content hash. Files whose size/mtime match the manifest reuse the
+        recorded hash; the others are hashed in parallel threads.
+        """
+        hashes = {}
+        to_hash = []
+        for path in paths:
+            if isinstance(path, ShardRecord):
+                hashes[path] = path.hash
+                continue
+            stat = os.stat(path)
+            entry = self.entries.get(os.path.basename(path))
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                hashes[path] = entry["hash"]
+            else:
+                to_hash.append(path)
+
+        if to_hash:
+            from data_preprocessing.executor import run_parallel
+
+            for path, digest, error in run_parallel(file_hash, to_hash, backend="thread"):
+                if error:
+                    raise error
+                hashes[path] = digest
+        return hashes
+
+    def pending(self, paths, extra=None):
+        """
+        Filters `paths` down to the inputs that still need processing.
+
+        Parameters:
+        - paths: list of input file paths (or `shards.ShardRecord`s)
+        - extra: optional dict path -> value mixed into the key (e.g. the metadata row
+          a board is joined with), so a change there also triggers reprocessing
+
+        Returns:
+        - list of paths that are new or changed
+        """
+        self._keys = {}
+        todo = []
+        hashes = self._content_hashes(paths)
+        for path in paths:
+            digest = hashes[path]
+            key = digest if extra is None else config_version(digest, extra.get(path))
+            self._keys[path] = (digest, key)
+
+            entry = self.entries.get(image_name(path))
+            if not (entry and entry.get("key") == key):
+                todo.append(path)
+        return todo
+
+    def mark_done(self, path):
+        """
+        Records an input returned by `pending` as processed.
+        Call it only after its output has been written.
+        """
+        digest, key = self._keys[path]
+        if isinstance(path, ShardRecord):
+            size, mtime = path.size, None
+        else:
+            stat = os.stat(path)
+            size, mtime = stat.st_size, stat.st_mtime_ns
+        entry = {
+            "stage": self.stage,
+            "version": self.version,
+            "file": image_name(path),
+            "hash": digest,
+            "key": key,
+            "size": size,
+            "mtime": mtime,
+        }
+        self.entries[entry["file"]] = entry
+        self._file.write(json.dumps(entry) + "\n")
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def forget_stages(path, stages):
+    """
+    Removes the entries of the given stages from a manifest, so their inputs are all
+    processed again on the next run. The other stages keep their entries.
+    """
+    if not os.path.exists(path):
+        return
+    kept = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                if json.loads(line).get("stage") in stages:
+                    continue
+            except ValueError:
+                continue
+            kept.append(line)
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(kept)
+
+def append_rows(path, rows, columns=None):
+    """
+    Appends rows (list of dicts) to a CSV, writing the header only if the file is new.
+    A CSV written with other `columns` (by an older version) is upgraded first, see `upgrade_columns`.
+    """
+    import pandas as pd
+
+    if not rows:
+        return
+    if columns is not None:
+        upgrade_columns(path, columns)
+    write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+    pd.DataFrame(rows, columns=columns).to_csv(path, mode="a", header=write_header, index=False)
+
+def upgrade_columns(path, columns):
+    """
+    Rewrites a CSV whose header is not `columns` (written before a column was added) with
+    exactly `columns`, the new ones empty, so rows with the new columns can be appended to it.
+    Only the header line is read when it already matches.
+
+    Returns:
+    - True if the file was rewritten
+    """
+    import pandas as pd
+
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, "r", encoding="utf-8") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+    if header == list(columns):
+        return False
+    df = pd.read_csv(path).reindex(columns=columns)
+    tmp = path + ".tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+    print(f"🔧 {path} upgraded to the columns {', '.join(columns)}")
+    return True
@@ -0,0 +1,183 @@
+import os
+import json
+import numpy as np
+
+# Hold matrices: 18 rows x 11 columns x (isHold, isStart, isEnd)
+MATRIX_SHAPE = (18, 11, 3)
+HOLD, START, END = 0, 1, 2
+
+def matrices_path(csv_path):
+    """
+    Returns the path of the packed matrices stored next to a dataset CSV
+    (final_data.csv -> final_data.bits).
+    """
+    return os.path.splitext(csv_path)[0] + ".bits"
+
+def pack_matrices(matrices):
+    """
+    Packs binary matrices of shape (N, ...) into bits, one row of bytes per matrix.
+    An 18x11x3 board (594 cells) takes 75 bytes.
+    """
+    matrices = np.asarray(matrices)
+    return np.packbits(matrices.reshape(len(matrices), -1).astype(bool), axis=1)
+
+def unpack_matrices(packed, shape=MATRIX_SHAPE):
+    """
+    Inverse of `pack_matrices`: returns a uint8 array of shape (N, *shape).
+    """
+    count = int(np.prod(shape))
+    return np.unpackbits(packed, axis=1, count=count).reshape(len(packed), *shape)
+
+def _read_header(bits_path):
+    with open(bits_path + ".json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _count_csv_rows(csv_path):
+    if not os.path.exists(csv_path):
+        return 0
+    with open(csv_path, "rb") as f:
+        return max(0, sum(1 for _ in f) - 1)
+
+class DatasetWriter:
+    """
+    Appends dataset rows to a CSV with the metadata columns and their matrices to a
+    fixed-size binary file (`matrices_path(csv_path)`), row i of one matching row i of the other.
+
+    The shape of the matrices is stored in a small JSON sidecar (`<name>.bits.json`).
+    On open, the binary file is truncated to the number of CSV rows, so a run interrupted
+    between both writes stays aligned. An existing CSV with other columns (written by an older
+    version) is rewritten with `columns` (see `manifest.upgrade_columns`).
+
+    Parameters:
+    - csv_path: path of the metadata CSV
+    - columns: CSV columns (without the matrix)
+    - shape: shape of one matrix (default 18x11x3)
+    - append: if False, existing files are replaced
+    - aggregates: if True, the statistics of `aggregates.AggregateStore` are updated with every
+      chunk written and saved on close
+    """
+
+    def __init__(self, csv_path, columns, shape=MATRIX_SHAPE, append=True, aggregates=False):
+        self.csv_path = csv_path
+        self.bits_path = matrices_path(csv_path)
+        self.columns = columns
+        self.shape = tuple(shape)
+        self.row_bytes = (int(np.prod(self.shape)) + 7) // 8
+
+        if not append:
+            for path in (csv_path, self.bits_path, self.bits_path + ".json"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        if append:
+            from data_preprocessing.manifest import upgrade_columns
+            upgrade_columns(csv_path, columns)
+
+        self.rows = _count_csv_rows(csv_path)
+        if self.rows and os.path.exists(self.bits_path + ".json"):
+            header = _read_header(self.bits_path)
+            if tuple(header["shape"]) != self.shape:
+                raise ValueError(
+                    f"{self.bits_path} stores matrices of shape {tuple(header['shape'])}, not {self.shape}"
+                    " (run the pipeline with --rebuild)"
+                )
+        else:
+            with open(self.bits_path + ".json", "w", encoding="utf-8") as f:
+                json.dump({"shape": list(self.shape), "row_bytes": self.row_bytes}, f)
+
+        self._bits = open(self.bits_path, "ab")
+        self._bits.truncate(self.rows * self.row_bytes)
+
+        self.aggregates = None
+        if aggregates:
+            from data_preprocessing.aggregates import AggregateStore
+            self.aggregates = AggregateStore(csv_path, reset=not append)
+
+    def write(self, rows, matrices):
+        """
+        Appends a chunk of rows (list of dicts) and their matrices.
+        """
+        import pandas as pd
+
+        if not rows:
+            return
+        packed = pack_matrices(matrices)
+        if packed.shape != (len(rows), self.row_bytes):
+            raise ValueError(f"Expected {len(rows)} matrices of shape {self.shape}")
+
+        self._bits.write(packed.tobytes())
+        self._bits.flush()
+        write_header = self.rows == 0
+        pd.DataFrame(rows, columns=self.columns).to_csv(self.csv_path, mode="a", header=write_header, index=False)
+        self.rows += len(rows)
+        if self.aggregates is not None:
+            self.aggregates.update(rows, matrices, first_row=self.rows - len(rows))
+
+    def close(self):
+        self._bits.close()
+        if self.aggregates is not None:
+            self.aggregates.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def load_matrices(csv_path, mmap=True, channel=None):
+    """
+    Loads the packed matrices of a dataset as a uint8 array of shape (N, 18, 11, 3).
+    No per-row parsing: the file is memory-mapped and unpacked in one vectorized call.
+
+    Parameters:
+    - csv_path: path of the dataset CSV (or of the .bits file itself)
+    - mmap: if True, the binary file is memory-mapped instead of read
+    - channel: if given (HOLD, START or END), only that channel is returned, shape (N, 18, 11)
+
+    Returns:
+    - numpy array of shape (N, *shape), dtype uint8
+    """
+    bits_path = csv_path if csv_path.endswith(".bits") else matrices_path(csv_path)
+    header = _read_header(bits_path)
+    row_bytes = header["row_bytes"]
+
+    if os.path.getsize(bits_path) == 0:
+        matrices = np.zeros((0, *header["shape"]), dtype=np.uint8)
+    else:
+        if mmap:
+            raw = np.memmap(bits_path, dtype=np.uint8, mode="r")
+        else:
+            raw = np.fromfile(bits_path, dtype=np.uint8)
+        packed = raw[: len(raw) // row_bytes * row_bytes].reshape(-1, row_bytes)
+        matrices = unpack_matrices(packed, tuple(header["shape"]))
+
+    if channel is not None:
+        matrices = np.ascontiguousarray(matrices[..., channel])
+    return matrices
+
+def load_dataset(csv_path, mmap=True, channel=None):
+    """
+    Loads a dataset written by `DatasetWriter`.
+
+    Rows appended by incremental runs for a file that changed are dropped in favour of
+    the last one.
+
+    Parameters:
+    - csv_path: path of the dataset CSV
+    - mmap: if True, the binary file is memory-mapped instead of read
+    - channel: if given (HOLD, START or END), only that channel of the matrices is returned
+
+    Returns:
+    - (pandas.DataFrame with the metadata columns, numpy array of shape (N, 18, 11, 3),
+      or (N, 18, 11) when `channel` is given)
+    """
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    matrices = load_matrices(csv_path, mmap=mmap, channel=channel)[: len(df)]
+    df = df.iloc[: len(matrices)]
+
+    keep = ~df["filename"].duplicated(keep="last").to_numpy()
+    if not keep.all():
+        df, matrices = df[keep], matrices[keep]
+    return df.reset_index(drop=True), matrices
@@ -0,0 +1,149 @@
+import os
+import json
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+import pytesseract
+
+import data_preprocessing.config as config
+from data_preprocessing.instrumentation import phase
+
+_local = threading.local()
+
+def image_key(image):
+    """
+    Content hash of an image array (its pixels and shape), the cache key of what tesseract reads.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((image.shape, str(image.dtype))).encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+class OcrCache:
+    """
+    Persistent cache of the raw tesseract output, keyed by the hash of the image it read (a header
+    crop) and the tesseract options. Only the OCR itself is cached:
+    the fields derived from it (grade, stars, benchmark) are recomputed on every run, so a change
+    in how they are derived only costs the cheap pixel work (see `python main.py rederive`).
+
+    A SQLite file in WAL mode, so the workers of a process pool read and write it concurrently.
+    One connection per thread and process (see `get_cache`).
+
+    Parameters:
+    - path: database file (default config.OCR_CACHE)
+    """
+
+    def __init__(self, path=None):
+        self.path = path or config.OCR_CACHE
+        self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS ocr (image TEXT, options TEXT, result TEXT, "
+                         "PRIMARY KEY (image, options)) WITHOUT ROWID")
+
+    def get(self, key, options=""):
+        """
+        Returns the cached output (see `ocr_data`) or None.
+        """
+        row = self._db.execute("SELECT result FROM ocr WHERE image = ? AND options = ?", (key, options)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key, options, result):
+        self._db.execute("INSERT OR REPLACE INTO ocr VALUES (?, ?, ?)", (key, options, json.dumps(result)))
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM ocr").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+def get_cache():
+    """
+    The OCR cache of the current thread, opened once per thread and process; None when
+    config.OCR_CACHE is not set.
+    """
+    if not config.OCR_CACHE:
+        return None
+    cache = getattr(_local, "cache", None)
+    # A connection must not be used across a fork
+    if cache is None or cache[0] != (os.getpid(), config.OCR_CACHE):
+        _local.cache = cache = ((os.getpid(), config.OCR_CACHE), OcrCache(config.OCR_CACHE))
+    return cache[1]
+
+def _group_lines(data):
+    """
+    Groups the words of `pytesseract.image_to_data` into text lines with their box (x, y, w, h)
+    and mean word confidence.
+    """
+    lines = {}
+    for i, word in enumerate(data["text"]):
+        if not str(word).strip():
+            continue
+        line = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        x, y, w, h = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
+        entry = lines.setdefault(line, {"words": [], "confs": [], "box": [x, y, x + w, y + h]})
+        entry["words"].append(str(word).strip())
+        entry["confs"].append(float(data["conf"][i]))
+        box = entry["box"]
+        entry["box"] = [min(box[0], x), min(box[1], y), max(box[2], x + w), max(box[3], y + h)]
+
+    result = []
+    for line in sorted(lines):
+        entry = lines[line]
+        x1, y1, x2, y2 = entry["box"]
+        result.append({"text": " ".join(entry["words"]), "box": [int(x1), int(y1), int(x2 - x1), int(y2 - y1)],
+                       "conf": round(sum(entry["confs"]) / len(entry["confs"]), 2)})
+    return result
+
+def cached_ocr_data(image, options=""):
+    """
+    The cached output of `ocr_data` for an image, or None if tesseract never read it (tesseract
+    is not run).
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    with phase("ocr_cache"):
+        return cache.get(image_key(image), options)
+
+def ocr_data(image, options=""):
+    """
+    Runs tesseract on an image, or returns its cached output.
+
+    Parameters:
+    - image: image array (BGR, or single channel)
+    - options: tesseract options ("--psm 7 ..."), part of the cache key
+
+    Returns:
+    - dict with "text" (the lines joined by newlines) and "lines" (list of dicts with the
+      "text", "box" (x, y, w, h) and mean "conf" of each line)
+    """
+    cached = cached_ocr_data(image, options)
+    if cached is not None:
+        return cached
+
+    with phase("tesseract"):
+        data = pytesseract.image_to_data(image, config=options, output_type=pytesseract.Output.DICT)
+    lines = _group_lines(data)
+    result = {"text": "\n".join(line["text"] for line in lines), "lines": lines}
+
+    cache = get_cache()
+    if cache is not None:
+        cache.put(image_key(image), options, result)
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache of the raw tesseract output")
+    parser.add_argument("--path", default=None, help="default: config.OCR_CACHE")
+    parser.add_argument("--clear", action="store_true", help="delete every cached result")
+    args = parser.parse_args()
+
+    cache = OcrCache(args.path)
+    if args.clear:
+        cache._db.execute("DELETE FROM ocr")
+        cache._db.execute("VACUUM")
+    size = os.path.getsize(cache.path) / 1e6
+    print(f"🗃️ {len(cache)} cached OCR results in {cache.path} ({size:.1f} MB)")
+    cache.close()
@@ -1,15 +1,37 @@
 import os
 import cv2
-import pytesseract
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-import cv2
-import os
 
-def is_benchmark(image, filename=None, debug=False, output_dir="debug_benchmark"):
+from data_preprocessing.executor import run_parallel
+import data_preprocessing.config as config
+from data_preprocessing.manifest import append_rows
+from data_preprocessing.grade_recognizer import recognize_grade, rederive_grade
+from data_preprocessing.grades import normalize_grade, GRADE_FLAGS
+from data_preprocessing.benchmark_detector import get_detector
+from data_preprocessing.instrumentation import phase
+from data_preprocessing.parallel_cropper import read_image
+from data_preprocessing.shards import list_images, image_name, image_lookup
+
+# grade is the normalized grade, grade_code its index in config.GRADE_VOCABULARY (-1 outside of
+# it), grade_flag how it was read (see grades.GRADE_FLAGS), raw_grade the text of the OCR and
+# grade_method "template" or "tesseract" (see grade_recognizer.recognize_grade)
+METADATA_COLUMNS = ["filename", "grade", "benchmark", "stars", "grade_code", "grade_flag", "raw_grade", "grade_method"]
+
+# Rows written (and recorded in the manifest) at once
+FLUSH_EVERY = 500
+
+# Yellow pixels (at full resolution) for a filled star, and for the icon when there is no
+# benchmark template. An image read at 1/scale has 1/scale² of them.
+STAR_MIN_PIXELS = 200
+BENCHMARK_MIN_PIXELS = 50
+
+def is_benchmark(image, filename=None, debug=False, output_dir="debug_benchmark", scale=1):
     """
     Detects whether the benchmark 'B' icon is present in the header.
+    Uses the cached `BenchmarkDetector` (template matching in the icon region); the old
+    yellow-pixel count is only used when config.BENCHMARK_TEMPLATE is missing, since route
+    names can contain yellow emojis.
     If debug=True, saves visualization images to disk instead of showing them.
 
     Parameters:
@@ -17,16 +39,25 @@ def is_benchmark(image, filename=None, debug=False, output_dir="debug_benchmark"
     - filename: original image filename, used to name debug files
     - debug: if True, saves debug images
     - output_dir: folder to save debug images
+    - scale: the image was read at 1/scale of its size
     """
 
+    detector = get_detector(scale=scale)
+    if detector is not None:
+        debug_path = None
+        if debug and filename:
+            base = os.path.splitext(os.path.basename(filename))[0]
+            debug_path = os.path.join(output_dir, f"{base}_match.png")
+        return detector.detect(image, debug_path=debug_path)
+
     h, w, _ = image.shape
-    y1, y2 = int(0 * h), int(0.33 * h)   # Title line area
-    x1, x2 = int(0.4 * w), int(0.95 * w)   # Zone of the 'B' icon
+    fy1, fy2, fx1, fx2 = config.BENCHMARK_ICON_REGION
+    y1, y2 = int(fy1 * h), int(fy2 * h)   # Title line area
+    x1, x2 = int(fx1 * w), int(fx2 * w)   # Zone of the 'B' icon
     crop = image[y1:y2, x1:x2]
 
     hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
-    lower_yellow = (20, 100, 100)
-    upper_yellow = (35, 255, 255)
+    lower_yellow, upper_yellow = config.YELLOW_HSV_RANGE
     mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
 
     yellow_pixels = cv2.countNonZero(mask)
@@ -43,9 +74,9 @@ def is_benchmark(image, filename=None, debug=False, output_dir="debug_benchmark"
         # Yellow mask
         cv2.imwrite(os.path.join(output_dir, f"{base}_mask.png"), mask)
 
-    return yellow_pixels > 50
+    return yellow_pixels > BENCHMARK_MIN_PIXELS / scale ** 2
 
-def count_stars(image, debug=False, filename=None, output_dir="debug_stars"):
+def count_stars(image, debug=False, filename=None, output_dir="debug_stars", scale=1):
     """
     Counts how many stars are filled with yellow.
     The region is divided into 5 horizontal sections, one for each star, and checks each one.
@@ -55,6 +86,7 @@ def count_stars(image, debug=False, filename=None, output_dir="debug_stars"):
     - debug: if True, saves debug images showing the mask and star sections
     - filename: the name of the image file (used for naming debug outputs)
     - output_dir: directory where debug images will be saved
+    - scale: the image was read at 1/scale of its size
 
     Returns:
     - star_count: number of detected filled (yellow) stars
@@ -66,15 +98,14 @@ def count_stars(image, debug=False, filename=None, output_dir="debug_stars"):
     crop = image[y1:y2, x1:x2]
 
     hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
-    lower_yellow = (20, 100, 100)
-    upper_yellow = (35, 255, 255)
+    lower_yellow, upper_yellow = config.YELLOW_HSV_RANGE
     mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
 
     # Dividing the mask into 5 sections
     # Each section corresponds to a star
     section_width = mask.shape[1] // 5
     star_count = 0
-    threshold = 200  # min yellow pixels to consider a star filled
+    threshold = STAR_MIN_PIXELS / scale ** 2  # min yellow pixels to consider a star filled
 
     for i in range(5):
         x_start = i * section_width
@@ -102,7 +133,51 @@ def count_stars(image, debug=False, filename=None, output_dir="debug_stars"):
 
     return star_count
 
-def process_image_ocr(image_path):
+def analyze_header(image, filename, scale=1):
+    """
+    Recognizes the grade and applies the pixel heuristics to an already decoded header image.
+
+    Parameters:
+    - image: header image (BGR format), may be a view into a larger screenshot
+    - filename: name stored in the 'filename' field
+    - scale: the header was read at 1/scale of its size; the text is enlarged back for the
+      grade recognizer, the stars and the benchmark icon are checked at the reduced size
+
+    Returns:
+    - A dictionary with the METADATA_COLUMNS: 'filename', 'grade', 'benchmark', 'stars', the grade
+      normalization fields 'grade_code', 'grade_flag' and 'raw_grade' (see `grades.normalize_grade`)
+      and 'grade_method'
+    """
+
+    # Template matching on the grade word, tesseract only when it is not confident
+    with phase("ocr"):
+        raw_grade, _, grade_method = recognize_grade(_text_image(image, scale))
+    grade, grade_code, grade_flag = normalize_grade(raw_grade)
+
+    return {
+        "filename": filename,
+        "grade": grade,
+        **_pixel_fields(image, filename, scale),
+        "grade_code": grade_code,
+        "grade_flag": grade_flag,
+        "raw_grade": raw_grade,
+        "grade_method": grade_method,
+    }
+
+def _text_image(image, scale):
+    # The grade is recognized at full size, whatever the decode scale
+    if scale > 1:
+        return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+    return image
+
+def _pixel_fields(image, filename, scale):
+    with phase("benchmark"):
+        benchmark = is_benchmark(image, filename=filename, debug=False, scale=scale)
+    with phase("stars"):
+        stars = count_stars(image, debug=False, filename=filename, scale=scale)
+    return {"benchmark": True if benchmark else False, "stars": stars}
+
+def process_image_ocr(image_path, scale=None):
     """
     Reads an image from the given path and applies OCR to extract:
     - Route name
@@ -111,78 +186,189 @@ def process_image_ocr(image_path):
     Returns a dictionary with the extracted fields or None if the image is invalid.
 
     Parameters:
-    - image_path: path to the image file
+    - image_path: path to the image file, or `shards.ShardRecord`
+    - scale: read the image at 1/scale of its size (default config.HEADER_DECODE_SCALE)
 
     Returns:
     - A dictionary with:
         - 'filename': the image file name
-        - 'grade': the extracted grade (or "unknown" if not found)
+        - 'grade': the normalized grade (None if the OCR text is not a grade)
         - 'benchmark': whether the route is marked as benchmark
         - 'stars': number of yellow-filled stars
+        - 'grade_code', 'grade_flag', 'raw_grade': see `grades.normalize_grade`
     """
 
-    image = cv2.imread(image_path)
+    scale = scale or config.HEADER_DECODE_SCALE
+    with phase("decode"):
+        image = read_image(image_path, scale)
     if image is None:
         return None  # Image could not be read
 
-    # Apply OCR to the image
-    text = pytesseract.image_to_string(image)
-
-    # Cleaning empty lines and stripping whitespace
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-
-    # Safely extract the name and grade
-    grade = lines[2] if len(lines) > 2 else "unknown"
-
-    filename = os.path.basename(image_path)
-
-    benchmark = is_benchmark(image, filename=image_path, debug=False)
-    stars = count_stars(image, debug=False, filename=image_path)
-
-    return {
-        "filename": filename,
-        "grade": grade,
-        "benchmark": True if benchmark else False,
-        "stars": stars,
-    }
+    return analyze_header(image, image_name(image_path), scale)
 
 # Principal function to extract metadata from header images
 
-def extract_metadata(header_dir):
+def extract_metadata(header_dir, backend=None, max_workers=None, manifest=None, output_csv=None, metrics=None,
+                     exclude=None):
     """
     Iterates through all header images in the given directory (`header_dir`),
-    applies OCR in parallel using multithreading, and builds a DataFrame with the results.
+    applies OCR in parallel (threads or processes), and builds a DataFrame with the results.
+
+    Parameters:
+    - header_dir: directory or shard set with the cropped headers
+    - backend: "thread" or "process" (default config.EXECUTOR_BACKEND)
+    - max_workers: number of workers (default config.NUM_WORKERS)
+    - manifest: optional `Manifest`; headers already processed are skipped
+    - output_csv: if given, rows are appended to this CSV as they are produced, so an
+      interrupted run keeps its progress
+    - metrics: optional `instrumentation.StageMetrics` to record timings and errors in
+    - exclude: optional set of file names to skip (e.g. duplicates found by `dedup.dedup_boards`)
 
     Returns:
-    - pandas.DataFrame with the following columns:
+    - pandas.DataFrame with the following columns (only the rows processed in this run):
         - filename: image filename
-        - name: extracted route name (if applicable)
-        - grade: extracted grade
+        - grade: normalized grade
+        - benchmark: benchmark flag
         - stars: number of yellow-filled stars
-        - mark: benchmark flag
+        - grade_code, grade_flag, raw_grade: grade normalization (see `grades.normalize_grade`)
+        - grade_method: "template" or "tesseract" (see `grade_recognizer.recognize_grade`)
     """
 
-    # Get all PNG image paths in the header directory
-    image_paths = [
-        os.path.join(header_dir, f)
-        for f in os.listdir(header_dir)
-        if f.lower().endswith(".png")
-    ]
+    # Get all PNG images of the header directory (paths) or shard set (records)
+    image_paths = [item for item in list_images(header_dir) if not (exclude and image_name(item) in exclude)]
+
+    if manifest is not None:
+        image_paths = manifest.pending(image_paths)
+        print(f"⏭️ {len(manifest)} headers already processed, {len(image_paths)} new or changed.")
 
     print(f"🔎 Processing {len(image_paths)} headers with OCR in parallel...")
 
     results = []
+    buffer = []
+
+    def flush():
+        if output_csv:
+            append_rows(output_csv, [row for _, row in buffer], columns=METADATA_COLUMNS)
+        if manifest is not None:
+            for path, _ in buffer:
+                manifest.mark_done(path)
+            manifest.flush()
+        buffer.clear()
+
+    # Chunks of paths are sent to the pool; only a bounded window is in flight
+    outputs = run_parallel(process_image_ocr, image_paths, backend=backend, max_workers=max_workers, metrics=metrics)
+    for path, result, error in tqdm(outputs, total=len(image_paths), desc="OCR"):
+        if error:
+            print(f"⚠️ Error con {image_name(path)}: {error}")
+        elif result:
+            results.append(result)
+            buffer.append((path, result))
+            if len(buffer) >= FLUSH_EVERY:
+                flush()
+        elif metrics is not None:
+            metrics.add_error(image_name(path), "unreadable")
+    flush()
+
+    results = pd.DataFrame(results, columns=METADATA_COLUMNS)
+    print("✅ OCR Completed.")
+    print_grade_flags(results)
+    return results
 
-    # Create a ThreadPoolExecutor to process images in parallel
-    with ThreadPoolExecutor() as executor:
-        # Send each image path to the executor
-        futures = [executor.submit(process_image_ocr, path) for path in image_paths]
+def print_grade_flags(rows):
+    """
+    Prints how the grades of a run were read (see `grades.GRADE_FLAGS`), so a drift of the OCR
+    shows up as more "confusion" or "invalid" rows.
+    """
+    if not len(rows):
+        return
+    counts = rows["grade_flag"].value_counts()
+    print("🔤 Grades: " + ", ".join(f"{counts.get(flag, 0)} {flag}" for flag in GRADE_FLAGS))
 
-        # Using tqdm to show progress
-        for future in tqdm(as_completed(futures), total=len(futures), desc="OCR"):
-            result = future.result()
-            if result:
-                results.append(result)
+def rederive_header(image_path, scale=None):
+    """
+    Recomputes the cheap fields of a header for `rederive_metadata`: the stars and benchmark
+    pixel pass, and the grade picked again from its cached tesseract output. Neither tesseract
+    nor the template matching runs.
 
-    print("✅ OCR Completed.")
-    return pd.DataFrame(results)
+    Returns:
+    - A dictionary with 'filename', 'benchmark', 'stars' and 'raw_grade' (None if tesseract never
+      read the header), or None if the image is invalid
+    """
+    scale = scale or config.HEADER_DECODE_SCALE
+    with phase("decode"):
+        image = read_image(image_path, scale)
+    if image is None:
+        return None
+
+    filename = image_name(image_path)
+    return {"filename": filename, "raw_grade": rederive_grade(_text_image(image, scale)),
+            **_pixel_fields(image, filename, scale)}
+
+def rederive_metadata(header_dir, metadata_csv, backend=None, max_workers=None, manifest=None, metrics=None,
+                      exclude=None):
+    """
+    Re-derives grade, stars and benchmark of every header of a metadata CSV after a change in how
+    they are derived (the grade line or word, the star or benchmark thresholds, the grade
+    normalization), from the tesseract output cached by `ocr_cache` and a fresh pixel pass
+    (see `rederive_header`). Grades matched by the templates are kept as they are: after changing
+    the templates or their thresholds, run the OCR stage again instead.
+    The metadata CSV is rewritten with one row per header.
+
+    Parameters:
+    - header_dir: directory or shard set with the cropped headers
+    - metadata_csv: CSV written by `extract_metadata`
+    - backend / max_workers: see `executor.run_parallel`
+    - manifest: optional `Manifest` of the "ocr" stage; the headers are recorded as processed with
+      the current settings, so the OCR stage does not redo them
+    - metrics: optional `instrumentation.StageMetrics` to record timings and errors in
+    - exclude: optional set of file names to skip
+
+    Returns:
+    - pandas.DataFrame with the rows whose fields changed
+    """
+    metadata = pd.read_csv(metadata_csv).reindex(columns=METADATA_COLUMNS)
+    metadata = metadata.drop_duplicates("filename", keep="last").set_index("filename", drop=False)
+    images = image_lookup(header_dir)
+    image_paths = [images[filename] for filename in metadata.index
+                   if filename in images and not (exclude and filename in exclude)]
+    todo = set(manifest.pending(image_paths)) if manifest is not None else set()
+
+    print(f"♻️ Re-deriving {len(image_paths)} headers from the OCR cache...")
+    rows = metadata.to_dict("index")
+    changed, misses = [], 0
+    outputs = run_parallel(rederive_header, image_paths, backend=backend, max_workers=max_workers, metrics=metrics)
+    for path, result, error in tqdm(outputs, total=len(image_paths), desc="Rederive"):
+        if error or not result:
+            print(f"⚠️ Error con {image_name(path)}: {error or 'unreadable'}")
+            todo.discard(path)
+            continue
+
+        old = rows[result["filename"]]
+        row = dict(old, benchmark=result["benchmark"], stars=result["stars"])
+        if pd.isna(row["raw_grade"]):
+            row["raw_grade"] = row["grade"]  # Metadata written before the raw text was kept
+        if row["grade_method"] != "template":
+            if result["raw_grade"] is not None:
+                row["raw_grade"], row["grade_method"] = result["raw_grade"], "tesseract"
+            else:
+                misses += 1
+        row["grade"], row["grade_code"], row["grade_flag"] = normalize_grade(row["raw_grade"])
+
+        if any(str(row[c]) != str(old[c]) for c in ("grade", "benchmark", "stars", "grade_flag", "raw_grade")):
+            changed.append(row)
+        rows[result["filename"]] = row
+
+    tmp = metadata_csv + ".tmp"
+    pd.DataFrame(list(rows.values()), columns=METADATA_COLUMNS).to_csv(tmp, index=False)
+    os.replace(tmp, metadata_csv)
+    if manifest is not None:
+        for path in todo:
+            manifest.mark_done(path)
+        manifest.flush()
+
+    if misses:
+        print(f"⚠️ {misses} headers not matched by the templates have no cached tesseract output, their grade was kept")
+    changed = pd.DataFrame(changed, columns=METADATA_COLUMNS)
+    print(f"✅ {len(changed)} of {len(image_paths)} headers changed.")
+    print_grade_flags(pd.DataFrame(list(rows.values()), columns=METADATA_COLUMNS))
+    return changed
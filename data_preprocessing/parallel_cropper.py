@@ -1,47 +1,150 @@
 import os
 import cv2
+from functools import partial
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import data_preprocessing.config as config
+from data_preprocessing.executor import run_parallel
+from data_preprocessing.instrumentation import phase
+from data_preprocessing.shards import ShardRecord, ShardWriter, is_shard_set, list_images, image_name
+
+# Crops appended to a shard set between two flushes
+FLUSH_EVERY = 500
+
+# Reduced decode modes: 1/2, 1/4 or 1/8 of the size in each dimension
+_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+DECODE_SCALES = tuple(_DECODE_FLAGS)
+
+def read_image(path, scale=1):
+    """
+    Reads an image at 1/scale of its size (scale 1, 2, 4 or 8). JPEG files are decoded
+    directly at the reduced size; other formats are decoded in full and shrunk by OpenCV,
+    so only the work done on the pixels afterwards gets cheaper.
+
+    Parameters:
+    - path: image file, or `shards.ShardRecord` of an image in a shard set
+    - scale: 1, 2, 4 or 8
+
+    Returns:
+    - the BGR image, or None if it could not be read
+    """
+    if scale not in _DECODE_FLAGS:
+        raise ValueError(f"Invalid decode scale {scale}, expected one of {DECODE_SCALES}")
+    if isinstance(path, ShardRecord):
+        return cv2.imdecode(path.array(), _DECODE_FLAGS[scale])
+    return cv2.imread(path, _DECODE_FLAGS[scale])
+
+def reduce_image(image, scale=1):
+    """
+    Shrinks an image already decoded to 1/scale of its size, with the same interpolation
+    `read_image` gives for formats decoded in full.
+    """
+    if scale == 1:
+        return image
+    h, w = image.shape[:2]
+    return cv2.resize(image, (w // scale, h // scale), interpolation=cv2.INTER_LINEAR)
+
+def scale_coords(coords, scale=1):
+    """
+    Converts (y1, y2, x1, x2) coords of the full-size image to an image read at 1/scale.
+    """
+    return tuple(c // scale for c in coords)
+
+def crop_region(image, coords):
+    """
+    Returns the (y1, y2, x1, x2) region of an image as a view, without copying pixels.
+    """
+    y1, y2, x1, x2 = coords
+    return image[y1:y2, x1:x2]
 
 def crop_single_header(input_path, output_path, coords):
     """
     Helper function to crop one header image.
     """
-    image = cv2.imread(input_path)
+    with phase("decode"):
+        image = read_image(input_path)
     if image is None:
-        print(f"⚠️ Could not load image: {os.path.basename(input_path)}")
+        print(f"⚠️ Could not load image: {image_name(input_path)}")
         return
 
-    y1, y2, x1, x2 = coords
-    cropped = image[y1:y2, x1:x2]
-    cv2.imwrite(output_path, cropped)
+    with phase("write"):
+        return cv2.imwrite(output_path, crop_region(image, coords))
+
+def _crop_file(item, output_dir, coords):
+    return crop_single_header(item, os.path.join(output_dir, image_name(item)), coords)
 
-def crop_header(input_dir, output_dir, coords):
+def _crop_encoded(item, coords):
     """
-    Crop the top header from all images in input_dir and save to output_dir, using parallel threads.
+    Crops one image and returns the PNG bytes of the crop, for the shard writer of the main thread.
+    """
+    with phase("decode"):
+        image = read_image(item)
+    if image is None:
+        print(f"⚠️ Could not load image: {image_name(item)}")
+        return None
+
+    with phase("encode"):
+        ok, data = cv2.imencode(".png", crop_region(image, coords))
+    return data if ok else None
+
+def crop_header(input_dir, output_dir, coords, backend=None, max_workers=None, manifest=None, metrics=None,
+                sharded=None):
+    """
+    Crop the top header from all images in input_dir and save to output_dir, in parallel.
     
     Parameters:
-    - input_dir: directory with original screenshots
+    - input_dir: directory or shard set with original screenshots
     - output_dir: directory to save cropped headers
     - coords: tuple (y1, y2, x1, x2) defining the crop rectangle
+    - backend: "thread" or "process" (default config.EXECUTOR_BACKEND)
+    - max_workers: number of workers (default config.NUM_WORKERS)
+    - manifest: optional `Manifest`; screenshots already cropped with the same coords are skipped
+    - metrics: optional `instrumentation.StageMetrics` to record timings and errors in
+    - sharded: if True, output_dir is a shard set the crops are appended to, instead of loose
+      PNGs (default config.SHARDED_CROPS, or True if output_dir already is a shard set)
     """
+    sharded = config.SHARDED_CROPS or is_shard_set(output_dir) if sharded is None else sharded
     os.makedirs(output_dir, exist_ok=True)
 
-    image_files = [
-        f for f in os.listdir(input_dir)
-        if f.lower().endswith(".png")
-    ]
+    images = list_images(input_dir)
+
+    if manifest is not None:
+        todo = set(manifest.pending(images))
+        existing = {image_name(item) for item in list_images(output_dir)}
+        images = [item for item in images if item in todo or image_name(item) not in existing]
+        print(f"⏭️ {len(manifest)} screenshots already cropped, {len(images)} new or changed.")
 
-    print(f"📋 Cropping {len(image_files)} headers in parallel...")
+    print(f"📋 Cropping {len(images)} headers in parallel...")
 
-    with ThreadPoolExecutor() as executor:
-        futures = []
-        for filename in image_files:
-            input_path = os.path.join(input_dir, filename)
-            output_path = os.path.join(output_dir, filename)
-            futures.append(executor.submit(crop_single_header, input_path, output_path, coords))
+    writer = ShardWriter(output_dir) if sharded else None
+    if writer is not None:
+        crop = partial(_crop_encoded, coords=coords)
+    else:
+        crop = partial(_crop_file, output_dir=output_dir, coords=coords)
+    results = run_parallel(crop, images, backend=backend, max_workers=max_workers, metrics=metrics)
+    for count, (item, cropped, error) in enumerate(tqdm(results, total=len(images), desc="Header Crop"), 1):
+        if error:
+            print(f"⚠️ Error con {image_name(item)}: {error}")
+            continue
+        elif cropped is None or cropped is False:
+            if metrics is not None:
+                metrics.add_error(image_name(item), "unreadable")
+            continue
 
-        for _ in tqdm(as_completed(futures), total=len(futures), desc="Header Crop"):
-            pass
+        if writer is not None:
+            writer.add(image_name(item), cropped)
+        if manifest is not None:
+            manifest.mark_done(item)
+            # Shard bytes reach the disk before the manifest says they are done
+            if writer is not None and count % FLUSH_EVERY == 0:
+                writer.flush()
+                manifest.flush()
+    if writer is not None:
+        writer.close()
 
-    print(f"✅ Cropped headers saved in: {output_dir}")
\ No newline at end of file
+    print(f"✅ Cropped headers saved in: {output_dir}")
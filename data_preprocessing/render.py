@@ -0,0 +1,263 @@
+import os
+import argparse
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+import data_preprocessing.config as config
+from data_preprocessing.executor import run_parallel
+from data_preprocessing.matrix_store import HOLD, START, END
+from data_preprocessing.instrumentation import phase
+from data_preprocessing.parallel_cropper import read_image
+from data_preprocessing.shards import image_lookup
+
+# BGR colours, as the app draws the holds: start green, intermediate blue, end red
+BACKGROUND_LEVEL = 24  # gray, so large backgrounds are a scalar fill
+BACKGROUND = (BACKGROUND_LEVEL,) * 3
+EMPTY = (70, 70, 70)
+HOLD_COLOUR = (255, 128, 0)
+START_COLOUR = (0, 200, 0)
+END_COLOUR = (0, 0, 230)
+CAPTION_COLOUR = (235, 235, 235)
+
+# Cell kinds, indices in the palette
+_NONE, _HOLD, _START, _END = 0, 1, 2, 3
+_PALETTE = np.array([EMPTY, HOLD_COLOUR, START_COLOUR, END_COLOUR], dtype=np.uint8)
+
+CAPTION_LINES = 2
+CAPTION_LINE_PX = 12
+
+def _disc(cell, radius):
+    """
+    Boolean (cell, cell) mask of a disc centred in the cell.
+    """
+    centre = (cell - 1) / 2
+    y, x = np.ogrid[:cell, :cell]
+    return (y - centre) ** 2 + (x - centre) ** 2 <= radius ** 2
+
+def cell_kinds(matrices):
+    """
+    Kind of every cell: none, hold, start or end (start wins, as in the debug images).
+
+    Parameters:
+    - matrices: (N, 18, 11, 3) matrices, or (N, 18, 11) hold masks
+
+    Returns:
+    - uint8 array of shape (N, 18, 11)
+    """
+    matrices = np.asarray(matrices)
+    if matrices.ndim == 3:
+        return (matrices > 0).astype(np.uint8) * _HOLD
+    kinds = (matrices[..., HOLD] > 0).astype(np.uint8) * _HOLD
+    kinds[matrices[..., END] > 0] = _END
+    kinds[matrices[..., START] > 0] = _START
+    return kinds
+
+def _to_image(cells):
+    # (N, 18, 11, cell, cell, ...) -> (N, 18 * cell, 11 * cell, ...)
+    n, rows, columns, cell = cells.shape[:4]
+    return cells.transpose(0, 1, 3, 2, 4, *range(5, cells.ndim)).reshape(n, rows * cell, columns * cell,
+                                                                          *cells.shape[5:])
+
+@lru_cache(maxsize=None)
+def _tiles(cell):
+    """
+    The cell image of every kind, (4, cell, cell, 3): a disc in the hold colour, or a small
+    dot for empty cells.
+    """
+    shapes = np.stack([_disc(cell, cell * 0.12)] + [_disc(cell, cell * 0.4)] * 3)
+    return np.where(shapes[..., None], _PALETTE[:, None, None, :], np.array(BACKGROUND, dtype=np.uint8))
+
+@lru_cache(maxsize=None)
+def _rings(cell):
+    """
+    The overlay mask of every kind, (4, cell, cell): a ring around the hold, nothing when empty.
+    """
+    ring = _disc(cell, cell * 0.48) & ~_disc(cell, cell * 0.36)
+    return np.stack([np.zeros_like(ring)] + [ring] * 3)
+
+def render_matrices(matrices, cell=None):
+    """
+    Draws hold matrices as BGR images, all at once: the tile of every cell is looked up
+    from its kind and the tiles are laid out with one transpose, no per-cell drawing.
+
+    Parameters:
+    - matrices: (N, 18, 11, 3) matrices or (N, 18, 11) hold masks
+    - cell: size of a cell in pixels (default config.RENDER_CELL_PX)
+
+    Returns:
+    - uint8 array of shape (N, 18 * cell, 11 * cell, 3)
+    """
+    cell = cell or config.RENDER_CELL_PX
+    return _to_image(_tiles(cell)[cell_kinds(matrices)])
+
+def overlay_matrices(boards, matrices, cell=None):
+    """
+    Draws the detected holds as rings over the board crops they were extracted from,
+    to check the extraction at a glance.
+
+    Parameters:
+    - boards: list of BGR board crops (any size, they are resized to the grid; None for missing ones)
+    - matrices: their (N, 18, 11, 3) matrices
+    - cell: size of a cell in pixels (default config.RENDER_CELL_PX)
+
+    Returns:
+    - uint8 array of shape (N, 18 * cell, 11 * cell, 3)
+    """
+    cell = cell or config.RENDER_CELL_PX
+    kinds = cell_kinds(matrices)
+    size = (11 * cell, 18 * cell)
+    images = np.stack([cv2.resize(board, size, interpolation=cv2.INTER_AREA) if board is not None
+                       else np.full((size[1], size[0], 3), BACKGROUND_LEVEL, dtype=np.uint8) for board in boards])
+
+    colours = np.broadcast_to(_PALETTE[kinds][:, :, :, None, None, :], (*kinds.shape, cell, cell, 3))
+    np.copyto(images, _to_image(colours), where=_to_image(_rings(cell)[kinds])[..., None])
+    return images
+
+def contact_sheet(tiles, captions=None, columns=None, padding=4):
+    """
+    Tiles images into one sheet, with up to CAPTION_LINES lines of text under each tile.
+
+    Parameters:
+    - tiles: (N, h, w, 3) images
+    - captions: one string per tile, lines separated by "\\n"
+    - columns: tiles per row (default config.SHEET_COLUMNS)
+
+    Returns:
+    - the sheet, a BGR image
+    """
+    columns = columns or config.SHEET_COLUMNS
+    n, h, w = tiles.shape[:3]
+    rows = max(1, -(-n // columns))
+    caption_h = CAPTION_LINES * CAPTION_LINE_PX + 4 if captions is not None else 0
+    step_y, step_x = h + caption_h + padding, w + padding
+
+    sheet = np.full((rows * step_y + padding, min(n, columns) * step_x + padding, 3), BACKGROUND_LEVEL,
+                    dtype=np.uint8)
+    for i in range(n):
+        y, x = padding + (i // columns) * step_y, padding + (i % columns) * step_x
+        sheet[y:y + h, x:x + w] = tiles[i]
+        if captions is not None:
+            for line_number, line in enumerate(str(captions[i]).split("\n")[:CAPTION_LINES]):
+                cv2.putText(sheet, line, (x + 1, y + h + (line_number + 1) * CAPTION_LINE_PX),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.33, CAPTION_COLOUR, 1, cv2.LINE_8)
+    return sheet
+
+def caption(row):
+    """
+    Caption of a dataset row: file name, then grade, stars and B for benchmarks.
+    """
+    benchmark = "  B" if str(row.get("benchmark")) == "True" else ""
+    return f"{row.get('filename', '')}\n{row.get('grade', '?')}  {row.get('stars', '?')}*{benchmark}"
+
+class SheetJob:
+    """
+    One contact sheet to render: its path, matrices, captions and board crops (or None).
+    Shown by its path in the metrics and error messages.
+    """
+
+    def __init__(self, path, matrices, captions, board_paths=None):
+        self.path = path
+        self.matrices = matrices
+        self.captions = captions
+        self.board_paths = board_paths
+
+    def __str__(self):
+        return self.path
+
+def _write_sheet(job, cell=None, columns=None):
+    """
+    Renders and saves one contact sheet (a `SheetJob`).
+    """
+    if job.board_paths is None:
+        with phase("render"):
+            tiles = render_matrices(job.matrices, cell)
+    else:
+        with phase("decode"):
+            boards = [read_image(path) if path is not None else None for path in job.board_paths]
+        with phase("render"):
+            tiles = overlay_matrices(boards, job.matrices, cell)
+    with phase("render"):
+        sheet = contact_sheet(tiles, job.captions, columns)
+    with phase("write"):
+        if not cv2.imwrite(job.path, sheet):
+            raise ValueError(f"Could not write {job.path}")
+    return job.path
+
+def write_contact_sheets(csv_path=None, output_dir=None, per_sheet=None, columns=None, cell=None, query=None,
+                         board_dir=None, backend=None, max_workers=None, metrics=None):
+    """
+    Renders every route of a dataset into contact-sheet PNGs, in parallel, for visual QA.
+    An index.csv maps every route to its sheet and position.
+
+    Parameters:
+    - csv_path: dataset CSV (default config.FINAL_CSV)
+    - output_dir: where the sheets are saved (default config.CONTACT_SHEETS_DIR)
+    - per_sheet: routes per sheet (default config.SHEET_ROUTES)
+    - columns: routes per sheet row (default config.SHEET_COLUMNS)
+    - cell: size of a cell in pixels (default config.RENDER_CELL_PX)
+    - query: optional pandas query selecting the routes, e.g. "grade == '7A+' and stars >= 3"
+    - board_dir: if given, the holds are drawn over the board crops of that directory (or shard set)
+    - backend / max_workers: see `executor.run_parallel`
+    - metrics: optional `instrumentation.StageMetrics` to record timings and errors in
+
+    Returns:
+    - list of the sheets written
+    """
+    import pandas as pd
+    from functools import partial
+    from data_preprocessing.matrix_store import load_dataset
+
+    csv_path = csv_path or config.FINAL_CSV
+    output_dir = output_dir or config.CONTACT_SHEETS_DIR
+    per_sheet = per_sheet or config.SHEET_ROUTES
+    os.makedirs(output_dir, exist_ok=True)
+
+    df, matrices = load_dataset(csv_path)
+    if query:
+        keep = df.eval(query).to_numpy(dtype=bool)
+        df, matrices = df[keep].reset_index(drop=True), matrices[keep]
+
+    captions = [caption(row) for row in df.to_dict("records")]
+    boards = image_lookup(board_dir) if board_dir else None
+    jobs, index = [], []
+    for number, start in enumerate(range(0, len(df), per_sheet)):
+        path = os.path.join(output_dir, f"sheet_{number:04}.png")
+        names = df["filename"].iloc[start:start + per_sheet].tolist()
+        board_paths = [boards.get(name) for name in names] if boards is not None else None
+        jobs.append(SheetJob(path, np.ascontiguousarray(matrices[start:start + per_sheet]),
+                             captions[start:start + per_sheet], board_paths))
+        index += [(name, os.path.basename(path), position) for position, name in enumerate(names)]
+
+    print(f"🖼️ Rendering {len(df)} routes into {len(jobs)} contact sheets...")
+    written = []
+    outputs = run_parallel(partial(_write_sheet, cell=cell, columns=columns), jobs, backend=backend,
+                           max_workers=max_workers, chunk_size=1, metrics=metrics)
+    for job, path, error in tqdm(outputs, total=len(jobs), desc="Sheets"):
+        if error:
+            print(f"⚠️ Error con {os.path.basename(job.path)}: {error}")
+            continue
+        written.append(path)
+
+    pd.DataFrame(index, columns=["filename", "sheet", "position"]).to_csv(
+        os.path.join(output_dir, "index.csv"), index=False)
+    print(f"✅ {len(written)} contact sheets saved in: {output_dir}")
+    return sorted(written)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Contact sheets of the hold matrices, for visual QA")
+    parser.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+    parser.add_argument("--output-dir", default=None, help="default: config.CONTACT_SHEETS_DIR")
+    parser.add_argument("--per-sheet", type=int, default=None, help="default: config.SHEET_ROUTES")
+    parser.add_argument("--columns", type=int, default=None, help="default: config.SHEET_COLUMNS")
+    parser.add_argument("--cell", type=int, default=None, help="cell size in pixels (default: config.RENDER_CELL_PX)")
+    parser.add_argument("--query", default=None, help="e.g. \"grade == '7A+' and stars >= 3\"")
+    parser.add_argument("--overlay", action="store_true", help="draw over the board crops of config.BOARDS_DIR")
+    parser.add_argument("--backend", choices=["thread", "process"], default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    write_contact_sheets(args.csv, args.output_dir, args.per_sheet, args.columns, args.cell, args.query,
+                         board_dir=config.BOARDS_DIR if args.overlay else None, backend=args.backend,
+                         max_workers=args.workers)
@@ -0,0 +1,377 @@
+import os
+import re
+import json
+import mmap
+import time
+import hashlib
+import tarfile
+import argparse
+
+import numpy as np
+from tqdm import tqdm
+
+import data_preprocessing.config as config
+
+# A shard set is a directory with large .tar shards (readable by any tar tool) and an index with
+# the name, shard, data offset, size and content hash of every image, one JSON line each
+INDEX_NAME = "index.jsonl"
+SHARD_PATTERN = "shard-{:05}.tar"
+BLOCK = tarfile.BLOCKSIZE
+
+# Images packed between two flushes (and deletions of the loose files with --remove)
+PACK_FLUSH_EVERY = 1000
+
+_maps = {}
+
+def _content_hash(data):
+    # Same hash as `manifest.file_hash`, so the manifest recognizes images once they are packed
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def natural_key(name):
+    """
+    Sort key of a file name with its numbers compared as numbers ("moonboard_10000.png" after
+    "moonboard_9999.png"), so images sort in capture order whatever their zero padding.
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+def _padded(size):
+    return -(-size // BLOCK) * BLOCK
+
+def _map(shard, end):
+    """
+    Memory map of a shard, cached for the lifetime of the process and remapped when the
+    shard grew past `end` since it was mapped.
+    """
+    mapped = _maps.get(shard)
+    if mapped is None or len(mapped) < end:
+        with open(shard, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _maps[shard] = mapped
+    return mapped
+
+class ShardRecord:
+    """
+    One image of a shard set: its name, shard path, and the offset, size and content hash of its
+    encoded bytes. Records are small and picklable, so they are sent to the workers instead of
+    the bytes; each worker maps the shards itself.
+    """
+
+    __slots__ = ("name", "shard", "offset", "size", "hash")
+
+    def __init__(self, name, shard, offset, size, hash):
+        self.name = name
+        self.shard = shard
+        self.offset = offset
+        self.size = size
+        self.hash = hash
+
+    def __str__(self):
+        return f"{os.path.basename(self.shard)}/{self.name}"
+
+    def __repr__(self):
+        return f"ShardRecord({self})"
+
+    # Equal by location, so copies coming back from a process worker match the originals
+    def __eq__(self, other):
+        return isinstance(other, ShardRecord) and (self.shard, self.offset) == (other.shard, other.offset)
+
+    def __hash__(self):
+        return hash((self.shard, self.offset))
+
+    def array(self):
+        """
+        The encoded bytes as a uint8 array, a view of the memory-mapped shard (no copy).
+        """
+        return np.frombuffer(_map(self.shard, self.offset + self.size), dtype=np.uint8, count=self.size,
+                             offset=self.offset)
+
+class ShardSet:
+    """
+    Reader of a shard set. The index is read once; images are read through memory maps of the
+    shards (`ShardRecord.array`) or as a sequential stream (`stream`).
+    If the same name was added several times, the last copy wins.
+
+    Parameters:
+    - path: directory of the shard set
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._records = {}
+
+        index = os.path.join(path, INDEX_NAME)
+        if not os.path.exists(index):
+            raise ValueError(f"{path} is not a shard set (no {INDEX_NAME})")
+        sizes = {}
+        with open(index, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Truncated last line after a crash
+                shard = os.path.join(path, entry["shard"])
+                if shard not in sizes:
+                    sizes[shard] = os.path.getsize(shard) if os.path.exists(shard) else 0
+                # Entries written before their bytes reached the disk are dropped
+                if entry["offset"] + entry["size"] <= sizes[shard]:
+                    self._records[entry["name"]] = ShardRecord(entry["name"], shard, entry["offset"],
+                                                               entry["size"], entry["hash"])
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def get(self, name):
+        return self._records.get(name)
+
+    def records(self):
+        """
+        All records, sorted by name (see `natural_key`).
+        """
+        return [self._records[name] for name in sorted(self._records, key=natural_key)]
+
+    def stream(self, records=None):
+        """
+        Reads images with large sequential reads, shard by shard in offset order, without
+        memory maps (e.g. over a network filesystem).
+
+        Yields:
+        - (record, bytes) for the given records (default all)
+        """
+        records = self.records() if records is None else records
+        by_shard = {}
+        for record in records:
+            by_shard.setdefault(record.shard, []).append(record)
+        for shard in sorted(by_shard):
+            with open(shard, "rb", buffering=1 << 20) as f:
+                for record in sorted(by_shard[shard], key=lambda r: r.offset):
+                    f.seek(record.offset)
+                    yield record, f.read(record.size)
+
+class ShardWriter:
+    """
+    Appends images to a shard set: each image is a tar member of the current shard, and its
+    offset is appended to the index once its bytes are written. A new shard is started when the
+    current one would exceed `max_bytes`. Re-adding an image with the same content is a no-op.
+    Only one writer may be open on a shard set at a time; an interrupted writer loses at most the
+    images written since the last `flush`.
+
+    Parameters:
+    - path: directory of the shard set (created if missing)
+    - max_bytes: shard size (default config.SHARD_MAX_BYTES)
+    """
+
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes or config.SHARD_MAX_BYTES
+        os.makedirs(path, exist_ok=True)
+
+        index = os.path.join(path, INDEX_NAME)
+        self.records = ShardSet(path)._records if os.path.exists(index) else {}
+        _cut_partial_line(index)
+        shards = sorted(f for f in os.listdir(path) if f.startswith("shard-") and f.endswith(".tar"))
+        self._number = len(shards) - 1 if shards else 0
+        self._shard = None
+        self._open_shard()
+        self._index = open(index, "a", encoding="utf-8")
+
+    def _open_shard(self):
+        """
+        Opens the current shard for appending, cut after its last indexed image (this drops the
+        end-of-archive blocks and anything an interrupted writer left behind).
+        """
+        shard = os.path.join(self.path, SHARD_PATTERN.format(self._number))
+        end = max((_padded(r.offset + r.size) for r in self.records.values() if r.shard == shard), default=0)
+        self._shard_path = shard
+        self._shard = open(shard, "r+b" if os.path.exists(shard) else "w+b")
+        self._shard.truncate(end)
+        self._shard.seek(end)
+
+    def _close_shard(self):
+        # End-of-archive marker, so the shard is a complete tar file
+        self._shard.write(b"\0" * (2 * BLOCK))
+        self._shard.close()
+        _maps.pop(self._shard_path, None)
+
+    def add(self, name, data):
+        """
+        Appends one encoded image.
+
+        Returns:
+        - its `ShardRecord`, or None if the same content is already stored under this name
+        """
+        data = bytes(data)
+        digest = _content_hash(data)
+        current = self.records.get(name)
+        if current is not None and current.hash == digest:
+            return None
+
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        header = info.tobuf(format=tarfile.PAX_FORMAT)
+
+        position = self._shard.tell()
+        if position and position + len(header) + _padded(len(data)) + 2 * BLOCK > self.max_bytes:
+            self._close_shard()
+            self._number += 1
+            self._open_shard()
+            position = 0
+
+        self._shard.write(header)
+        self._shard.write(data)
+        self._shard.write(b"\0" * (_padded(len(data)) - len(data)))
+
+        record = ShardRecord(name, self._shard_path, position + len(header), len(data), digest)
+        self.records[name] = record
+        self._index.write(json.dumps({"name": name, "shard": os.path.basename(self._shard_path),
+                                      "offset": record.offset, "size": record.size, "hash": digest}) + "\n")
+        return record
+
+    def flush(self):
+        # The bytes first, so the index never points past the end of a shard
+        self._shard.flush()
+        os.fsync(self._shard.fileno())
+        self._index.flush()
+        os.fsync(self._index.fileno())
+
+    def close(self):
+        self.flush()
+        self._close_shard()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _cut_partial_line(path):
+    """
+    Drops the truncated last line an interrupted writer may have left in an index.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) == b"\n":
+            return
+        size = f.tell()
+        f.seek(max(0, size - (1 << 20)))
+        tail = f.read()
+        f.truncate(size - len(tail) + tail.rfind(b"\n") + 1)
+
+def is_shard_set(path):
+    return os.path.exists(os.path.join(path, INDEX_NAME))
+
+def list_images(source):
+    """
+    The PNG images of a source, sorted by name (see `natural_key`): file paths for a directory,
+    `ShardRecord`s for a shard set. Every stage accepts either kind of item.
+    """
+    if is_shard_set(source):
+        return ShardSet(source).records()
+    names = sorted((f for f in os.listdir(source) if f.lower().endswith(".png")), key=natural_key)
+    return [os.path.join(source, f) for f in names]
+
+def image_lookup(source):
+    """
+    Dict image name -> item (path or `ShardRecord`) of a source, to find images by file name.
+    """
+    return {image_name(item): item for item in list_images(source)}
+
+def image_name(item):
+    """
+    File name of an image, a path or a `ShardRecord`.
+    """
+    return item.name if isinstance(item, ShardRecord) else os.path.basename(item)
+
+def read_bytes(item):
+    """
+    Encoded bytes of an image (path or `ShardRecord`) as a uint8 array.
+    """
+    if isinstance(item, ShardRecord):
+        return item.array()
+    return np.fromfile(item, dtype=np.uint8)
+
+def pack(input_dir, output, max_bytes=None, remove=False):
+    """
+    Packs the PNGs of a directory into a shard set (appending to it if it exists), in name order.
+
+    Parameters:
+    - input_dir: directory of loose PNGs
+    - output: directory of the shard set
+    - max_bytes: shard size (default config.SHARD_MAX_BYTES)
+    - remove: delete every loose file once it is safely stored
+
+    Returns:
+    - number of images added
+    """
+    paths = list_images(input_dir)
+    added = 0
+    with ShardWriter(output, max_bytes) as writer, tqdm(total=len(paths), desc="Pack") as progress:
+        for start in range(0, len(paths), PACK_FLUSH_EVERY):
+            batch = paths[start:start + PACK_FLUSH_EVERY]
+            for path in batch:
+                with open(path, "rb") as f:
+                    added += writer.add(os.path.basename(path), f.read()) is not None
+            writer.flush()
+            if remove:
+                for path in batch:
+                    os.remove(path)
+            progress.update(len(batch))
+    print(f"✅ {added} images packed into {output} ({len(paths) - added} already there)")
+    return added
+
+def unpack(source, output_dir):
+    """
+    Writes the images of a shard set back as loose PNGs.
+    """
+    shard_set = ShardSet(source)
+    os.makedirs(output_dir, exist_ok=True)
+    for record, data in tqdm(shard_set.stream(), total=len(shard_set), desc="Unpack"):
+        with open(os.path.join(output_dir, record.name), "wb") as f:
+            f.write(data)
+    print(f"✅ {len(shard_set)} images written to {output_dir}")
+
+def verify(source):
+    """
+    Re-hashes every image of a shard set, reading the shards sequentially.
+
+    Returns:
+    - list of the names whose bytes do not match the index
+    """
+    shard_set = ShardSet(source)
+    bad = [record.name for record, data in tqdm(shard_set.stream(), total=len(shard_set), desc="Verify")
+           if _content_hash(data) != record.hash]
+    shards = {record.shard for record in shard_set.records()}
+    print(f"{'✅' if not bad else '❌'} {len(shard_set)} images in {len(shards)} shards, {len(bad)} corrupted")
+    return bad
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shard sets: many images packed into a few large tar files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = commands.add_parser("pack", help="pack a directory of PNGs into a shard set")
+    pack_parser.add_argument("input_dir")
+    pack_parser.add_argument("output")
+    pack_parser.add_argument("--max-bytes", type=int, default=None, help="default: config.SHARD_MAX_BYTES")
+    pack_parser.add_argument("--remove", action="store_true", help="delete the loose PNGs once packed")
+
+    unpack_parser = commands.add_parser("unpack", help="write the images of a shard set as loose PNGs")
+    unpack_parser.add_argument("source")
+    unpack_parser.add_argument("output_dir")
+
+    verify_parser = commands.add_parser("verify", help="check the content hashes of a shard set")
+    verify_parser.add_argument("source")
+
+    args = parser.parse_args()
+    if args.command == "pack":
+        pack(args.input_dir, args.output, args.max_bytes, args.remove)
+    elif args.command == "unpack":
+        unpack(args.source, args.output_dir)
+    else:
+        verify(args.source)
@@ -0,0 +1,318 @@
+import os
+import json
+import argparse
+
+import numpy as np
+
+import data_preprocessing.config as config
+from data_preprocessing.matrix_store import HOLD, MATRIX_SHAPE
+
+# Elements (queries x rows) compared at once, bounds the temporary arrays to a few MB
+BLOCK_ELEMENTS = 1 << 22
+
+METRICS = ("jaccard", "hamming")
+
+def pack_words(masks):
+    """
+    Packs binary masks of shape (N, 18, 11) into rows of uint64 words: 198 bits -> 4 words,
+    padded with zeros.
+    """
+    masks = np.asarray(masks)
+    bits = masks.reshape(len(masks), -1).astype(bool)
+    words = (bits.shape[1] + 63) // 64
+    packed = np.packbits(bits, axis=1, bitorder="little")
+    padded = np.zeros((len(masks), words * 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view(np.uint64)
+
+def _popcount(words):
+    return np.bitwise_count(words).sum(axis=-1, dtype=np.int32)
+
+def _grow(buffer, size):
+    """
+    Returns `buffer` with room for at least `size` rows (doubling its capacity when needed).
+    """
+    if len(buffer) >= size:
+        return buffer
+    grown = np.zeros((max(size, 2 * len(buffer)),) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:len(buffer)] = buffer
+    return grown
+
+def _scores(intersection, count_a, count_b, metric):
+    if metric == "hamming":
+        return count_a + count_b - 2 * intersection
+    union = count_a + count_b - intersection
+    return np.divide(intersection, union, out=np.zeros(intersection.shape, dtype=np.float32),
+                     where=union > 0, dtype=np.float32)
+
+class SimilarityIndex:
+    """
+    Nearest-neighbour index over hold matrices. Every route is a row of 4 uint64 words (the
+    198 cells of one channel), so Jaccard/Hamming similarities are a bitwise AND plus a
+    vectorized popcount per word, with no Python loop over routes.
+
+    Stored as three files: `path` (the raw words, memory-mappable), `path.json` (layout) and
+    `path.keys` (one key per row, e.g. the screenshot file name). Rows can be appended.
+
+    Parameters:
+    - path: index file (default config.SIMILARITY_INDEX)
+    - channel: matrix channel indexed when full (18, 11, 3) matrices are given (default HOLD)
+    - mmap: if True, the words are memory-mapped instead of read
+    """
+
+    def __init__(self, path=None, channel=HOLD, mmap=True):
+        self.path = path or config.SIMILARITY_INDEX
+        self.mmap = mmap
+        self.shape = MATRIX_SHAPE[:2]
+        self.words = (int(np.prod(self.shape)) + 63) // 64
+
+        if os.path.exists(self.path + ".json"):
+            with open(self.path + ".json", "r", encoding="utf-8") as f:
+                header = json.load(f)
+            if tuple(header["shape"]) != self.shape or header["words"] != self.words:
+                raise ValueError(f"{self.path} was built for matrices of shape {tuple(header['shape'])}")
+            self.channel = header["channel"]
+        else:
+            self.channel = channel
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".json", "w", encoding="utf-8") as f:
+                json.dump({"shape": list(self.shape), "words": self.words, "channel": channel}, f)
+            open(self.path, "wb").close()
+            open(self.path + ".keys", "w").close()
+        self._load()
+
+    def _load(self):
+        size = os.path.getsize(self.path) // (self.words * 8)
+        if size and not self.mmap:
+            words = np.fromfile(self.path, dtype=np.uint64, count=size * self.words).reshape(size, self.words)
+        else:
+            words = self._map(size)
+        with open(self.path + ".keys", "r", encoding="utf-8") as f:
+            self.keys = f.read().splitlines()[:size]
+
+        self._size = 0
+        self._rows = np.zeros((0, self.words), dtype=np.uint64)
+        self._counts = np.zeros(0, dtype=np.int32)
+        self._buffers = [np.zeros(0, dtype=np.uint64) for _ in range(self.words)]
+        self._extend(words)
+
+    def _map(self, size):
+        if size == 0:
+            return np.zeros((0, self.words), dtype=np.uint64)
+        return np.memmap(self.path, dtype=np.uint64, mode="r", shape=(size, self.words))
+
+    def _extend(self, words):
+        """
+        Appends packed rows to the in-memory arrays. The buffers grow by doubling, so adding
+        routes one batch at a time costs the size of the batch, not of the whole index.
+        """
+        start, end = self._size, self._size + len(words)
+        self._counts = _grow(self._counts, end)
+        self._counts[start:end] = _popcount(words)
+        for w in range(self.words):
+            self._buffers[w] = _grow(self._buffers[w], end)
+            self._buffers[w][start:end] = words[:, w]
+        if self.mmap:
+            # The file already holds the new rows: only the mapped length changes
+            self.vectors = self._map(end)
+        else:
+            self._rows = _grow(self._rows, end)
+            self._rows[start:end] = words
+            self.vectors = self._rows[:end]
+
+        self._size = end
+        self.counts = self._counts[:end]
+        # One contiguous column per word, so the scans stream through memory
+        self._columns = [buffer[:end] for buffer in self._buffers]
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _as_words(self, matrices):
+        """
+        Accepts (18, 11) masks, (18, 11, 3) matrices (the index channel is used), batches of
+        either, or already packed words.
+        """
+        matrices = np.asarray(matrices)
+        if matrices.dtype == np.uint64:
+            return matrices.reshape(-1, self.words)
+        if matrices.shape[-1] == MATRIX_SHAPE[-1] and matrices.shape[-3:] == MATRIX_SHAPE:
+            matrices = matrices[..., self.channel]
+        return pack_words(matrices.reshape(-1, *self.shape))
+
+    def add(self, matrices, keys=None):
+        """
+        Appends routes to the index (and to the files on disk).
+
+        Parameters:
+        - matrices: batch of matrices or masks (see `_as_words`)
+        - keys: one key per route (default: the row numbers)
+        """
+        words = self._as_words(matrices)
+        if keys is None:
+            keys = range(len(self), len(self) + len(words))
+        keys = [str(key) for key in keys]
+        if len(keys) != len(words):
+            raise ValueError(f"Got {len(keys)} keys for {len(words)} matrices")
+
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(words).tobytes())
+        with open(self.path + ".keys", "a", encoding="utf-8") as f:
+            f.writelines(key + "\n" for key in keys)
+        self.keys.extend(keys)
+        self._extend(words)
+
+    def _intersections(self, queries, rows=slice(None)):
+        inter = None
+        for w, column in enumerate(self._columns):
+            part = np.bitwise_count(queries[:, w, None] & column[None, rows])
+            inter = part.astype(np.int32) if inter is None else inter + part
+        return inter
+
+    def query(self, matrices, k=10, metric="jaccard"):
+        """
+        Returns the k nearest routes of every query.
+
+        Parameters:
+        - matrices: one matrix/mask or a batch of them
+        - k: number of neighbours
+        - metric: "jaccard" (similarity, highest first) or "hamming" (distance, lowest first)
+
+        Returns:
+        - (indices, scores) arrays of shape (Q, k), best first; use `keys[i]` for the names
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+        queries = self._as_words(matrices)
+        k = min(k, len(self))
+        indices = np.zeros((len(queries), k), dtype=np.int64)
+        scores = np.zeros((len(queries), k), dtype=np.int32 if metric == "hamming" else np.float32)
+        if k == 0:
+            return indices, scores
+
+        batch = max(1, BLOCK_ELEMENTS // max(1, len(self)))
+        for start in range(0, len(queries), batch):
+            q = queries[start:start + batch]
+            s = _scores(self._intersections(q), _popcount(q)[:, None], self.counts[None, :], metric)
+            order_key = s if metric == "hamming" else -s
+            top = np.argpartition(order_key, k - 1, axis=1)[:, :k]
+            top = np.take_along_axis(top, np.argsort(np.take_along_axis(order_key, top, axis=1), axis=1), axis=1)
+            indices[start:start + batch] = top
+            scores[start:start + batch] = np.take_along_axis(s, top, axis=1)
+        return indices, scores
+
+    def near_duplicates(self, min_jaccard=None, max_hamming=None, block=1024):
+        """
+        Finds every pair of routes of the index closer than a threshold (all pairs, each once).
+        Rows are sorted by number of holds, so each block is only compared with the rows whose
+        hold count can still reach the threshold.
+
+        Parameters:
+        - min_jaccard: keep pairs with Jaccard similarity >= this value, or
+        - max_hamming: keep pairs with Hamming distance <= this value
+
+        Returns:
+        - (i, j, score) arrays of row indices (i < j in index order) and their score
+        """
+        if (min_jaccard is None) == (max_hamming is None):
+            raise ValueError("Give exactly one of min_jaccard or max_hamming")
+        if min_jaccard is not None and min_jaccard <= 0:
+            raise ValueError(f"min_jaccard must be > 0 (every pair has Jaccard >= 0), got {min_jaccard}")
+        metric = "jaccard" if min_jaccard is not None else "hamming"
+
+        order = np.argsort(self.counts, kind="stable")
+        counts = self.counts[order]
+        columns, self._columns = self._columns, [column[order] for column in self._columns]
+        found_i, found_j, found_s = [], [], []
+        try:
+            for start in range(0, len(order), block):
+                end = min(start + block, len(order))
+                top = counts[end - 1]
+                # |A n B| / |A u B| <= min/max count, and hamming >= the count difference
+                limit = top / min_jaccard if metric == "jaccard" else top + max_hamming
+                stop = int(np.searchsorted(counts, limit, side="right"))
+
+                q = np.stack([column[start:end] for column in self._columns], axis=1)
+                s = _scores(self._intersections(q, slice(start, stop)),
+                            counts[start:end, None], counts[None, start:stop], metric)
+                keep = s >= min_jaccard if metric == "jaccard" else s <= max_hamming
+                # Each pair once: only j after i
+                keep &= np.arange(start, end)[:, None] < np.arange(start, stop)[None, :]
+                rows, cols = np.nonzero(keep)
+                found_i.append(order[rows + start])
+                found_j.append(order[cols + start])
+                found_s.append(s[rows, cols])
+        finally:
+            self._columns = columns
+
+        if not found_i:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        i, j, s = np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_s)
+        return np.minimum(i, j), np.maximum(i, j), s
+
+def build_index(csv_path=None, index_path=None, channel=HOLD):
+    """
+    Builds (from scratch) the similarity index of a dataset written by `build_csv`.
+
+    Returns:
+    - the `SimilarityIndex`
+    """
+    from data_preprocessing.matrix_store import load_dataset
+
+    csv_path = csv_path or config.FINAL_CSV
+    index_path = index_path or config.SIMILARITY_INDEX
+    for suffix in ("", ".json", ".keys"):
+        if os.path.exists(index_path + suffix):
+            os.remove(index_path + suffix)
+
+    df, matrices = load_dataset(csv_path, channel=channel)
+    index = SimilarityIndex(index_path, channel=channel)
+    index.add(matrices, keys=df["filename"])
+    print(f"✅ {len(index)} routes indexed in: {index_path}")
+    return index
+
+if __name__ == "__main__":
+    import time
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Similarity index over the hold matrices")
+    parser.add_argument("--index", default=None, help="index file (default: config.SIMILARITY_INDEX)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="index every route of a dataset")
+    build.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+
+    query = commands.add_parser("query", help="routes most similar to the given ones")
+    query.add_argument("keys", nargs="+", help="file names of indexed routes")
+    query.add_argument("-k", type=int, default=10)
+    query.add_argument("--metric", choices=METRICS, default="jaccard")
+
+    dups = commands.add_parser("dups", help="all pairs of near-duplicate routes")
+    dups.add_argument("--min-jaccard", type=float, default=None)
+    dups.add_argument("--max-hamming", type=int, default=None)
+    dups.add_argument("--output", default="near_duplicates.csv")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_index(args.csv, args.index)
+    elif args.command == "query":
+        index = SimilarityIndex(args.index)
+        positions = {key: i for i, key in enumerate(index.keys)}
+        start = time.perf_counter()
+        indices, scores = index.query(index.vectors[[positions[key] for key in args.keys]], k=args.k + 1,
+                                      metric=args.metric)
+        print(f"⏱️ {len(args.keys)} queries over {len(index)} routes in {(time.perf_counter() - start) * 1000:.1f} ms")
+        for key, row, row_scores in zip(args.keys, indices, scores):
+            print(f"🔎 {key}")
+            for i, score in zip(row, row_scores):
+                if index.keys[i] != key:
+                    print(f"   {score:8.3f}  {index.keys[i]}")
+    else:
+        index = SimilarityIndex(args.index)
+        start = time.perf_counter()
+        if args.min_jaccard is None and args.max_hamming is None:
+            args.max_hamming = 0
+        i, j, s = index.near_duplicates(args.min_jaccard, args.max_hamming)
+        keys = np.asarray(index.keys)
+        pd.DataFrame({"route_a": keys[i], "route_b": keys[j], "score": s}).to_csv(args.output, index=False)
+        print(f"✅ {len(i)} pairs in {time.perf_counter() - start:.1f}s, saved in: {args.output}")
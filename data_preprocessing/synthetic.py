@@ -0,0 +1,169 @@
+import os
+import cv2
+import numpy as np
+
+import data_preprocessing.config as config
+from data_preprocessing.matrix_store import DatasetWriter, MATRIX_SHAPE
+
+# Size of a synthetic screenshot, large enough for HEADER_COORDS and BOARD_COORDS
+SCREEN_SIZE = (2400, 1440)  # (height, width)
+
+# BGR colours, inside the HSV ranges of config.py
+YELLOW = (0, 215, 255)
+HOLD_COLORS = {"start": (0, 255, 0), "hold": (255, 0, 0), "end": (0, 0, 255)}
+
+TRUTH_COLUMNS = ["filename", "grade", "benchmark", "stars"]
+
+def random_route(rng):
+    """
+    Draws a random route: grade, stars, benchmark flag and an (18, 11, 3) hold matrix
+    with 1-2 start holds, 1-2 end holds and a few intermediate holds.
+    """
+    matrix = np.zeros(MATRIX_SHAPE, dtype=np.uint8)
+    cells = rng.choice(18 * 11, size=rng.integers(5, 14), replace=False)
+    rows, cols = np.unravel_index(cells, (18, 11))
+    matrix[rows, cols, 0] = 1
+
+    # Lowest holds are the starts, highest ones the ends (row 0 is the top of the board)
+    order = np.argsort(rows)
+    n_end, n_start = rng.integers(1, 3), rng.integers(1, 3)
+    matrix[rows[order[:n_end]], cols[order[:n_end]], 2] = 1
+    matrix[rows[order[-n_start:]], cols[order[-n_start:]], 1] = 1
+
+    return {
+        "grade": str(rng.choice(config.GRADE_VOCABULARY)),
+        "stars": int(rng.integers(0, 6)),
+        "benchmark": bool(rng.random() < 0.2),
+        "matrix": matrix,
+    }
+
+def draw_benchmark_icon(image, center, radius=14):
+    cv2.circle(image, center, radius, YELLOW, -1)
+    cv2.putText(image, "B", (center[0] - 8, center[1] + 8), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+
+def render_header(route, name, height, width):
+    """
+    Renders a header like the app's: name, setter, grade line and the 5 stars row,
+    plus the yellow 'B' icon for benchmarks.
+    """
+    header = np.full((height, width, 3), 255, dtype=np.uint8)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    grade = route["grade"]
+    cv2.putText(header, name, (10, 25), font, 0.7, (0, 0, 0), 2)
+    cv2.putText(header, "Set by synthetic", (10, 55), font, 0.6, (0, 0, 0), 1)
+    cv2.putText(header, f"Grade: User {grade}/V5 Setter {grade}/V5", (10, 85), font, 0.6, (0, 0, 0), 1)
+
+    if route["benchmark"]:
+        draw_benchmark_icon(header, benchmark_icon_center(height, width))
+
+    # Stars row, inside the region read by count_stars
+    y = int(0.9 * height)
+    x1, x2 = int(0.38 * width), int(0.624 * width)
+    step = (x2 - x1) // 5
+    for i in range(5):
+        center = (x1 + i * step + step // 2, y)
+        if i < route["stars"]:
+            cv2.circle(header, center, 10, YELLOW, -1)
+        else:
+            cv2.circle(header, center, 10, (160, 160, 160), 1)
+    return header
+
+def benchmark_icon_center(height, width):
+    return int(0.85 * width), int(0.16 * height)
+
+def render_board(matrix, height, width, rng):
+    """
+    Renders a board with grey, unsaturated holds and a coloured ring around each used hold.
+    """
+    board = np.full((height, width, 3), 35, dtype=np.uint8)
+    cell_h, cell_w = height // 18, width // 11
+    radius = int(0.38 * min(cell_h, cell_w))
+
+    # Unused holds: low saturation, so they never match the HSV ranges
+    for row in range(18):
+        for col in range(11):
+            center = (int((col + 0.5) * cell_w), int((row + 0.5) * cell_h))
+            shade = int(rng.integers(60, 140))
+            cv2.circle(board, center, radius // 2, (shade, shade, shade + 10), -1)
+
+            if matrix[row, col, 1]:
+                color = HOLD_COLORS["start"]
+            elif matrix[row, col, 2]:
+                color = HOLD_COLORS["end"]
+            elif matrix[row, col, 0]:
+                color = HOLD_COLORS["hold"]
+            else:
+                continue
+            cv2.circle(board, center, radius, color, 4)
+    return board
+
+def render_screenshot(route, name, rng):
+    """
+    Renders a full synthetic screenshot matching the config.py layout.
+
+    Parameters:
+    - route: dictionary from `random_route`
+    - name: route name written in the header
+    - rng: numpy random Generator
+
+    Returns:
+    - BGR image of shape SCREEN_SIZE + (3,)
+    """
+    screen = np.full((*SCREEN_SIZE, 3), 20, dtype=np.uint8)
+
+    y1, y2, x1, x2 = config.HEADER_COORDS
+    screen[y1:y2, x1:x2] = render_header(route, name, y2 - y1, x2 - x1)
+
+    y1, y2, x1, x2 = config.BOARD_COORDS
+    screen[y1:y2, x1:x2] = render_board(route["matrix"], y2 - y1, x2 - x1, rng)
+    return screen
+
+def generate_corpus(output_dir, n, seed=0):
+    """
+    Generates `n` synthetic screenshots with known ground truth.
+
+    Writes to `output_dir`:
+    - raw/: the screenshots (PNG)
+    - truth.csv + truth.bits: ground truth (see `matrix_store.load_dataset`)
+    - template_benchmark.png: the 'B' icon template
+    - grade_templates.npz: grade templates built from the ground truth
+
+    Returns:
+    - path of the raw screenshots directory
+    """
+    from data_preprocessing.grade_recognizer import build_grade_templates
+
+    rng = np.random.default_rng(seed)
+    raw_dir = os.path.join(output_dir, "raw")
+    os.makedirs(raw_dir, exist_ok=True)
+
+    rows, matrices = [], []
+    for i in range(n):
+        route = random_route(rng)
+        filename = f"moonboard_{i:05}.png"
+        cv2.imwrite(os.path.join(raw_dir, filename), render_screenshot(route, f"Route {i}", rng))
+        rows.append({"filename": filename, "grade": route["grade"],
+                     "benchmark": route["benchmark"], "stars": route["stars"]})
+        matrices.append(route["matrix"])
+
+    truth_csv = os.path.join(output_dir, "truth.csv")
+    with DatasetWriter(truth_csv, TRUTH_COLUMNS, append=False) as writer:
+        writer.write(rows, matrices)
+
+    # Benchmark template: the icon drawn alone, cropped around its center
+    y1, y2, x1, x2 = config.HEADER_COORDS
+    icon = np.full((y2 - y1, x2 - x1, 3), 255, dtype=np.uint8)
+    cx, cy = benchmark_icon_center(y2 - y1, x2 - x1)
+    draw_benchmark_icon(icon, (cx, cy))
+    cv2.imwrite(os.path.join(output_dir, "template_benchmark.png"), icon[cy - 16:cy + 16, cx - 16:cx + 16])
+
+    # Grade templates from the headers of the corpus and their true grades
+    header_dir = os.path.join(output_dir, "truth_headers")
+    os.makedirs(header_dir, exist_ok=True)
+    for row in rows[: 20 * len(config.GRADE_VOCABULARY)]:
+        screen = cv2.imread(os.path.join(raw_dir, row["filename"]))
+        cv2.imwrite(os.path.join(header_dir, row["filename"]), screen[y1:y2, x1:x2])
+    build_grade_templates(header_dir, truth_csv, os.path.join(output_dir, "grade_templates.npz"))
+
+    print(f"✅ {n} synthetic screenshots saved in: {raw_dir}")
+    return raw_dir
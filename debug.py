@@ -1,52 +1,130 @@
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+import os
+import csv
+import json
+import random
+import argparse
+
+import data_preprocessing.config as config
+
+# Layout of the packed matrices (see data_preprocessing/matrix_store.py), kept here so a route
+# can be read without importing numpy
+ROWS, COLUMNS, CHANNELS = 18, 11, 3
+HOLD, START, END = 0, 1, 2
 
 def plot_hold_matrix(matrix, title="Hold Matrix"):
     """
-    Visualizes an 18x11 climbing hold matrix as a MoonBoard-style grid.
-    
-    Values:
-    - 0 → black (no hold)
-    - 1 → green (hold present)
+    Visualizes an 18x11 climbing hold matrix as a MoonBoard-style grid, drawn as one image
+    by `render.render_matrices` (row 0 at the bottom, as before).
 
     Parameters:
-    - matrix: numpy array of shape (18, 11), binary matrix representing holds.
+    - matrix: numpy array of shape (18, 11), binary matrix representing holds,
+      or (18, 11, 3) to also show the start/end holds.
     - title: title for the plot (default is "Hold Matrix").
     """
-    
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from data_preprocessing.render import render_matrices
+
+    image = render_matrices(np.flipud(np.asarray(matrix))[None])[0]
     fig, ax = plt.subplots(figsize=(6, 9))
-    for i in range(matrix.shape[0]):  # filas
-        for j in range(matrix.shape[1]):  # columnas
-            color = "green" if matrix[i, j] == 1 else "black"
-            rect = plt.Rectangle((j, 17 - i), 1, 1, facecolor=color)
-            ax.add_patch(rect)
-
-    ax.set_xlim(0, 11)
-    ax.set_ylim(0, 18)
-    ax.set_xticks(np.arange(0, 11))
-    ax.set_yticks(np.arange(0, 18))
-    ax.set_xticklabels([])
-    ax.set_yticklabels([])
+    ax.imshow(image[..., ::-1])  # BGR -> RGB
+    ax.set_xticks([])
+    ax.set_yticks([])
     ax.set_title(title)
-    ax.set_aspect('equal')
-    ax.grid(True)
-    plt.gca().invert_yaxis()
     plt.show()
 
+def read_route(csv_path=None, route=None):
+    """
+    Reads one route of a dataset with the standard library only: its CSV row and its
+    matrix, unpacked from the bytes of that row in the .bits file.
+
+    Parameters:
+    - csv_path: dataset CSV (default config.FINAL_CSV)
+    - route: screenshot file name (its last row is used), row number, or None for a random row
+
+    Returns:
+    - (row number, dict of the CSV columns, matrix as nested lists [row][column][channel])
+    """
+    csv_path = csv_path or config.FINAL_CSV
+    bits_path = os.path.splitext(csv_path)[0] + ".bits"
+    with open(bits_path + ".json", "r", encoding="utf-8") as f:
+        header = json.load(f)
+    row_bytes = header["row_bytes"]
+    matrices = os.path.getsize(bits_path) // row_bytes
+
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))[:matrices]
+    if not rows:
+        raise ValueError(f"{csv_path} is empty")
+
+    if route is None:
+        index = random.randrange(len(rows))
+    elif str(route).isdigit():
+        index = int(route)
+        if index >= len(rows):
+            raise ValueError(f"{csv_path} has {len(rows)} routes, there is no row {index}")
+    else:
+        matches = [i for i, row in enumerate(rows) if row["filename"] == route]
+        if not matches:
+            raise ValueError(f"{route} is not in {csv_path}")
+        index = matches[-1]
+
+    with open(bits_path, "rb") as f:
+        f.seek(index * row_bytes)
+        packed = f.read(row_bytes)
+    # np.packbits order: flattened (row, column, channel), most significant bit first
+    bits = [(packed[k // 8] >> (7 - k % 8)) & 1 for k in range(ROWS * COLUMNS * CHANNELS)]
+    matrix = [[bits[(i * COLUMNS + j) * CHANNELS:(i * COLUMNS + j + 1) * CHANNELS] for j in range(COLUMNS)]
+              for i in range(ROWS)]
+    return index, rows[index], matrix
+
+def format_route(matrix):
+    """
+    Text drawing of a route: S start hold, E end hold, o any other hold. Row 18 is on top,
+    as on the board.
+    """
+    lines = ["    " + " ".join(chr(65 + j) for j in range(COLUMNS))]
+    for i, row in enumerate(matrix):
+        cells = []
+        for cell in row:
+            cells.append("S" if cell[START] else "E" if cell[END] else "o" if cell[HOLD] else ".")
+        lines.append(f"{ROWS - i:>3} " + " ".join(cells))
+    return "\n".join(lines)
+
+def main(csv_path=None, route=None, plot=False, png=None):
+    """
+    Prints one route of the dataset (a random one by default) and optionally plots it
+    or saves its drawing as a PNG (no display needed).
+    """
+    index, row, matrix = read_route(csv_path, route)
 
+    # Key information
+    print(f"🔢 Row: {index}")
+    print("🖼️ Image filename:", row["filename"])
+    print("🎯 Grade:", row["grade"])
+    print("⭐ Benchmark:", row["benchmark"])
+    print("🌟 Stars:", row["stars"])
+    print(format_route(matrix))
 
-# loading CSV
-df = pd.read_csv("final_data.csv", converters={"matrix": eval})
+    if plot or png:
+        import numpy as np
 
-# Select a random sample
-sample = df.sample(1).iloc[0]
+        matrix = np.array(matrix, dtype=np.uint8)
+        if png:
+            import cv2
+            from data_preprocessing.render import render_matrices
 
-# Key information
-print("🖼️ Image filename:", sample["filename"])
-print("🎯 Grade:", sample["grade"])
-print("⭐ Benchmark:", sample["benchmark"])
-print("🌟 Stars:", sample["stars"])
+            cv2.imwrite(png, render_matrices(matrix[None])[0])
+            print(f"✅ Route drawing saved in: {png}")
+        if plot:
+            plot_hold_matrix(np.flipud(matrix), title=row["filename"])
 
-matrix_flipped = np.flipud(sample["matrix"])
-plot_hold_matrix(matrix_flipped)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show one route of the dataset")
+    parser.add_argument("route", nargs="?", default=None,
+                        help="screenshot file name or row number (default: a random route)")
+    parser.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+    parser.add_argument("--no-plot", action="store_true", help="only print the route")
+    parser.add_argument("--png", default=None, help="save the drawing of the route in this file")
+    args = parser.parse_args()
+    main(csv_path=args.csv, route=args.route, plot=not args.no_plot, png=args.png)
@@ -1,40 +1,386 @@
-from data_preprocessing.parallel_cropper import crop_header
-from data_preprocessing.ocr_parallel_extractor import extract_metadata
-from data_preprocessing.build_dataframe import build_csv
-from data_preprocessing.image_to_matrix import image_to_matrix
+import os
+import sys
+import argparse
 
 import data_preprocessing.config as config
 
-def main():
-
-    print("📦 Paso 1: Header cropping...")
-    crop_header(
-        input_dir=config.RAW_DIR,
-        output_dir=config.HEADERS_DIR,
-        coords=config.HEADER_COORDS
-    )
-
-    print("🎯 Paso 2: Board cropping...")
-    crop_header(
-        input_dir=config.RAW_DIR,
-        output_dir=config.BOARDS_DIR,
-        coords=config.BOARD_COORDS
-    )
-
-    print("🔎 Paso 3: Extracting metadata from headers...")
-    df = extract_metadata(config.HEADERS_DIR)
-    df.to_csv(config.METADATA_CSV, index=False)
+# Every stage imports its dependencies (cv2, pandas, pytesseract, ...) when it runs, so cheap
+# commands such as `inspect` start without loading them
+
+COMMANDS = ("build", "crop", "dedup", "ocr", "matrix", "rederive", "templates", "benchmark-flag", "inspect", "sheets",
+            "calibrate")
+
+# Files each stage writes, removed by --rebuild together with its manifest entries
+STAGE_OUTPUTS = {
+    "crop_header": (),
+    "crop_board": (),
+    "dedup": (config.DEDUP_INDEX,),
+    "ocr": (config.METADATA_CSV,),
+    "matrix": (config.FINAL_CSV,),
+}
+
+def _forget(stages):
+    """
+    Forgets what the given stages already processed, so they run again on every screenshot.
+    """
+    from data_preprocessing.manifest import forget_stages
+    from data_preprocessing.matrix_store import matrices_path
+    from data_preprocessing.aggregates import aggregates_path
+
+    forget_stages(config.MANIFEST_PATH, stages)
+    for stage in stages:
+        for path in STAGE_OUTPUTS.get(stage, ()):
+            extra = (matrices_path(path), matrices_path(path) + ".json", aggregates_path(path)) \
+                if path == config.FINAL_CSV else ()
+            for p in (path, *extra):
+                if os.path.exists(p):
+                    os.remove(p)
+
+def _known_duplicates(dedup):
+    """
+    Boards already flagged as repeated captures by a previous `dedup` run.
+    """
+    if not dedup or not os.path.exists(config.DEDUP_INDEX):
+        return set()
+    from data_preprocessing.dedup import DedupIndex
+
+    with DedupIndex() as index:
+        return set(index.duplicates())
+
+def run_crop(run, backend=None, max_workers=None, only=None):
+    """
+    Crops the headers and/or the boards of the raw screenshots.
+
+    Parameters:
+    - run: `instrumentation.RunMetrics` of the run
+    - only: "header" or "board" to run a single crop (default both)
+    """
+    from data_preprocessing.parallel_cropper import crop_header
+    from data_preprocessing.manifest import Manifest
+    from data_preprocessing.executor import stage_executor
+
+    steps = [("crop_header", "📦 Header cropping...", config.HEADERS_DIR, config.HEADER_COORDS),
+             ("crop_board", "🎯 Board cropping...", config.BOARDS_DIR, config.BOARD_COORDS)]
+    for stage, message, output_dir, coords in steps:
+        if only and stage != f"crop_{only}":
+            continue
+        print(message)
+        stage_backend, stage_workers = stage_executor(stage, backend, max_workers)
+        with Manifest(config.MANIFEST_PATH, stage) as manifest, run.stage(stage) as metrics:
+            crop_header(
+                input_dir=config.RAW_DIR,
+                output_dir=output_dir,
+                coords=coords,
+                backend=stage_backend,
+                max_workers=stage_workers,
+                manifest=manifest,
+                metrics=metrics
+            )
+
+def run_dedup(run, backend=None, max_workers=None):
+    """
+    Flags repeated captures among the cropped boards.
+
+    Returns:
+    - set of the board file names to skip
+    """
+    from data_preprocessing.dedup import dedup_boards
+    from data_preprocessing.executor import stage_executor
+
+    backend, max_workers = stage_executor("dedup", backend, max_workers)
+    print("🧬 Dropping repeated captures...")
+    with run.stage("dedup") as metrics:
+        return dedup_boards(config.BOARDS_DIR, backend=backend, max_workers=max_workers, metrics=metrics)
+
+def run_ocr(run, backend=None, max_workers=None, exclude=None):
+    """
+    Extracts grade, stars and benchmark flag from the cropped headers into config.METADATA_CSV.
+    """
+    from data_preprocessing.ocr_parallel_extractor import extract_metadata
+    from data_preprocessing.manifest import Manifest
+    from data_preprocessing.executor import stage_executor
+
+    backend, max_workers = stage_executor("ocr", backend, max_workers)
+    print("🔎 Extracting metadata from headers...")
+    if not os.path.exists(config.GRADE_TEMPLATES):
+        print(f"💡 No grade templates in {config.GRADE_TEMPLATES}, every header goes to tesseract: "
+              "build them with `python main.py templates` once this run is done.")
+    with Manifest(config.MANIFEST_PATH, "ocr") as manifest, run.stage("ocr") as metrics:
+        extract_metadata(
+            config.HEADERS_DIR,
+            backend=backend,
+            max_workers=max_workers,
+            manifest=manifest,
+            output_csv=config.METADATA_CSV,
+            metrics=metrics,
+            exclude=exclude
+        )
     print(f"✅ Metadata saved in: {config.METADATA_CSV}")
 
-    #Dataframe with matrices
-    build_csv(
-    image_dir="./data/moonboards",
-    metadata_csv="metadata.csv",
-    image_to_matrix_func=image_to_matrix,
-    output_csv="final_data.csv"
-)
+def run_matrix(run, backend=None, max_workers=None, exclude=None):
+    """
+    Joins the metadata with the hold matrices of the boards into config.FINAL_CSV.
+    """
+    from data_preprocessing.build_dataframe import build_csv
+    from data_preprocessing.image_to_matrix import image_to_matrix
+    from data_preprocessing.manifest import Manifest
+    from data_preprocessing.executor import stage_executor
+
+    backend, max_workers = stage_executor("matrix", backend, max_workers)
+    print("🧩 Building the dataset with the hold matrices...")
+    with Manifest(config.MANIFEST_PATH, "matrix") as manifest, run.stage("matrix") as metrics:
+        build_csv(
+            image_dir=config.BOARDS_DIR,
+            metadata_csv=config.METADATA_CSV,
+            image_to_matrix_func=image_to_matrix,
+            output_csv=config.FINAL_CSV,
+            backend=backend,
+            max_workers=max_workers,
+            manifest=manifest,
+            metrics=metrics,
+            exclude=exclude
+        )
+
+def run_fused(run, backend=None, max_workers=None, save_crops=False, dedup=True):
+    """
+    Runs crop + OCR + matrix in a single pass over the raw screenshots.
+    """
+    from data_preprocessing.fused_pipeline import run_fused_pipeline
+    from data_preprocessing.manifest import Manifest
+    from data_preprocessing.dedup import DedupIndex
+    from data_preprocessing.executor import stage_executor
+
+    backend, max_workers = stage_executor("fused", backend, max_workers)
+    print("⚡ Fused pipeline: crop + OCR + matrix in a single pass...")
+    with Manifest(config.MANIFEST_PATH, "fused") as manifest, run.stage("fused") as metrics, \
+            DedupIndex() as index:
+        run_fused_pipeline(
+            input_dir=config.RAW_DIR,
+            output_csv=config.FINAL_CSV,
+            header_coords=config.HEADER_COORDS,
+            board_coords=config.BOARD_COORDS,
+            header_dir=config.HEADERS_DIR if save_crops else None,
+            board_dir=config.BOARDS_DIR if save_crops else None,
+            backend=backend,
+            max_workers=max_workers,
+            manifest=manifest,
+            metrics=metrics,
+            dedup=index if dedup else None,
+        )
+
+def _run_metrics(profile):
+    from data_preprocessing.instrumentation import RunMetrics
+
+    return RunMetrics(config.METRICS_DIR, profile=profile, top_n=config.SLOWEST_IMAGES)
+
+def main(fused=False, save_crops=False, backend=None, max_workers=None, rebuild=False, profile=False, dedup=True):
+    """
+    Runs the preprocessing pipeline.
+    Per-stage and per-image timings, errors and the slowest images are saved in config.METRICS_DIR.
+
+    Parameters:
+    - fused: if True, every raw screenshot is decoded once and the final rows are built
+      in memory, without intermediate header/board PNGs
+    - save_crops: only for the fused mode, also writes the crops to disk for debugging
+    - backend: "thread", "process" or "auto" (default: config.STAGE_EXECUTORS, else config.EXECUTOR_BACKEND)
+    - max_workers: number of workers per stage, or "auto" (default: config.STAGE_EXECUTORS, else
+      config.NUM_WORKERS)
+    - rebuild: if True, forgets the manifest and reprocesses every screenshot; otherwise only
+      new or changed screenshots are processed and appended to the existing outputs
+    - profile: if True, a sampling profiler reports the hot functions of every stage
+    - dedup: if True, repeated captures of the same route are dropped before OCR
+      (see config.DEDUP_REPORT for the list)
+    """
+
+    if rebuild:
+        for path in (config.MANIFEST_PATH, config.METADATA_CSV, config.FINAL_CSV, config.DEDUP_INDEX):
+            if os.path.exists(path):
+                os.remove(path)
+
+    with _run_metrics(profile) as run:
+        if fused:
+            run_fused(run, backend, max_workers, save_crops=save_crops, dedup=dedup)
+        else:
+            run_crop(run, backend, max_workers)
+            duplicates = run_dedup(run, backend, max_workers) if dedup else set()
+            run_ocr(run, backend, max_workers, exclude=duplicates)
+            run_matrix(run, backend, max_workers, exclude=duplicates)
 
     print("🎉 Pipeline completed successfully.")
 
+def run_stage(command, backend=None, max_workers=None, rebuild=False, profile=False, dedup=True, only=None):
+    """
+    Runs a single stage of the staged pipeline, e.g. to redo the OCR after changing its settings
+    without cropping again. The outputs of the previous stages are read from disk.
+    """
+    stages = {"crop": [f"crop_{only}"] if only else ["crop_header", "crop_board"],
+              "dedup": ["dedup"], "ocr": ["ocr"], "matrix": ["matrix"]}[command]
+    if rebuild:
+        _forget(stages)
+
+    with _run_metrics(profile) as run:
+        if command == "crop":
+            run_crop(run, backend, max_workers, only=only)
+        elif command == "dedup":
+            run_dedup(run, backend, max_workers)
+        elif command == "ocr":
+            run_ocr(run, backend, max_workers, exclude=_known_duplicates(dedup))
+        else:
+            run_matrix(run, backend, max_workers, exclude=_known_duplicates(dedup))
+
+def rederive(backend=None, max_workers=None, profile=False, dedup=True):
+    """
+    Recomputes grade, stars and benchmark of every header after a change in how they are derived
+    (grade line or word, grade normalization, star or benchmark thresholds), then rebuilds the
+    dataset rows whose fields changed. The grades read by tesseract are picked again from
+    config.OCR_CACHE and only the pixel work is redone: neither tesseract nor the template
+    matching runs (see `ocr_parallel_extractor.rederive_metadata`).
+    Needs the header crops of config.HEADERS_DIR (staged pipeline, or `build --fused --save-crops`).
+    """
+    from data_preprocessing.ocr_parallel_extractor import rederive_metadata
+    from data_preprocessing.manifest import Manifest
+    from data_preprocessing.executor import stage_executor
+
+    if not os.path.exists(config.METADATA_CSV):
+        raise FileNotFoundError(f"{config.METADATA_CSV} not found: run `python main.py ocr` first")
+    ocr_backend, ocr_workers = stage_executor("ocr", backend, max_workers)
+    with _run_metrics(profile) as run:
+        duplicates = _known_duplicates(dedup)
+        with Manifest(config.MANIFEST_PATH, "ocr") as manifest, run.stage("rederive") as metrics:
+            rederive_metadata(config.HEADERS_DIR, config.METADATA_CSV, backend=ocr_backend, max_workers=ocr_workers,
+                              manifest=manifest, metrics=metrics, exclude=duplicates)
+        run_matrix(run, backend, max_workers, exclude=duplicates)
+
+def build_templates(metadata_csv=None, header_dir=None, output=None, per_grade=50):
+    """
+    Builds config.GRADE_TEMPLATES from the headers whose grade is already known, typically the
+    metadata of a first `ocr` run with tesseract. The next OCR runs match the grade words against
+    the templates and only call tesseract when the match is not confident; the templates are part
+    of the OCR stage version, so the next run redoes every header once.
+
+    Parameters:
+    - metadata_csv: CSV with 'filename' and 'grade' (default config.METADATA_CSV)
+    - header_dir: header crops (default config.HEADERS_DIR)
+    - output: templates file (default config.GRADE_TEMPLATES)
+    - per_grade: maximum number of headers averaged per grade
+    """
+    from data_preprocessing.grade_recognizer import build_grade_templates
+
+    metadata_csv = metadata_csv or config.METADATA_CSV
+    header_dir = header_dir or config.HEADERS_DIR
+    for path in (metadata_csv, header_dir):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found: run `python main.py crop` and `python main.py ocr` first")
+    build_grade_templates(header_dir, metadata_csv, output, per_grade=per_grade)
+
+def _workers(value):
+    return value if value == "auto" else int(value)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="MoonBoard screenshots preprocessing pipeline",
+                                     epilog="Without a command, `build` is run.")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    # Options shared by the stages that process screenshots
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--backend", choices=["thread", "process", "auto"], default=None,
+                        help="parallel backend, auto to measure both (default: config.STAGE_EXECUTORS, "
+                             "else config.EXECUTOR_BACKEND)")
+    common.add_argument("--workers", type=_workers, default=None,
+                        help="number of workers per stage, auto to adapt it to the throughput "
+                             "(default: config.STAGE_EXECUTORS, else config.NUM_WORKERS or one per core)")
+    common.add_argument("--rebuild", action="store_true",
+                        help="ignore the manifest and reprocess every screenshot from scratch")
+    common.add_argument("--profile", action="store_true",
+                        help="run a sampling profiler and report the hot functions of every stage")
+
+    build = commands.add_parser("build", parents=[common], help="run the whole pipeline (default)")
+    build.add_argument("--fused", action="store_true",
+                       help="decode each screenshot once, without intermediate PNG crops")
+    build.add_argument("--save-crops", action="store_true",
+                       help="with --fused, also save header/board crops for debugging")
+    build.add_argument("--no-dedup", action="store_true",
+                       help="keep repeated captures of the same route")
+
+    crop_parser = commands.add_parser("crop", parents=[common], help="crop headers and boards")
+    crop_parser.add_argument("--only", choices=["header", "board"], default=None)
+
+    commands.add_parser("dedup", parents=[common], help="flag repeated captures among the boards")
+
+    for name, help_text in (("ocr", "extract grade, stars and benchmark from the headers"),
+                            ("matrix", "build the final dataset from the metadata and the boards")):
+        stage = commands.add_parser(name, parents=[common], help=help_text)
+        stage.add_argument("--no-dedup", action="store_true",
+                           help="do not skip the repeated captures flagged by `dedup`")
+
+    derive = commands.add_parser("rederive", parents=[common],
+                                 help="recompute grade, stars and benchmark from the OCR cache and the headers")
+    derive.add_argument("--no-dedup", action="store_true",
+                        help="do not skip the repeated captures flagged by `dedup`")
+
+    templates = commands.add_parser("templates", help="build the grade templates from already recognized headers")
+    templates.add_argument("--metadata", default=None, help="default: config.METADATA_CSV")
+    templates.add_argument("--headers", default=None, help="header crops (default: config.HEADERS_DIR)")
+    templates.add_argument("--output", default=None, help="default: config.GRADE_TEMPLATES")
+    templates.add_argument("--per-grade", type=int, default=50, help="headers averaged per grade (default: 50)")
+
+    flag = commands.add_parser("benchmark-flag", help="add the benchmark column to an existing dataset")
+    flag.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+    flag.add_argument("--output", default=None, help="output CSV (default: <csv>_with_benchmark.csv)")
+
+    inspect = commands.add_parser("inspect", help="show one route of the dataset")
+    inspect.add_argument("route", nargs="?", default=None,
+                         help="screenshot file name or row number (default: a random route)")
+    inspect.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+    inspect.add_argument("--plot", action="store_true", help="also plot the board with matplotlib")
+    inspect.add_argument("--png", default=None, help="save the drawing of the route in this file")
+
+    sheets = commands.add_parser("sheets", help="contact sheets of the routes, for visual QA")
+    sheets.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+    sheets.add_argument("--output-dir", default=None, help="default: config.CONTACT_SHEETS_DIR")
+    sheets.add_argument("--per-sheet", type=int, default=None, help="default: config.SHEET_ROUTES")
+    sheets.add_argument("--query", default=None, help="e.g. \"grade == '7A+' and stars >= 3\"")
+    sheets.add_argument("--overlay", action="store_true", help="draw over the board crops of config.BOARDS_DIR")
+    sheets.add_argument("--backend", choices=["thread", "process"], default=None)
+    sheets.add_argument("--workers", type=int, default=None)
+
+    calibrate = commands.add_parser("calibrate", help="pick the decode scales of the headers and the boards")
+    calibrate.add_argument("--sample", type=int, default=None, help="default: config.CALIBRATION_SAMPLE")
+    calibrate.add_argument("--scales", type=int, nargs="+", choices=(1, 2, 4, 8), default=None)
+    calibrate.add_argument("--min-agreement", type=float, default=1.0,
+                           help="fraction of the screenshots that must give the same results (default: 1.0)")
+    return parser
+
+def cli(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ("-h", "--help")):
+        argv = ["build", *argv]
+    args = build_parser().parse_args(argv)
+
+    if args.command == "build":
+        main(fused=args.fused, save_crops=args.save_crops, backend=args.backend, max_workers=args.workers,
+             rebuild=args.rebuild, profile=args.profile, dedup=not args.no_dedup)
+    elif args.command in ("crop", "dedup", "ocr", "matrix"):
+        run_stage(args.command, backend=args.backend, max_workers=args.workers, rebuild=args.rebuild,
+                  profile=args.profile, dedup=not getattr(args, "no_dedup", False), only=getattr(args, "only", None))
+    elif args.command == "rederive":
+        rederive(backend=args.backend, max_workers=args.workers, profile=args.profile, dedup=not args.no_dedup)
+    elif args.command == "templates":
+        build_templates(args.metadata, args.headers, args.output, args.per_grade)
+    elif args.command == "benchmark-flag":
+        import benchmark
+        benchmark.main(csv_path=args.csv, output_csv=args.output)
+    elif args.command == "sheets":
+        from data_preprocessing.render import write_contact_sheets
+        write_contact_sheets(args.csv, args.output_dir, args.per_sheet, query=args.query,
+                             board_dir=config.BOARDS_DIR if args.overlay else None, backend=args.backend,
+                             max_workers=args.workers)
+    elif args.command == "calibrate":
+        from data_preprocessing.decode_calibration import calibrate_decode_scale
+        calibrate_decode_scale(sample=args.sample, scales=args.scales, min_agreement=args.min_agreement)
+    else:
+        import debug
+        debug.main(csv_path=args.csv, route=args.route, plot=args.plot, png=args.png)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
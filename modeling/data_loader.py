@@ -0,0 +1,287 @@
+import os
+import json
+import queue
+import threading
+
+import numpy as np
+
+import data_preprocessing.config as config
+from data_preprocessing.matrix_store import load_dataset, matrices_path, HOLD
+
+# Bump when the layout of the cache changes
+CACHE_VERSION = 1
+
+_ARRAYS = ("matrices", "grades", "benchmark", "stars", "filenames")
+
+def cache_path(csv_path):
+    """
+    Returns the tensor cache directory of a dataset (final_data.csv -> final_data.cache).
+    """
+    return os.path.splitext(csv_path)[0] + ".cache"
+
+def _source_stamp(csv_path):
+    stamp = {"version": CACHE_VERSION, "grades": config.TRAINING_GRADES,
+             "corrections": config.GRADE_CORRECTIONS, "confusions": config.GRADE_CONFUSIONS}
+    for path in (csv_path, matrices_path(csv_path)):
+        info = os.stat(path)
+        stamp[os.path.basename(path)] = [info.st_size, info.st_mtime_ns]
+    return stamp
+
+def build_cache(csv_path=None, cache_dir=None):
+    """
+    Reads the pipeline output once and saves it as plain .npy arrays, ready to be memory-mapped:
+    - matrices.npy: uint8 (N, 18, 11, 3)
+    - grades.npy: int8 index in config.TRAINING_GRADES, -1 when invalid or outside of it
+    - benchmark.npy: bool
+    - stars.npy: int8
+    - filenames.npy: the screenshot names
+
+    Returns:
+    - the cache directory
+    """
+    from data_preprocessing.grades import dataset_grade_codes
+
+    csv_path = csv_path or config.FINAL_CSV
+    cache_dir = cache_dir or cache_path(csv_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    df, matrices = load_dataset(csv_path, mmap=True)
+    arrays = {
+        "matrices": np.ascontiguousarray(matrices, dtype=np.uint8),
+        "grades": dataset_grade_codes(df),
+        "benchmark": df["benchmark"].fillna(False).astype(bool).to_numpy(),
+        "stars": df["stars"].fillna(0).astype(np.int8).to_numpy(),
+        "filenames": df["filename"].to_numpy(dtype=str),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(cache_dir, f"{name}.npy"), array)
+
+    # Written last: a cache without a stamp is incomplete and gets rebuilt
+    with open(os.path.join(cache_dir, "stamp.json"), "w", encoding="utf-8") as f:
+        json.dump(_source_stamp(csv_path), f)
+
+    print(f"✅ {len(df)} routes cached in: {cache_dir}")
+    return cache_dir
+
+def load(csv_path=None, cache_dir=None, rebuild=False):
+    """
+    Opens the tensor cache of a dataset, building it first if it is missing or older than
+    the dataset (or than the grade settings of config.py).
+
+    Returns:
+    - `RouteDataset`
+    """
+    csv_path = csv_path or config.FINAL_CSV
+    cache_dir = cache_dir or cache_path(csv_path)
+    stamp_path = os.path.join(cache_dir, "stamp.json")
+
+    stale = rebuild or not os.path.exists(stamp_path)
+    if not stale and os.path.exists(csv_path):
+        with open(stamp_path, "r", encoding="utf-8") as f:
+            stale = json.load(f) != json.loads(json.dumps(_source_stamp(csv_path)))
+    if stale:
+        build_cache(csv_path, cache_dir)
+    return RouteDataset(cache_dir)
+
+class RouteDataset:
+    """
+    The cached dataset, memory-mapped: nothing is copied until a batch is gathered.
+
+    Attributes (numpy arrays of length N):
+    - matrices (N, 18, 11, 3), grades, benchmark, stars, filenames
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r"))
+        self.grade_names = list(config.TRAINING_GRADES)
+
+    def __len__(self):
+        return len(self.grades)
+
+    def mask(self, min_stars=None, benchmark=None, valid_grade=True):
+        """
+        Boolean mask of the routes matching the filters.
+
+        Parameters:
+        - min_stars: keep routes with at least this many stars (the notebook uses 3)
+        - benchmark: True for benchmarks only, False for non-benchmarks only, None for both
+        - valid_grade: keep only routes whose grade is in config.TRAINING_GRADES
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if valid_grade:
+            keep &= self.grades >= 0
+        if min_stars is not None:
+            keep &= self.stars >= min_stars
+        if benchmark is not None:
+            keep &= self.benchmark == bool(benchmark)
+        return keep
+
+    def subset(self, mask=None, **filters):
+        """
+        Returns a `RouteSubset` of the routes in `mask` (or matching `filters`, see `mask`).
+        Only the row indices are stored; the arrays stay memory-mapped.
+        """
+        mask = self.mask(**filters) if mask is None else np.asarray(mask, dtype=bool)
+        return RouteSubset(self, np.flatnonzero(mask))
+
+    def split(self, min_stars=3):
+        """
+        The notebook split: non-benchmark routes to train on, benchmarks to test on.
+
+        Returns:
+        - (train `RouteSubset`, test `RouteSubset`)
+        """
+        return (self.subset(min_stars=min_stars, benchmark=False),
+                self.subset(min_stars=min_stars, benchmark=True))
+
+class RouteSubset:
+    """
+    A set of rows of a `RouteDataset`, with a batch iterator.
+
+    Parameters:
+    - dataset: `RouteDataset`
+    - indices: row indices, in dataset order
+    """
+
+    def __init__(self, dataset, indices):
+        self.dataset = dataset
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def gather(self, indices, channel=HOLD, expand_dims=True, normalize_labels=False):
+        """
+        Builds one batch from dataset row indices.
+
+        Returns:
+        - X: float32 (B, 18, 11, 1) for one channel (or (B, 18, 11) without `expand_dims`),
+          float32 (B, 18, 11, 3) when `channel` is None
+        - y: float32 grade index, divided by len(grades) - 1 with `normalize_labels`
+          (the notebook's MinMaxScaler when the train set spans every grade)
+        """
+        # Sorted reads are sequential on the memory map; the order is restored afterwards
+        order = np.argsort(indices, kind="stable")
+        rows = np.asarray(indices)[order]
+        X = np.empty((len(rows), *self.dataset.matrices.shape[1:3],
+                      1 if channel is not None else self.dataset.matrices.shape[3]), dtype=np.float32)
+        source = self.dataset.matrices[rows]
+        X[order] = source[..., channel, None] if channel is not None else source
+        if channel is not None and not expand_dims:
+            X = X[..., 0]
+
+        y = np.empty(len(rows), dtype=np.float32)
+        y[order] = self.dataset.grades[rows]
+        if normalize_labels:
+            y /= max(1, len(self.dataset.grade_names) - 1)
+        return X, y
+
+    def arrays(self, **kwargs):
+        """
+        The whole subset as (X, y) arrays (see `gather`), e.g. for `model.fit(X, y)`.
+        """
+        return self.gather(self.indices, **kwargs)
+
+    def steps(self, batch_size, num_shards=1, drop_last=False):
+        """
+        Number of batches per epoch of one shard.
+        """
+        size = len(np.arange(len(self))[::num_shards])
+        return size // batch_size if drop_last else -(-size // batch_size)
+
+    def epoch_indices(self, epoch=0, shuffle=True, seed=0, shard=0, num_shards=1):
+        """
+        Row indices of one epoch for one shard. Every shard shuffles with the same seed, so
+        the shards of an epoch are disjoint and together cover the subset.
+        """
+        indices = self.indices
+        if shuffle:
+            indices = np.random.default_rng((seed, epoch)).permutation(indices)
+        return indices[shard::num_shards]
+
+    def batches(self, batch_size=32, epoch=0, shuffle=True, seed=0, shard=0, num_shards=1, prefetch=2,
+                drop_last=False, **kwargs):
+        """
+        Yields the (X, y) batches of one epoch. A background thread gathers up to `prefetch`
+        batches ahead, so reading overlaps with training.
+
+        Parameters:
+        - batch_size: routes per batch
+        - epoch: epoch number, changes the shuffle order
+        - shuffle / seed: shuffle the routes with this seed
+        - shard / num_shards: only yield this shard of the epoch (one per training process)
+        - prefetch: batches prepared ahead (0 = no background thread)
+        - drop_last: skip the last, incomplete batch
+        - kwargs: passed to `gather` (channel, expand_dims, normalize_labels)
+        """
+        indices = self.epoch_indices(epoch, shuffle, seed, shard, num_shards)
+        stop = len(indices) - len(indices) % batch_size if drop_last else len(indices)
+        chunks = (indices[i:i + batch_size] for i in range(0, stop, batch_size))
+
+        if not prefetch:
+            for chunk in chunks:
+                yield self.gather(chunk, **kwargs)
+            return
+
+        ready = queue.Queue(maxsize=prefetch)
+        stop_event = threading.Event()
+        done = object()
+
+        def producer():
+            try:
+                for chunk in chunks:
+                    if stop_event.is_set():
+                        return
+                    ready.put(self.gather(chunk, **kwargs))
+            except Exception as e:
+                ready.put(e)
+            ready.put(done)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = ready.get()
+                if batch is done:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # Unblock the producer if the consumer stopped early
+            stop_event.set()
+            while thread.is_alive():
+                try:
+                    ready.get_nowait()
+                except queue.Empty:
+                    thread.join(0.01)
+
+    def forever(self, batch_size=32, **kwargs):
+        """
+        Yields batches epoch after epoch (reshuffled every epoch), for APIs that take one
+        endless generator plus `steps_per_epoch`, such as `keras.Model.fit`.
+        """
+        epoch = 0
+        while True:
+            yield from self.batches(batch_size, epoch=epoch, **kwargs)
+            epoch += 1
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the tensor cache of a dataset and time one epoch")
+    parser.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the cache even if it is up to date")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--min-stars", type=int, default=3)
+    args = parser.parse_args()
+
+    dataset = load(args.csv, rebuild=args.rebuild)
+    train, test = dataset.split(min_stars=args.min_stars)
+    print(f"📊 {len(dataset)} routes: {len(train)} train, {len(test)} test (benchmarks)")
+    start = time.perf_counter()
+    count = sum(len(X) for X, _ in train.batches(args.batch_size))
+    print(f"⏱️ One epoch ({count} routes, batch size {args.batch_size}) read in {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,124 @@
+import json
+
+import numpy as np
+
+import data_preprocessing.config as config
+
+# Keras layers the NumPy engine (inference.py) can run
+SUPPORTED_LAYERS = ("InputLayer", "Conv2D", "BatchNormalization", "Dense", "Flatten", "Reshape",
+                    "Activation", "ReLU", "Dropout")
+
+FORMAT_VERSION = 1
+
+def _layer_spec(layer):
+    """
+    Returns (spec, weights) of one Keras layer: the options the forward pass needs and
+    its weights as float32 arrays.
+    """
+    kind = type(layer).__name__
+    if kind not in SUPPORTED_LAYERS:
+        raise ValueError(f"Layer '{layer.name}' ({kind}) is not supported by the NumPy engine, "
+                         f"expected one of {SUPPORTED_LAYERS}")
+    options = layer.get_config()
+    weights = [np.asarray(w, dtype=np.float32) for w in layer.get_weights()]
+    spec = {"type": kind, "name": layer.name}
+
+    if kind == "Conv2D":
+        if options.get("data_format", "channels_last") != "channels_last":
+            raise ValueError(f"Layer '{layer.name}': only channels_last convolutions are supported")
+        if tuple(options.get("dilation_rate", (1, 1))) != (1, 1) or options.get("groups", 1) != 1:
+            raise ValueError(f"Layer '{layer.name}': dilated or grouped convolutions are not supported")
+        spec.update(strides=list(options["strides"]), padding=options["padding"],
+                    activation=options["activation"])
+        kernel = weights[0]
+        bias = weights[1] if options["use_bias"] else np.zeros(kernel.shape[-1], dtype=np.float32)
+        return spec, {"kernel": kernel, "bias": bias}
+
+    if kind == "Dense":
+        spec.update(activation=options["activation"])
+        kernel = weights[0]
+        bias = weights[1] if options["use_bias"] else np.zeros(kernel.shape[-1], dtype=np.float32)
+        return spec, {"kernel": kernel, "bias": bias}
+
+    if kind == "BatchNormalization":
+        axis = options["axis"]
+        if (axis[0] if isinstance(axis, (list, tuple)) else axis) not in (-1, 3):
+            raise ValueError(f"Layer '{layer.name}': only channel (last axis) batch norm is supported")
+        # Weights are [gamma], [beta], moving_mean, moving_variance depending on scale/center
+        names = (["gamma"] if options["scale"] else []) + (["beta"] if options["center"] else []) \
+            + ["moving_mean", "moving_variance"]
+        named = dict(zip(names, weights))
+        channels = len(named["moving_mean"])
+        gamma = named.get("gamma", np.ones(channels, dtype=np.float32))
+        beta = named.get("beta", np.zeros(channels, dtype=np.float32))
+        # Inference batch norm is an affine map per channel: x * scale + shift
+        scale = gamma / np.sqrt(named["moving_variance"] + options["epsilon"])
+        shift = beta - named["moving_mean"] * scale
+        return spec, {"scale": scale.astype(np.float32), "shift": shift.astype(np.float32)}
+
+    if kind == "Reshape":
+        spec.update(target_shape=list(options["target_shape"]))
+    elif kind == "Activation":
+        spec.update(activation=options["activation"])
+    elif kind == "ReLU":
+        if options.get("max_value") is not None or options.get("negative_slope", 0) or options.get("threshold", 0):
+            raise ValueError(f"Layer '{layer.name}': only the plain ReLU is supported")
+        spec.update(type="Activation", activation="relu")
+    return spec, {}
+
+def export_model(model, path=None, scaler=None, label_range=None, grades=None, sample=None):
+    """
+    Dumps a trained Keras 2D-CNN (Conv2D / BatchNormalization / Dense, as in the notebook) to an
+    .npz file the NumPy engine can run without TensorFlow.
+
+    Parameters:
+    - model: Keras Sequential model
+    - path: output file (default config.GRADE_MODEL)
+    - scaler: the fitted MinMaxScaler of the labels, to turn the outputs back into grade indices
+    - label_range: (min, max) grade index instead of a scaler (e.g. (0, len(grades) - 1) with
+      the `normalize_labels` option of the data loader); None if the outputs are grade indices
+    - grades: grade names of the indices (default config.TRAINING_GRADES)
+    - sample: optional input batch; both models are run on it and their outputs compared
+
+    Returns:
+    - the path of the exported file
+    """
+    path = path or config.GRADE_MODEL
+
+    # index = output * label_scale + label_offset
+    label_scale, label_offset = 1.0, 0.0
+    if scaler is not None:
+        label_scale = 1.0 / float(scaler.scale_[0])
+        label_offset = -float(scaler.min_[0]) / float(scaler.scale_[0])
+    elif label_range is not None:
+        label_scale, label_offset = float(label_range[1] - label_range[0]), float(label_range[0])
+
+    layers, arrays = [], {}
+    for i, layer in enumerate(model.layers):
+        spec, weights = _layer_spec(layer)
+        layers.append(spec)
+        for name, array in weights.items():
+            arrays[f"{i}.{name}"] = array
+
+    input_shape = [int(d) for d in model.inputs[0].shape[1:]]
+    spec = {
+        "version": FORMAT_VERSION,
+        "input_shape": input_shape,
+        "layers": layers,
+        "grades": list(grades or config.TRAINING_GRADES),
+        "label_scale": label_scale,
+        "label_offset": label_offset,
+    }
+    np.savez(path, spec=np.array(json.dumps(spec)), **arrays)
+    print(f"✅ {len(layers)} layers exported to: {path}")
+
+    if sample is not None:
+        from modeling.inference import GradeModel
+
+        sample = np.asarray(sample, dtype=np.float32)
+        expected = np.asarray(model.predict(sample, verbose=0), dtype=np.float32).reshape(len(sample))
+        got = GradeModel(path).predict(sample)
+        difference = float(np.max(np.abs(expected - got))) if len(sample) else 0.0
+        icon = "✅" if difference < 1e-3 else "⚠️"
+        print(f"{icon} Max difference with Keras on {len(sample)} routes: {difference:.2e}")
+    return path
@@ -0,0 +1,234 @@
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import data_preprocessing.config as config
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0, out=x),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "tanh": np.tanh,
+}
+
+def _activation(name):
+    if name not in ACTIVATIONS:
+        raise ValueError(f"Activation '{name}' is not supported, expected one of {tuple(ACTIVATIONS)}")
+    return ACTIVATIONS[name]
+
+def _same_padding(size, kernel, stride):
+    # TensorFlow's "same": the extra row/column goes after
+    out = -(-size // stride)
+    total = max((out - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+class Conv2D:
+    """
+    Convolution as one matrix product: every (kh, kw, cin) window of the batch becomes a row
+    of the patch matrix (im2col), multiplied by the kernel reshaped to (kh * kw * cin, cout).
+    """
+
+    def __init__(self, kernel, bias, strides=(1, 1), padding="valid", activation="linear"):
+        self.kernel_size = kernel.shape[:2]
+        self.weights = np.ascontiguousarray(kernel.reshape(-1, kernel.shape[-1]), dtype=np.float32)
+        self.bias = bias.astype(np.float32)
+        self.strides = tuple(strides)
+        self.padding = padding
+        self.activation = _activation(activation)
+
+    def output_shape(self, shape):
+        (h, w, _), (kh, kw), (sh, sw) = shape, self.kernel_size, self.strides
+        if self.padding == "same":
+            return -(-h // sh), -(-w // sw), self.weights.shape[1]
+        return (h - kh) // sh + 1, (w - kw) // sw + 1, self.weights.shape[1]
+
+    def __call__(self, x):
+        (kh, kw), (sh, sw) = self.kernel_size, self.strides
+        if self.padding == "same":
+            x = np.pad(x, ((0, 0), _same_padding(x.shape[1], kh, sh), _same_padding(x.shape[2], kw, sw), (0, 0)))
+        # (N, Ho, Wo, C, kh, kw) view, no copy until the reshape
+        windows = sliding_window_view(x, (kh, kw), axis=(1, 2))[:, ::sh, ::sw]
+        n, ho, wo = windows.shape[:3]
+        patches = windows.transpose(0, 1, 2, 4, 5, 3).reshape(n * ho * wo, -1)
+        out = patches @ self.weights
+        out += self.bias
+        return self.activation(out).reshape(n, ho, wo, -1)
+
+class Dense:
+    def __init__(self, kernel, bias, activation="linear"):
+        self.weights = np.ascontiguousarray(kernel, dtype=np.float32)
+        self.bias = bias.astype(np.float32)
+        self.activation = _activation(activation)
+
+    def output_shape(self, shape):
+        return (self.weights.shape[1],)
+
+    def __call__(self, x):
+        out = x @ self.weights
+        out += self.bias
+        return self.activation(out)
+
+class Affine:
+    """
+    Batch norm that could not be folded: x * scale + shift per channel.
+    """
+
+    def __init__(self, scale, shift):
+        self.scale, self.shift = scale, shift
+
+    def output_shape(self, shape):
+        return shape
+
+    def __call__(self, x):
+        return x * self.scale + self.shift
+
+class Reshape:
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+
+    def output_shape(self, shape):
+        return self.shape
+
+    def __call__(self, x):
+        return x.reshape(len(x), *self.shape)
+
+class Activation:
+    def __init__(self, name):
+        self.activation = _activation(name)
+
+    def output_shape(self, shape):
+        return shape
+
+    def __call__(self, x):
+        return self.activation(x)
+
+def _fold(op, scale, shift):
+    """
+    Folds a batch norm x * scale + shift (per input channel) into the next linear op:
+    W' = W * scale (on the input channels), b' = b + W applied to shift.
+    Returns False when it cannot be folded exactly.
+    """
+    if isinstance(op, Conv2D):
+        if op.padding != "valid":
+            return False  # The zero padding would be shifted too
+        kh, kw = op.kernel_size
+        kernel = op.weights.reshape(kh, kw, len(scale), -1)
+        op.bias = op.bias + np.einsum("hwio,i->o", kernel, shift)
+        op.weights = np.ascontiguousarray((kernel * scale[None, None, :, None]).reshape(op.weights.shape))
+        return True
+    if isinstance(op, Dense):
+        op.bias = op.bias + shift @ op.weights
+        op.weights = np.ascontiguousarray(op.weights * scale[:, None])
+        return True
+    return False
+
+class GradeModel:
+    """
+    Forward pass of an exported 2D-CNN (see `export.export_model`) in plain NumPy.
+    Each batch norm is folded into the convolution or dense layer that follows it, so a
+    prediction is only matrix products and ReLUs.
+
+    Parameters:
+    - path: exported .npz model (default config.GRADE_MODEL)
+    - fold: fold the batch norms (False runs them separately, for checking)
+    """
+
+    def __init__(self, path=None, fold=True):
+        self.path = path or config.GRADE_MODEL
+        with np.load(self.path) as data:
+            self.spec = json.loads(str(data["spec"]))
+            arrays = {name: data[name] for name in data.files if name != "spec"}
+
+        self.input_shape = tuple(self.spec["input_shape"])
+        self.grades = self.spec["grades"]
+        self.label_scale = self.spec["label_scale"]
+        self.label_offset = self.spec["label_offset"]
+
+        self.ops = []
+        shape = self.input_shape
+        pending = None  # batch norm waiting for the next linear op
+        for i, layer in enumerate(self.spec["layers"]):
+            kind = layer["type"]
+            if kind in ("InputLayer", "Dropout"):
+                continue
+            if kind == "BatchNormalization":
+                if pending is not None:
+                    self.ops.append(Affine(*pending))
+                pending = (arrays[f"{i}.scale"], arrays[f"{i}.shift"])
+                continue
+            if kind == "Flatten":
+                op = Reshape((int(np.prod(shape)),))
+                if pending is not None:
+                    # Flattening keeps the (h, w, c) order: the channels repeat h * w times
+                    repeat = int(np.prod(shape[:-1]))
+                    pending = (np.tile(pending[0], repeat), np.tile(pending[1], repeat))
+            elif kind == "Reshape":
+                op = Reshape(layer["target_shape"])
+            elif kind == "Activation":
+                op = Activation(layer["activation"])
+            elif kind == "Conv2D":
+                op = Conv2D(arrays[f"{i}.kernel"], arrays[f"{i}.bias"], layer["strides"], layer["padding"],
+                            layer["activation"])
+            elif kind == "Dense":
+                op = Dense(arrays[f"{i}.kernel"], arrays[f"{i}.bias"], layer["activation"])
+            else:
+                raise ValueError(f"Layer '{layer['name']}' ({kind}) is not supported")
+
+            if pending is not None and kind in ("Conv2D", "Dense"):
+                if not (fold and _fold(op, *pending)):
+                    self.ops.append(Affine(*pending))
+                pending = None
+            elif pending is not None and kind != "Flatten":
+                self.ops.append(Affine(*pending))
+                pending = None
+            self.ops.append(op)
+            shape = op.output_shape(shape)
+        if pending is not None:
+            self.ops.append(Affine(*pending))
+
+    def _prepare(self, matrices):
+        """
+        Accepts (N, 18, 11) masks, (N, 18, 11, 1) inputs or a single route of either.
+        """
+        x = np.asarray(matrices, dtype=np.float32)
+        if x.shape in (self.input_shape, self.input_shape[:-1]):
+            x = x[None]
+        if x.shape[1:] == self.input_shape[:-1]:
+            x = x[..., None]
+        if x.shape[1:] != self.input_shape:
+            raise ValueError(f"Expected routes of shape {self.input_shape}, got {x.shape[1:]}")
+        return x
+
+    def predict(self, matrices, batch_size=None):
+        """
+        Raw model outputs (the scaled grade), one float32 per route.
+
+        Parameters:
+        - matrices: batch of hold matrices (see `_prepare`)
+        - batch_size: routes per forward pass (default config.INFERENCE_BATCH_SIZE)
+        """
+        x = self._prepare(matrices)
+        batch_size = batch_size or config.INFERENCE_BATCH_SIZE
+        out = np.empty(len(x), dtype=np.float32)
+        for start in range(0, len(x), batch_size):
+            y = x[start:start + batch_size]
+            for op in self.ops:
+                y = op(y)
+            out[start:start + batch_size] = y.reshape(len(y))
+        return out
+
+    def predict_index(self, matrices, **kwargs):
+        """
+        Predicted grade index (a float, e.g. 3.4 is between 7A and 7A+).
+        """
+        return self.predict(matrices, **kwargs) * self.label_scale + self.label_offset
+
+    def predict_grades(self, matrices, **kwargs):
+        """
+        Returns:
+        - (grade names, grade indices): the nearest grade of every route and the raw index
+        """
+        index = self.predict_index(matrices, **kwargs)
+        nearest = np.clip(np.rint(index), 0, len(self.grades) - 1).astype(int)
+        return [self.grades[i] for i in nearest], index
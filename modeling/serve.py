@@ -0,0 +1,231 @@
+import re
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import data_preprocessing.config as config
+from modeling.inference import GradeModel
+
+ROWS, COLUMNS = 18, 11
+
+# Column letter A-K and row number 1-18
+HOLD_NAME = re.compile(r"^[A-K]([1-9]|1[0-8])$")
+
+def holds_to_matrix(holds):
+    """
+    Builds the (18, 11) hold mask of a route from hold names as shown on the board
+    ("A18" is the top-left hold, "K1" the bottom-right one).
+    """
+    matrix = np.zeros((ROWS, COLUMNS), dtype=np.uint8)
+    for hold in holds:
+        hold = str(hold).strip().upper()
+        if not HOLD_NAME.match(hold):
+            raise ValueError(f"Unknown hold '{hold}'")
+        matrix[ROWS - int(hold[1:]), ord(hold[0]) - 65] = 1
+    return matrix
+
+class MicroBatcher:
+    """
+    Groups concurrent prediction requests into one forward pass. A worker thread takes the
+    first waiting request, then keeps collecting for at most `max_wait_ms` (or until
+    `max_batch` routes) and runs them together: one route costs about the same as a batch.
+
+    Parameters:
+    - model: `GradeModel`
+    - max_batch: routes per forward pass (default config.SERVE_MAX_BATCH)
+    - max_wait_ms: how long a request may wait for others (default config.SERVE_MAX_WAIT_MS)
+    """
+
+    def __init__(self, model, max_batch=None, max_wait_ms=None):
+        self.model = model
+        self.max_batch = max_batch or config.SERVE_MAX_BATCH
+        self.max_wait = (config.SERVE_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self.requests = queue.Queue()
+        self.stats = {"requests": 0, "routes": 0, "batches": 0}
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def submit(self, matrices):
+        """
+        Queues routes for prediction.
+
+        Returns:
+        - a Future of (grade names, grade indices), see `GradeModel.predict_grades`
+        """
+        x = self.model._prepare(matrices)
+        future = Future()
+        self.requests.put((x, future))
+        return future
+
+    def predict(self, matrices, timeout=None):
+        return self.submit(matrices).result(timeout)
+
+    def _work(self):
+        while True:
+            first = self.requests.get()
+            if first is None:
+                return
+            batch, size = [first], len(first[0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    entry = self.requests.get(timeout=max(0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self.requests.put(None)  # Stop after this batch
+                    break
+                batch.append(entry)
+                size += len(entry[0])
+
+            try:
+                names, index = self.model.predict_grades(np.concatenate([x for x, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for x, future in batch:
+                future.set_result((names[start:start + len(x)], index[start:start + len(x)]))
+                start += len(x)
+            self.stats["requests"] += len(batch)
+            self.stats["routes"] += size
+            self.stats["batches"] += 1
+
+    def close(self):
+        self.requests.put(None)
+        self._thread.join()
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        """
+        POST /predict with {"matrices": [18x11 lists of 0/1, ...]} or {"holds": [["A5", "F12", ...], ...]}
+        returns {"grades": [...], "index": [...]}. GET /health returns the model and batching stats.
+        """
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/health":
+                return self._send(404, {"error": "not found"})
+            self._send(200, {"model": batcher.model.path, "grades": batcher.model.grades, **batcher.stats})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                return self._send(404, {"error": "not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if "holds" in body:
+                    matrices = np.stack([holds_to_matrix(route) for route in body["holds"]])
+                else:
+                    matrices = np.asarray(body["matrices"], dtype=np.float32)
+                names, index = batcher.predict(matrices, timeout=30)
+            except (ValueError, KeyError, TypeError) as e:
+                return self._send(400, {"error": str(e)})
+            except (TimeoutError, FutureTimeoutError):
+                return self._send(503, {"error": "prediction timed out, the server is overloaded"})
+            except Exception as e:
+                return self._send(500, {"error": f"{type(e).__name__}: {e}"})
+            self._send(200, {"grades": names, "index": [round(float(i), 3) for i in index]})
+
+        def log_message(self, format, *args):
+            pass  # One line per request would cost more than the prediction
+
+    return Handler
+
+def serve(model_path=None, port=None, max_batch=None, max_wait_ms=None):
+    """
+    Serves grade predictions over HTTP on localhost until interrupted.
+    """
+    start = time.perf_counter()
+    batcher = MicroBatcher(GradeModel(model_path), max_batch, max_wait_ms)
+    port = port or config.SERVE_PORT
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(batcher))
+    print(f"🚀 Model {batcher.model.path} loaded in {(time.perf_counter() - start) * 1000:.0f} ms, "
+          f"serving on http://127.0.0.1:{port}/predict")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+def predict_dataset(model_path=None, csv_path=None, output_csv=None):
+    """
+    Predicts the grade of every route of a dataset written by `build_csv`.
+    """
+    import pandas as pd
+    from data_preprocessing.matrix_store import load_dataset, HOLD
+
+    csv_path = csv_path or config.FINAL_CSV
+    model = GradeModel(model_path)
+    df, matrices = load_dataset(csv_path, channel=HOLD)
+    start = time.perf_counter()
+    names, index = model.predict_grades(matrices)
+    seconds = time.perf_counter() - start
+    out = pd.DataFrame({"filename": df["filename"], "grade": df["grade"], "predicted": names,
+                        "predicted_index": np.round(index, 3)})
+    output_csv = output_csv or "predictions.csv"
+    out.to_csv(output_csv, index=False)
+    print(f"✅ {len(out)} routes predicted in {seconds:.2f}s "
+          f"({len(out) / max(seconds, 1e-9):.0f} predictions/sec), saved in: {output_csv}")
+    return out
+
+def benchmark(model_path=None, routes=10000, batch_sizes=(1, 8, 64, 256, 1024)):
+    """
+    Prints the load time and the predictions/sec of the model for several batch sizes.
+    """
+    start = time.perf_counter()
+    model = GradeModel(model_path)
+    print(f"⏱️ Model loaded in {(time.perf_counter() - start) * 1000:.1f} ms")
+    x = (np.random.default_rng(0).random((routes, *model.input_shape[:-1])) < 0.05).astype(np.float32)
+    for batch_size in batch_sizes:
+        n = min(routes, batch_size * 200)
+        start = time.perf_counter()
+        model.predict(x[:n], batch_size=batch_size)
+        seconds = time.perf_counter() - start
+        print(f"   batch {batch_size:5}: {n / seconds:10.0f} predictions/sec")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grade predictions with the exported NumPy model")
+    parser.add_argument("--model", default=None, help="exported model (default: config.GRADE_MODEL)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    route = commands.add_parser("route", help="predict one route from its hold names")
+    route.add_argument("holds", nargs="+", help="e.g. A5 F12 K18")
+
+    dataset = commands.add_parser("dataset", help="predict every route of a dataset")
+    dataset.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+    dataset.add_argument("--output", default=None, help="predictions CSV (default: predictions.csv)")
+
+    http = commands.add_parser("serve", help="local HTTP server with micro-batching")
+    http.add_argument("--port", type=int, default=None, help="default: config.SERVE_PORT")
+    http.add_argument("--max-batch", type=int, default=None, help="default: config.SERVE_MAX_BATCH")
+    http.add_argument("--max-wait-ms", type=float, default=None, help="default: config.SERVE_MAX_WAIT_MS")
+
+    bench = commands.add_parser("bench", help="load time and predictions/sec")
+    bench.add_argument("--routes", type=int, default=10000)
+
+    args = parser.parse_args()
+    if args.command == "route":
+        names, index = GradeModel(args.model).predict_grades(holds_to_matrix(args.holds))
+        print(f"🧗 {names[0]} ({index[0]:.2f})")
+    elif args.command == "dataset":
+        predict_dataset(args.model, args.csv, args.output)
+    elif args.command == "serve":
+        serve(args.model, args.port, args.max_batch, args.max_wait_ms)
+    else:
+        benchmark(args.model, args.routes)
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import argparse
+import itertools
+from functools import partial
+
+import numpy as np
+from tqdm import tqdm
+
+import data_preprocessing.config as config
+from data_preprocessing.executor import run_parallel
+from modeling.data_loader import load, RouteDataset, RouteSubset
+
+# Notebook settings: 200 epochs with early stopping (patience 20, from epoch 10), batch size 8
+DEFAULT_PARAMS = {"epochs": 200, "batch_size": 8, "patience": 20, "learning_rate": 0.001, "alpha": 1.0}
+SPLITS = ("benchmark", "kfold", "stratified")
+
+def limit_threads(threads):
+    """
+    Limits the threads of the libraries a training job uses (BLAS, OpenMP, TensorFlow) in the
+    current process. TensorFlow reads its limits when it starts, so this runs before it is imported.
+    """
+    threads = max(1, int(threads))
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[var] = str(threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+
+def _build_cnn(params):
+    from tensorflow.keras import layers, models
+
+    return models.Sequential([
+        layers.Input(shape=(18, 11, 1)),
+        layers.Conv2D(32, 3, activation="relu"),
+        layers.BatchNormalization(),
+        layers.Conv2D(32, 3, activation="relu"),
+        layers.BatchNormalization(),
+        layers.Conv2D(64, 3, activation="relu"),
+        layers.BatchNormalization(),
+        layers.Conv2D(64, 3, activation="relu"),
+        layers.BatchNormalization(),
+        layers.Flatten(),
+        layers.Dense(32, activation="relu"),
+        layers.Dense(1, activation="linear"),
+    ])
+
+def _build_lstm(params):
+    from tensorflow.keras import layers, models
+
+    return models.Sequential([
+        layers.Input(shape=(18, 11, 1)),
+        layers.Reshape(target_shape=(18, 11)),
+        layers.LSTM(128),
+        layers.Dense(32, activation="relu"),
+        layers.Dense(1, activation="linear"),
+    ])
+
+def _fit_keras(build, train, val, params, seed):
+    """
+    Trains a notebook model on normalized grade indices, stopping early on the validation fold.
+
+    Returns:
+    - (predicted grade indices of the validation fold, epochs run)
+    """
+    import tensorflow as tf
+
+    tf.keras.utils.set_random_seed(seed)
+    model = build(params)
+    model.compile(loss="mean_squared_error", optimizer=tf.keras.optimizers.Adam(params["learning_rate"]))
+
+    X, y = train.arrays(normalize_labels=True)
+    X_val, y_val = val.arrays(normalize_labels=True)
+    stop = tf.keras.callbacks.EarlyStopping(monitor="val_loss", patience=params["patience"],
+                                            restore_best_weights=True,
+                                            start_from_epoch=min(10, params["epochs"] // 2))
+    history = model.fit(X, y, validation_data=(X_val, y_val), epochs=params["epochs"],
+                        batch_size=params["batch_size"], callbacks=[stop], verbose=0)
+    predictions = model.predict(X_val, batch_size=1024, verbose=0).reshape(len(X_val))
+    return predictions * max(1, len(train.dataset.grade_names) - 1), len(history.history["loss"])
+
+def _fit_ridge(train, val, params, seed):
+    """
+    Linear baseline without TensorFlow: ridge regression of the grade index on the 198 holds.
+    """
+    X, y = train.arrays(expand_dims=False)
+    X = np.hstack([X.reshape(len(X), -1), np.ones((len(X), 1), dtype=np.float32)]).astype(np.float64)
+    penalty = params["alpha"] * np.eye(X.shape[1])
+    penalty[-1, -1] = 0  # The bias is not penalized
+    weights = np.linalg.solve(X.T @ X + penalty, X.T @ y)
+
+    X_val, _ = val.arrays(expand_dims=False)
+    X_val = np.hstack([X_val.reshape(len(X_val), -1), np.ones((len(X_val), 1), dtype=np.float32)])
+    return X_val @ weights, 1
+
+# Model name -> fit(train, val, params, seed)
+MODELS = {
+    "cnn": partial(_fit_keras, _build_cnn),
+    "lstm": partial(_fit_keras, _build_lstm),
+    "ridge": _fit_ridge,
+}
+KERAS_MODELS = ("cnn", "lstm")
+
+# Parameters each model uses
+MODEL_PARAMS = {
+    "cnn": ("epochs", "batch_size", "patience", "learning_rate"),
+    "lstm": ("epochs", "batch_size", "patience", "learning_rate"),
+    "ridge": ("alpha",),
+}
+
+def make_folds(dataset, split="stratified", folds=None, min_stars=3, seed=0):
+    """
+    Train / validation splits of the routes with a valid grade and at least `min_stars` stars.
+
+    Parameters:
+    - dataset: `RouteDataset`
+    - split: "benchmark" (the notebook split: non-benchmarks to train on, benchmarks to validate on),
+      "kfold" (random folds) or "stratified" (every fold gets the same share of each grade)
+    - folds: number of folds (default config.CV_FOLDS), ignored by "benchmark"
+
+    Returns:
+    - list of (train row indices, validation row indices)
+    """
+    if split not in SPLITS:
+        raise ValueError(f"Unknown split '{split}', expected one of {SPLITS}")
+    if split == "benchmark":
+        train, val = dataset.split(min_stars=min_stars)
+        return [(train.indices, val.indices)]
+
+    folds = folds or config.CV_FOLDS
+    rows = dataset.subset(min_stars=min_stars).indices
+    rng = np.random.default_rng(seed)
+    fold_of = np.empty(len(rows), dtype=np.int64)
+    if split == "kfold":
+        fold_of[rng.permutation(len(rows))] = np.arange(len(rows)) % folds
+    else:
+        grades = np.asarray(dataset.grades[rows])
+        for grade in np.unique(grades):
+            members = rng.permutation(np.flatnonzero(grades == grade))
+            # Each grade starts at another fold, so the small grades do not all land in fold 0
+            fold_of[members] = (np.arange(len(members)) + int(grade)) % folds
+    return [(rows[fold_of != k], rows[fold_of == k]) for k in range(folds)]
+
+def make_configs(models=("cnn",), **grid):
+    """
+    Every combination of models and hyperparameter values, e.g.
+    make_configs(("cnn", "lstm"), batch_size=[8, 32]) gives 4 configs.
+
+    Returns:
+    - list of dicts with "model" and the parameters it uses (DEFAULT_PARAMS for the ones not in `grid`)
+    """
+    grid = {name: values if isinstance(values, (list, tuple)) else [values]
+            for name, values in grid.items() if values is not None}
+    configs = []
+    for model in models:
+        if model not in MODELS:
+            raise ValueError(f"Unknown model '{model}', expected one of {tuple(MODELS)}")
+        names = [name for name in grid if name in MODEL_PARAMS[model]]
+        for values in itertools.product(*(grid[name] for name in names)):
+            params = {**DEFAULT_PARAMS, **dict(zip(names, values))}
+            configs.append({"model": model, **{name: params[name] for name in MODEL_PARAMS[model]}})
+    return configs
+
+def _run_job(job, cache_dir, threads):
+    """
+    Trains and evaluates one config on one fold, inside a pool worker.
+    """
+    limit_threads(threads)
+    if job["config"]["model"] in KERAS_MODELS:
+        import tensorflow as tf
+
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except RuntimeError:
+            pass  # Already set by a previous job of this worker
+
+    dataset = RouteDataset(cache_dir)
+    train, val = RouteSubset(dataset, job["train"]), RouteSubset(dataset, job["val"])
+    params = {k: v for k, v in job["config"].items() if k != "model"}
+
+    start = time.perf_counter()
+    predictions, epochs = MODELS[job["config"]["model"]](train, val, params, job["seed"])
+    seconds = time.perf_counter() - start
+
+    errors = np.asarray(predictions, dtype=np.float64) - np.asarray(dataset.grades[val.indices], dtype=np.float64)
+    return {"epochs": epochs, "fit_seconds": seconds, "samples_per_sec": len(train) * epochs / max(seconds, 1e-9),
+            "mae": float(np.mean(np.abs(errors))), "rmse": float(np.sqrt(np.mean(errors ** 2)))}
+
+def cross_validate(configs, csv_path=None, split="stratified", folds=None, min_stars=3, seed=0,
+                   threads_per_job=None, max_workers=None, output=None):
+    """
+    Runs every config on every fold as an independent job, side by side on a process pool: a sweep
+    takes about as long as its slowest jobs instead of their sum. The dataset is read once into
+    the tensor cache (see `data_loader.load`); every worker memory-maps it.
+
+    Parameters:
+    - configs: list of dicts with "model" (see MODELS) and its parameters (see `make_configs`)
+    - csv_path: dataset CSV (default config.FINAL_CSV)
+    - split / folds / min_stars / seed: see `make_folds`
+    - threads_per_job: threads of every job (default config.TRAIN_THREADS_PER_JOB)
+    - max_workers: jobs at a time (default: cores // threads_per_job)
+    - output: CSV for the result table (default config.TRAIN_RESULTS)
+
+    Returns:
+    - pandas DataFrame, one row per job: config, fold, sizes, epochs, fit time, samples/sec, MAE, RMSE
+    """
+    import pandas as pd
+
+    csv_path = csv_path or config.FINAL_CSV
+    threads = threads_per_job or config.TRAIN_THREADS_PER_JOB
+    workers = max_workers or max(1, (os.cpu_count() or 1) // threads)
+    output = output or config.TRAIN_RESULTS
+
+    dataset = load(csv_path)
+    splits = make_folds(dataset, split, folds, min_stars, seed)
+    jobs = [{"id": i, "config": cfg, "fold": fold, "train": train, "val": val, "seed": seed}
+            for i, (cfg, (fold, (train, val))) in enumerate(itertools.product(configs, enumerate(splits)))]
+    print(f"🏋️ {len(configs)} configs x {len(splits)} folds = {len(jobs)} jobs, "
+          f"{workers} at a time with {threads} threads each")
+
+    rows = []
+    start = time.perf_counter()
+    results = run_parallel(partial(_run_job, cache_dir=dataset.cache_dir, threads=threads), jobs,
+                           backend="process", max_workers=workers, chunk_size=1, max_pending=workers)
+    for job, result, error in tqdm(results, total=len(jobs), desc="Training"):
+        row = {"job": job["id"], "model": job["config"]["model"],
+               "params": json.dumps({k: v for k, v in job["config"].items() if k != "model"}),
+               "fold": job["fold"], "train": len(job["train"]), "val": len(job["val"])}
+        if error:
+            print(f"⚠️ Job {job['id']} ({row['model']}, fold {job['fold']}) failed: {error}")
+            row["error"] = str(error)
+        else:
+            row.update(result)
+        rows.append(row)
+    wall = time.perf_counter() - start
+
+    df = pd.DataFrame(rows).sort_values("job").reset_index(drop=True)
+    df.to_csv(output, index=False)
+    if "fit_seconds" in df:
+        total = df["fit_seconds"].sum()
+        print(f"⏱️ {wall:.1f}s wall clock for {total:.1f}s of training ({total / max(wall, 1e-9):.1f}x), "
+              f"slowest job {df['fit_seconds'].max():.1f}s")
+        summary = df.groupby(["model", "params"], sort=False).agg(
+            folds=("fold", "count"), mae=("mae", "mean"), mae_std=("mae", "std"), rmse=("rmse", "mean"),
+            fit_seconds=("fit_seconds", "mean"), samples_per_sec=("samples_per_sec", "mean"))
+        print(summary.round(3).to_string())
+    print(f"✅ Results saved in: {output}")
+    return df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validate grade models, one job per config and fold")
+    parser.add_argument("--csv", default=None, help="dataset CSV (default: config.FINAL_CSV)")
+    parser.add_argument("--models", nargs="+", choices=tuple(MODELS), default=["cnn", "lstm"])
+    parser.add_argument("--split", choices=SPLITS, default="stratified")
+    parser.add_argument("--folds", type=int, default=None, help="default: config.CV_FOLDS")
+    parser.add_argument("--min-stars", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--epochs", type=int, nargs="+", default=None)
+    parser.add_argument("--batch-size", type=int, nargs="+", default=None)
+    parser.add_argument("--patience", type=int, nargs="+", default=None)
+    parser.add_argument("--learning-rate", type=float, nargs="+", default=None)
+    parser.add_argument("--alpha", type=float, nargs="+", default=None, help="ridge penalty")
+    parser.add_argument("--threads-per-job", type=int, default=None, help="default: config.TRAIN_THREADS_PER_JOB")
+    parser.add_argument("--workers", type=int, default=None, help="jobs at a time (default: cores // threads)")
+    parser.add_argument("--output", default=None, help="result table (default: config.TRAIN_RESULTS)")
+    args = parser.parse_args()
+
+    configs = make_configs(args.models, epochs=args.epochs, batch_size=args.batch_size, patience=args.patience,
+                           learning_rate=args.learning_rate, alpha=args.alpha)
+    cross_validate(configs, args.csv, args.split, args.folds, args.min_stars, args.seed,
+                   args.threads_per_job, args.workers, args.output)
@@ -0,0 +1,262 @@
+# Throughput benchmark of the preprocessing pipeline on synthetic screenshots.
+# Every stage is run at several corpus sizes and worker counts, each case in a fresh process
+# so its peak memory can be measured, and the outputs are checked against the known ground truth.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+STAGES = ["crop_header", "process_image_ocr", "image_to_matrix", "build_csv", "pipeline_fused", "pipeline_staged"]
+
+def _timed(func, item):
+    """
+    Runs func(item) and returns (result, seconds). Used inside the workers.
+    """
+    start = time.perf_counter()
+    result = func(item)
+    return result, time.perf_counter() - start
+
+def _crop_to(output_dir, coords, image_path):
+    from data_preprocessing.parallel_cropper import crop_single_header
+
+    return crop_single_header(image_path, os.path.join(output_dir, os.path.basename(image_path)), coords)
+
+def _peak_rss_mb():
+    usage = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return usage / 1024  # ru_maxrss is in KB on Linux
+
+def _subset_dir(corpus_dir, size):
+    """
+    Builds (once) a directory with symlinks to the first `size` screenshots, headers and boards.
+    """
+    subset = os.path.join(corpus_dir, f"subset_{size}")
+    for kind in ("raw", "headers", "boards"):
+        target = os.path.join(subset, kind)
+        if os.path.isdir(target):
+            continue
+        os.makedirs(target)
+        for filename in sorted(os.listdir(os.path.join(corpus_dir, kind)))[:size]:
+            os.symlink(os.path.abspath(os.path.join(corpus_dir, kind, filename)), os.path.join(target, filename))
+    return subset
+
+def prepare_corpus(corpus_dir, size, seed=0):
+    """
+    Generates the synthetic corpus (if needed) with its header and board crops.
+    """
+    import cv2
+    import data_preprocessing.config as config
+    from data_preprocessing.synthetic import generate_corpus
+    from data_preprocessing.parallel_cropper import crop_region
+
+    raw_dir = os.path.join(corpus_dir, "raw")
+    if not os.path.isdir(raw_dir) or len(os.listdir(raw_dir)) < size:
+        generate_corpus(corpus_dir, size, seed=seed)
+
+    for kind, coords in (("headers", config.HEADER_COORDS), ("boards", config.BOARD_COORDS)):
+        out_dir = os.path.join(corpus_dir, kind)
+        os.makedirs(out_dir, exist_ok=True)
+        for filename in os.listdir(raw_dir):
+            out_path = os.path.join(out_dir, filename)
+            if not os.path.exists(out_path):
+                cv2.imwrite(out_path, crop_region(cv2.imread(os.path.join(raw_dir, filename)), coords))
+
+def _accuracy_rows(rows, truth):
+    """
+    Fraction of correct grades, stars and benchmark flags, rows being dicts with a filename.
+    """
+    truth = truth.set_index("filename")
+    hits = {"grade": 0, "stars": 0, "benchmark": 0}
+    for row in rows:
+        expected = truth.loc[row["filename"]]
+        hits["grade"] += str(row["grade"]) == str(expected["grade"])
+        hits["stars"] += int(row["stars"]) == int(expected["stars"])
+        hits["benchmark"] += bool(row["benchmark"]) == bool(expected["benchmark"])
+    total = max(1, len(truth))
+    return {f"{key}_accuracy": value / total for key, value in hits.items()}
+
+def _accuracy_matrices(filenames, matrices, truth, truth_matrices):
+    index = {filename: i for i, filename in enumerate(truth["filename"])}
+    expected = truth_matrices[[index[f] for f in filenames]]
+    matrices = np.asarray(matrices).reshape(expected.shape) if len(filenames) else expected
+    total = max(1, len(truth))
+    return {
+        "matrix_exact_accuracy": float((matrices == expected).all(axis=(1, 2, 3)).sum()) / total,
+        "cell_accuracy": float((matrices == expected).mean()) if len(filenames) else 0.0,
+    }
+
+def _accuracy_dataset(output_csv, truth, truth_matrices):
+    from data_preprocessing.matrix_store import load_dataset
+
+    df, matrices = load_dataset(output_csv)
+    metrics = _accuracy_rows(df.to_dict("records"), truth)
+    metrics.update(_accuracy_matrices(list(df["filename"]), matrices, truth, truth_matrices))
+    return metrics
+
+def run_case(corpus_dir, stage, size, workers, backend):
+    """
+    Runs one benchmark case and returns its metrics. Meant to run in a fresh process.
+    """
+    import data_preprocessing.config as config
+    from data_preprocessing.executor import run_parallel
+    from data_preprocessing.matrix_store import load_dataset
+
+    # Templates generated together with the corpus. This process was spawned, so its own
+    # workers must be forked to inherit these settings.
+    multiprocessing.set_start_method("fork", force=True)
+    config.GRADE_TEMPLATES = os.path.join(corpus_dir, "grade_templates.npz")
+    config.BENCHMARK_TEMPLATE = os.path.join(corpus_dir, "template_benchmark.png")
+
+    subset = _subset_dir(corpus_dir, size)
+    out_dir = os.path.join(subset, f"out_{stage}_{backend}_{workers}")
+    os.makedirs(out_dir, exist_ok=True)
+    truth, truth_matrices = load_dataset(os.path.join(corpus_dir, "truth.csv"))
+    truth = truth[truth["filename"].isin(os.listdir(os.path.join(subset, "raw")))]
+    truth_matrices = truth_matrices[truth.index.to_numpy()]
+    truth = truth.reset_index(drop=True)
+
+    latencies = []
+    accuracy = {}
+    errors = 0
+
+    def per_image(func, directory):
+        nonlocal errors
+        paths = [os.path.join(directory, f) for f in sorted(os.listdir(directory))]
+        results = []
+        for path, output, error in run_parallel(partial(_timed, func), paths, backend=backend, max_workers=workers):
+            if error:
+                errors += 1
+                continue
+            result, seconds = output
+            latencies.append(seconds)
+            results.append((os.path.basename(path), result))
+        return results
+
+    start = time.perf_counter()
+    if stage == "crop_header":
+        results = per_image(partial(_crop_to, out_dir, config.HEADER_COORDS), os.path.join(subset, "raw"))
+        accuracy["written"] = sum(bool(ok) for _, ok in results) / size
+
+    elif stage == "process_image_ocr":
+        from data_preprocessing.ocr_parallel_extractor import process_image_ocr
+
+        results = per_image(process_image_ocr, os.path.join(subset, "headers"))
+        accuracy = _accuracy_rows([row for _, row in results if row], truth)
+
+    elif stage == "image_to_matrix":
+        from data_preprocessing.image_to_matrix import image_to_matrix
+
+        results = per_image(image_to_matrix, os.path.join(subset, "boards"))
+        accuracy = _accuracy_matrices([f for f, _ in results], [m for _, m in results], truth, truth_matrices)
+
+    elif stage == "build_csv":
+        from data_preprocessing.build_dataframe import build_csv
+        from data_preprocessing.image_to_matrix import image_to_matrix
+
+        output_csv = os.path.join(out_dir, "final_data.csv")
+        build_csv(os.path.join(subset, "boards"), os.path.join(corpus_dir, "truth.csv"), image_to_matrix,
+                  output_csv, backend=backend, max_workers=workers)
+        accuracy = _accuracy_dataset(output_csv, truth, truth_matrices)
+
+    elif stage == "pipeline_fused":
+        from data_preprocessing.fused_pipeline import run_fused_pipeline
+
+        output_csv = os.path.join(out_dir, "final_data.csv")
+        run_fused_pipeline(os.path.join(subset, "raw"), output_csv, config.HEADER_COORDS, config.BOARD_COORDS,
+                           backend=backend, max_workers=workers)
+        accuracy = _accuracy_dataset(output_csv, truth, truth_matrices)
+
+    elif stage == "pipeline_staged":
+        from data_preprocessing.parallel_cropper import crop_header
+        from data_preprocessing.ocr_parallel_extractor import extract_metadata
+        from data_preprocessing.build_dataframe import build_csv
+        from data_preprocessing.image_to_matrix import image_to_matrix
+
+        headers, boards = os.path.join(out_dir, "headers"), os.path.join(out_dir, "boards")
+        metadata_csv, output_csv = os.path.join(out_dir, "metadata.csv"), os.path.join(out_dir, "final_data.csv")
+        if os.path.exists(metadata_csv):
+            os.remove(metadata_csv)
+        crop_header(os.path.join(subset, "raw"), headers, config.HEADER_COORDS, backend=backend, max_workers=workers)
+        crop_header(os.path.join(subset, "raw"), boards, config.BOARD_COORDS, backend=backend, max_workers=workers)
+        extract_metadata(headers, backend=backend, max_workers=workers, output_csv=metadata_csv)
+        build_csv(boards, metadata_csv, image_to_matrix, output_csv, backend=backend, max_workers=workers)
+        accuracy = _accuracy_dataset(output_csv, truth, truth_matrices)
+
+    else:
+        raise ValueError(f"Unknown stage '{stage}', expected one of {STAGES}")
+    elapsed = time.perf_counter() - start
+
+    return {
+        "stage": stage,
+        "size": size,
+        "workers": workers,
+        "backend": backend,
+        "seconds": elapsed,
+        "images_per_sec": size / elapsed if elapsed else None,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000) if latencies else None,
+        "p99_ms": float(np.percentile(latencies, 99) * 1000) if latencies else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "errors": errors,
+        "accuracy": accuracy,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmark on synthetic MoonBoard screenshots")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 500])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, os.cpu_count() or 1])
+    parser.add_argument("--backend", choices=["thread", "process"], default="process")
+    parser.add_argument("--corpus", default="perf_corpus", help="directory of the synthetic corpus")
+    parser.add_argument("--output", default="perf_results.jsonl", help="JSON lines file results are appended to")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    prepare_corpus(args.corpus, max(args.sizes), seed=args.seed)
+
+    run_info = {
+        "run": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+    }
+
+    # Each case runs in a new process, so the peak RSS is its own
+    context = multiprocessing.get_context("spawn")
+    print(f"{'stage':<18}{'size':>6}{'workers':>8}{'img/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'RSS MB':>9}  accuracy")
+    for stage in args.stages:
+        for size in args.sizes:
+            for workers in args.workers:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(run_case, args.corpus, stage, size, workers, args.backend).result()
+                result.update(run_info)
+                with open(args.output, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(result) + "\n")
+
+                fmt = lambda v: f"{v:.1f}" if v is not None else "-"
+                accuracy = " ".join(f"{k}={v:.3f}" for k, v in result["accuracy"].items())
+                print(f"{stage:<18}{size:>6}{workers:>8}{fmt(result['images_per_sec']):>10}"
+                      f"{fmt(result['p50_ms']):>9}{fmt(result['p99_ms']):>9}{fmt(result['peak_rss_mb']):>9}  {accuracy}")
+
+    print(f"✅ Results appended to: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+# The packages are imported from the repository root, as `python main.py` does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_preprocessing.config as config
+
+# Paths of config.py moved to the temporary directory of each test
+CONFIG_PATHS = ("RAW_DIR", "RAW_TEST_DIR", "HEADERS_DIR", "HEADERS_TEST_DIR", "BOARDS_DIR", "MANIFEST_PATH",
+                "DEDUP_INDEX", "DEDUP_REPORT", "METRICS_DIR", "CONTACT_SHEETS_DIR", "GRADE_TEMPLATES", "OCR_CACHE",
+                "METADATA_CSV", "FINAL_CSV", "SIMILARITY_INDEX", "TRAIN_RESULTS")
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    """
+    Small synthetic corpus (see `synthetic.generate_corpus`): raw screenshots with known grade,
+    stars, benchmark flag and hold matrix, plus the benchmark and grade templates.
+    """
+    from data_preprocessing.synthetic import generate_corpus
+
+    output_dir = str(tmp_path_factory.mktemp("corpus"))
+    generate_corpus(output_dir, 24, seed=0)
+    return output_dir
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Points every path of config.py to a fresh directory, so a test never reads or writes the real data.
+    """
+    base = str(tmp_path)
+    monkeypatch.setattr(config, "BASE_IMAGE_DIR", base)
+    for name in CONFIG_PATHS:
+        monkeypatch.setattr(config, name, os.path.join(base, os.path.basename(getattr(config, name))))
+    return base
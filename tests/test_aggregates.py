@@ -0,0 +1,63 @@
+import numpy as np
+
+import data_preprocessing.config as config
+from data_preprocessing.aggregates import AggregateStore
+from data_preprocessing.matrix_store import DatasetWriter, load_dataset, HOLD
+from data_preprocessing.synthetic import random_route
+
+COLUMNS = ["filename", "grade", "benchmark", "stars"]
+AGGREGATES = ("routes", "holds", "stars", "hold_counts", "cooccurrence")
+
+def _routes(rng, names):
+    routes = [random_route(rng) for _ in names]
+    rows = [{"filename": name, "grade": route["grade"], "benchmark": route["benchmark"], "stars": route["stars"]}
+            for name, route in zip(names, routes)]
+    return rows, np.stack([route["matrix"] for route in routes])
+
+def _assert_same(store, expected):
+    for name in AGGREGATES:
+        np.testing.assert_array_equal(getattr(store, name), getattr(expected, name), err_msg=name)
+
+def test_replaced_rows_are_subtracted(tmp_path):
+    rng = np.random.default_rng(0)
+    csv_path = str(tmp_path / "data.csv")
+    with DatasetWriter(csv_path, COLUMNS, append=False, aggregates=True) as writer:
+        writer.write(*_routes(rng, [f"m_{i}.png" for i in range(12)]))
+    # Incremental runs: three routes read again (other grade, stars and holds), a new one twice
+    with DatasetWriter(csv_path, COLUMNS, aggregates=True) as writer:
+        writer.write(*_routes(rng, ["m_3.png", "m_12.png", "m_7.png", "m_12.png"]))
+    with DatasetWriter(csv_path, COLUMNS, aggregates=True) as writer:
+        writer.write(*_routes(rng, ["m_0.png"]))
+
+    df, matrices = load_dataset(csv_path, mmap=False)
+    rebuilt_path = str(tmp_path / "rebuilt.csv")
+    with DatasetWriter(rebuilt_path, COLUMNS, append=False, aggregates=True) as writer:
+        writer.write(df.to_dict("records"), matrices)
+
+    store = AggregateStore(csv_path)
+    _assert_same(store, AggregateStore(rebuilt_path))
+    assert store.routes.sum() == len(df) == 13
+    assert len(store.index) == 13
+
+    # Against the counts computed directly from the last row of every route
+    grades = [config.GRADE_VOCABULARY.index(grade) for grade in df["grade"]]
+    for grade in set(grades):
+        routes = np.array(grades) == grade
+        np.testing.assert_array_equal(store.heatmap(config.GRADE_VOCABULARY[grade], normalize=False),
+                                      matrices[routes][..., HOLD].sum(axis=0))
+    np.testing.assert_array_equal(store.star_histogram(), np.bincount(df["stars"], minlength=6))
+
+def test_rewritten_dataset_is_rebuilt_on_open(tmp_path):
+    rng = np.random.default_rng(1)
+    csv_path = str(tmp_path / "data.csv")
+    with DatasetWriter(csv_path, COLUMNS, append=False, aggregates=True) as writer:
+        writer.write(*_routes(rng, [f"m_{i}.png" for i in range(6)]))
+    # Rewritten without the aggregates: the saved store no longer matches the files
+    with DatasetWriter(csv_path, COLUMNS, append=False) as writer:
+        writer.write(*_routes(rng, [f"m_{i}.png" for i in range(4)]))
+
+    store = AggregateStore(csv_path)
+    assert store.routes.sum() == 4
+    rebuilt = AggregateStore(csv_path, reset=True)
+    assert rebuilt.sync() == 4
+    _assert_same(store, rebuilt)
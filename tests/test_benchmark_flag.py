@@ -0,0 +1,58 @@
+import os
+
+import cv2
+import numpy as np
+import pandas as pd
+
+import benchmark
+import data_preprocessing.config as config
+from data_preprocessing.matrix_store import DatasetWriter, load_dataset
+from data_preprocessing.synthetic import TRUTH_COLUMNS
+
+def _dataset_with_replaced_row(corpus, tmp_path):
+    """
+    Copy of the ground truth as a dataset without the benchmark column, where the first route was
+    appended again by an incremental run (stale benchmark flag and matrix in its first row).
+    """
+    truth, matrices = load_dataset(os.path.join(corpus, "truth.csv"), mmap=False)
+    columns = [c for c in TRUTH_COLUMNS if c != "benchmark"]
+    csv_path = str(tmp_path / "final_data.csv")
+    stale = matrices.copy()
+    stale[0] = 0
+    with DatasetWriter(csv_path, columns, append=False) as writer:
+        writer.write(truth[columns].to_dict("records"), stale)
+        writer.write(truth[columns].iloc[:1].to_dict("records"), matrices[:1])
+    return csv_path, truth, matrices
+
+def _crop_headers(corpus, tmp_path):
+    header_dir = tmp_path / "headers"
+    header_dir.mkdir()
+    y1, y2, x1, x2 = config.HEADER_COORDS
+    raw_dir = os.path.join(corpus, "raw")
+    for filename in os.listdir(raw_dir):
+        cv2.imwrite(str(header_dir / filename), cv2.imread(os.path.join(raw_dir, filename))[y1:y2, x1:x2])
+    return str(header_dir)
+
+def test_benchmark_flag_keeps_the_matrices(corpus, tmp_path):
+    csv_path, truth, matrices = _dataset_with_replaced_row(corpus, tmp_path)
+    header_dir = _crop_headers(corpus, tmp_path)
+    output_csv = str(tmp_path / "with_benchmark.csv")
+
+    benchmark.main(csv_path, output_csv, header_dir, os.path.join(corpus, "template_benchmark.png"))
+
+    df, out_matrices = load_dataset(output_csv)
+    assert len(pd.read_csv(output_csv)) == len(truth)  # One row per screenshot
+    order = truth.set_index("filename").loc[df["filename"]]
+    assert df["benchmark"].tolist() == order["benchmark"].tolist()
+    expected = matrices[[truth.index[truth["filename"] == f][0] for f in df["filename"]]]
+    assert np.array_equal(out_matrices, expected)
+
+def test_benchmark_flag_in_place(corpus, tmp_path):
+    csv_path, truth, matrices = _dataset_with_replaced_row(corpus, tmp_path)
+    header_dir = _crop_headers(corpus, tmp_path)
+
+    benchmark.main(csv_path, csv_path, header_dir, os.path.join(corpus, "template_benchmark.png"))
+
+    df, out_matrices = load_dataset(csv_path)
+    assert "benchmark" in df and len(df) == len(truth)
+    assert np.array_equal(out_matrices[df["filename"] == truth["filename"][0]][0], matrices[0])
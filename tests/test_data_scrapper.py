@@ -0,0 +1,48 @@
+import os
+import asyncio
+
+from data_preprocessing.data_scrapper import PNG_SIGNATURE, capture_filename, capture_routes
+from data_preprocessing.shards import list_images
+
+class FlakyDevice:
+    """
+    In-memory device whose screencap fails on the given attempts (1-based) and whose swipe
+    fails once.
+    """
+
+    def __init__(self, failing_captures):
+        self.failing = set(failing_captures)
+        self.attempts = 0
+        self.route = 0
+        self.swipe_failed = False
+
+    async def screencap(self):
+        self.attempts += 1
+        if self.attempts in self.failing:
+            raise RuntimeError("adb: device offline")
+        return PNG_SIGNATURE + str(self.route).encode()
+
+    async def swipe(self):
+        if not self.swipe_failed:
+            self.swipe_failed = True
+            raise RuntimeError("adb: closed")
+        self.route += 1
+
+def test_transient_adb_errors_do_not_stop_the_capture(tmp_path):
+    # Route 2 fails once (retried), route 4 fails every attempt (skipped)
+    device = FlakyDevice({2, 5, 6, 7})
+    stats = asyncio.run(capture_routes(device, 5, save_dir=str(tmp_path), settle=0))
+    assert stats["captured"] == 4
+    assert stats["errors"] == 5  # 4 screencaps and 1 swipe
+    names = [p.name for p in sorted(tmp_path.iterdir())]
+    assert names == ["moonboard_0001.png", "moonboard_0002.png", "moonboard_0003.png", "moonboard_0005.png"]
+
+def test_names_sort_in_capture_order(tmp_path):
+    assert capture_filename(7, 1, 50000) == "moonboard_00007.png"
+    assert capture_filename(7, 1, 10) == "moonboard_0007.png"
+
+    # Names of runs with other paddings still sort by capture number
+    for name in ("moonboard_9999.png", "moonboard_10000.png", "moonboard_0002.png"):
+        (tmp_path / name).write_bytes(b"")
+    assert [os.path.basename(p) for p in list_images(str(tmp_path))] == [
+        "moonboard_0002.png", "moonboard_9999.png", "moonboard_10000.png"]
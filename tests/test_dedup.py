@@ -0,0 +1,55 @@
+import numpy as np
+
+import data_preprocessing.config as config
+from data_preprocessing.dedup import DedupIndex, board_hash, matrix_hash
+from data_preprocessing.image_to_matrix import board_to_matrix
+from data_preprocessing.synthetic import random_route, render_board
+
+def _board(matrix, noise=0, seed=0):
+    # The same background (unused holds) for every route, as on a real MoonBoard
+    y1, y2, x1, x2 = config.BOARD_COORDS
+    board = render_board(matrix, y2 - y1, x2 - x1, np.random.default_rng(1))
+    if noise:
+        jitter = np.random.default_rng(seed).integers(-noise, noise + 1, board.shape)
+        board = np.clip(board.astype(int) + jitter, 0, 255).astype(np.uint8)
+    return board
+
+def _hashes(board):
+    return board_hash(board), matrix_hash(board_to_matrix(board))
+
+def test_different_routes_on_the_same_board_are_kept(tmp_path):
+    rng = np.random.default_rng(0)
+    hashes = [_hashes(_board(random_route(rng)["matrix"])) for _ in range(40)]
+
+    # The perceptual hashes of different routes are close: the hash alone would drop them
+    boards = [board for board, _ in hashes]
+    assert min(bin(boards[0] ^ other).count("1") for other in boards[1:]) <= config.DEDUP_MAX_DISTANCE
+
+    with DedupIndex(str(tmp_path / "index.jsonl")) as index:
+        decisions = [index.check(f"moonboard_{i:02}.png", *h) for i, h in enumerate(hashes)]
+    assert decisions == [None] * len(hashes)
+
+def test_repeated_capture_is_dropped(tmp_path):
+    rng = np.random.default_rng(0)
+    first, other = random_route(rng)["matrix"], random_route(rng)["matrix"]
+    captures = [_hashes(_board(first)), _hashes(_board(first, noise=3, seed=1)), _hashes(_board(other))]
+
+    path = str(tmp_path / "index.jsonl")
+    with DedupIndex(path) as index:
+        decisions = [index.check(f"moonboard_{i}.png", *h) for i, h in enumerate(captures)]
+    assert decisions[0] is None
+    assert decisions[1][:2] == ("moonboard_0.png", "near_identical")
+    assert decisions[2] is None
+
+    # The decisions are replayed from the index file
+    with DedupIndex(path) as index:
+        assert index.duplicates() == {"moonboard_1.png": decisions[1]}
+
+def test_same_matrix_outside_the_window_is_dropped(tmp_path):
+    rng = np.random.default_rng(0)
+    route = random_route(rng)["matrix"]
+    with DedupIndex(str(tmp_path / "index.jsonl"), window=2) as index:
+        assert index.check("a.png", *_hashes(_board(route))) is None
+        for i in range(3):
+            index.check(f"other_{i}.png", *_hashes(_board(random_route(rng)["matrix"])))
+        assert index.check("b.png", *_hashes(_board(route)))[:2] == ("a.png", "same_matrix")
@@ -0,0 +1,83 @@
+import os
+
+import cv2
+
+import data_preprocessing.executor as executor
+from data_preprocessing.executor import ConcurrencyController, run_parallel
+
+def _threads(_):
+    return os.environ.get("OMP_THREAD_LIMIT"), cv2.getNumThreads()
+
+def test_thread_backend_restores_native_threads(monkeypatch):
+    monkeypatch.delenv("OMP_THREAD_LIMIT", raising=False)
+    monkeypatch.setenv("OMP_NUM_THREADS", "7")
+    cv2.setNumThreads(3)
+    try:
+        results = list(run_parallel(_threads, range(8), backend="thread", max_workers=2, ordered=True))
+        # Pinned while the stage runs...
+        assert all(result[0] is not None for _, result, _ in results)
+        # ...and back to the caller's settings afterwards
+        assert "OMP_THREAD_LIMIT" not in os.environ
+        assert os.environ["OMP_NUM_THREADS"] == "7"
+        assert cv2.getNumThreads() == 3
+    finally:
+        cv2.setNumThreads(-1)
+
+def test_results_keep_input_order():
+    results = list(run_parallel(abs, range(-50, 0), backend="thread", max_workers=4, chunk_size=3, ordered=True))
+    assert [item for item, _, _ in results] == list(range(-50, 0))
+    assert [result for _, result, _ in results] == list(range(50, 0, -1))
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def _window(controller, clock, rate):
+    # One measurement window of `controller.window` seconds at `rate` images/sec
+    controller.record(1, 0.01)
+    clock.now += controller.window
+    controller.record(int(rate * controller.window), 0.01)
+
+def test_placement_probe_keeps_the_fastest_backend(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(executor.time, "perf_counter", clock)
+    controller = ConcurrencyController(["thread", "process"], initial=4, maximum=16, window=1, tolerance=0.05)
+
+    _window(controller, clock, 100)
+    assert (controller.backend, controller.limit) == ("process", 4)
+    _window(controller, clock, 150)
+    assert (controller.backend, controller.limit, controller.retired) == ("process", 4, ["thread"])
+    assert controller.settings()["backend"] == "process"
+
+def test_workers_climb_turn_back_and_settle(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(executor.time, "perf_counter", clock)
+    controller = ConcurrencyController(["thread"], initial=4, maximum=16, window=1, tolerance=0.05)
+
+    limits = []
+    for rate in (100, 150, 200, 150, 152):
+        _window(controller, clock, rate)
+        limits.append(controller.limit)
+    # First step up by initial // 2, doubled while it improves (at most +50%), then back by
+    # half the step on a drop and towards fewer workers when flat
+    assert limits == [6, 9, 13, 11, 10]
+    assert [window["workers"] for window in controller.history] == [4, 6, 9, 13, 11]
+    assert controller.settings()["workers"] == 9
+
+def test_workers_stay_within_bounds(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(executor.time, "perf_counter", clock)
+    controller = ConcurrencyController(["thread"], initial=4, maximum=5, window=1, tolerance=0.05)
+    _window(controller, clock, 100)
+    assert controller.limit == 5
+    # Improving at the maximum: turns back instead of staying stuck
+    _window(controller, clock, 200)
+    assert controller.limit == 4
+
+    fixed = ConcurrencyController(["thread"], initial=4, maximum=16, adapt=False, window=1)
+    for rate in (100, 200, 300):
+        _window(fixed, clock, rate)
+    assert fixed.limit == 4
@@ -0,0 +1,24 @@
+import pandas as pd
+
+import data_preprocessing.config as config
+from data_preprocessing.grades import normalize_grade, normalize_grades, dataset_grade_codes
+
+def test_normalize_grade_flags():
+    assert normalize_grade("Grade: User 7A+/V7 Setter 7A/V6") == ("7A+", config.GRADE_VOCABULARY.index("7A+"), "exact")
+    assert normalize_grade("TAt") == ("7A+", config.GRADE_VOCABULARY.index("7A+"), "corrected")
+    assert normalize_grade("T8t") == ("7B+", config.GRADE_VOCABULARY.index("7B+"), "confusion")
+    assert normalize_grade("6b") == ("6B", -1, "unlisted")
+    assert normalize_grade("S > & & & ¢") == (None, -1, "invalid")
+
+def test_config_changes_are_not_hidden_by_the_cache(monkeypatch):
+    assert normalize_grade("XYZ") == (None, -1, "invalid")
+    monkeypatch.setitem(config.GRADE_CORRECTIONS, "XYZ", "7A")
+    assert normalize_grade("XYZ") == ("7A", config.GRADE_VOCABULARY.index("7A"), "corrected")
+    assert normalize_grades(["XYZ"])["grade_flag"].tolist() == ["corrected"]
+
+    monkeypatch.setattr(config, "GRADE_VOCABULARY", config.GRADE_VOCABULARY + ["6B"])
+    assert normalize_grade("6b") == ("6B", len(config.GRADE_VOCABULARY) - 1, "corrected")
+
+def test_dataset_grade_codes_fall_back_to_the_grade_string():
+    df = pd.DataFrame({"grade": ["7A", "6B", "8A", "7C+"], "grade_code": [3, -1, None, None]})
+    assert dataset_grade_codes(df).tolist() == [3, -1, -1, 8]
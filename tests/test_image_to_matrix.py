@@ -0,0 +1,62 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import data_preprocessing.config as config
+from data_preprocessing.image_to_matrix import image_to_matrix, board_to_matrix, boards_to_matrices
+from data_preprocessing.matrix_store import load_dataset, HOLD, START, END
+
+def centroid_matrix(img):
+    """
+    The contour/centroid detection `image_to_matrix` used before it was vectorized: each
+    coloured contour marks the cell of its centroid (start/end channels filled by colour).
+    """
+    img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    cell_h, cell_w = img.shape[0] // 18, img.shape[1] // 11
+    masks = {key: cv2.inRange(img_hsv, np.array(lower), np.array(upper))
+             for key, (lower, upper) in config.HOLD_HSV_RANGES.items()}
+    colors = {START: masks["green"], HOLD: masks["blue"], END: cv2.bitwise_or(masks["red1"], masks["red2"])}
+
+    matrix = np.zeros((18, 11, 3), dtype=np.uint8)
+    for channel, mask in colors.items():
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for cnt in contours:
+            m = cv2.moments(cnt)
+            if m["m00"] == 0:
+                continue
+            row, col = int(m["m01"] / m["m00"]) // cell_h, int(m["m10"] / m["m00"]) // cell_w
+            if 0 <= row < 18 and 0 <= col < 11:
+                matrix[row, col, HOLD] = 1
+                if channel != HOLD:
+                    matrix[row, col, channel] = 1
+    return matrix
+
+@pytest.fixture(scope="module")
+def boards(corpus, tmp_path_factory):
+    df, truth = load_dataset(os.path.join(corpus, "truth.csv"), mmap=False)
+    y1, y2, x1, x2 = config.BOARD_COORDS
+    board_dir = tmp_path_factory.mktemp("boards")
+    paths, crops = [], []
+    for filename in df["filename"]:
+        crop = cv2.imread(os.path.join(corpus, "raw", filename))[y1:y2, x1:x2]
+        path = str(board_dir / filename)
+        cv2.imwrite(path, crop)
+        paths.append(path)
+        crops.append(crop)
+    return paths, np.stack(crops), truth
+
+def test_vectorized_matrix_matches_the_centroid_detection(boards):
+    paths, crops, truth = boards
+    for path, crop, expected in zip(paths, crops, truth):
+        reference = centroid_matrix(crop)
+        np.testing.assert_array_equal(reference, expected)
+        # Full size and the reduced decode size give the same cells
+        np.testing.assert_array_equal(board_to_matrix(crop), reference)
+        np.testing.assert_array_equal(image_to_matrix(path), reference)
+
+def test_batch_matches_single_boards(boards):
+    _, crops, truth = boards
+    np.testing.assert_array_equal(boards_to_matrices(crops), truth)
+    assert boards_to_matrices(crops[:0]).shape == (0, 18, 11, 3)
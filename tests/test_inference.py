@@ -0,0 +1,109 @@
+import json
+
+import numpy as np
+import pytest
+
+from modeling.inference import GradeModel
+
+GRADES = ["6B+", "6C", "6C+", "7A", "7A+", "7B", "7B+", "7C", "7C+"]
+
+def _batch_norm(rng, channels):
+    return {"scale": rng.uniform(0.5, 1.5, channels).astype(np.float32),
+            "shift": rng.normal(0, 0.3, channels).astype(np.float32)}
+
+def _dense(rng, inputs, outputs):
+    return {"kernel": rng.normal(0, 0.3, (inputs, outputs)).astype(np.float32),
+            "bias": rng.normal(0, 0.1, outputs).astype(np.float32)}
+
+def _conv(rng, kernel, cin, cout):
+    return {"kernel": rng.normal(0, 0.3, (*kernel, cin, cout)).astype(np.float32),
+            "bias": rng.normal(0, 0.1, cout).astype(np.float32)}
+
+def export(path, seed=0):
+    """
+    Writes a small model in the format of `export.export_model`, with a batch norm before each
+    kind of layer (valid and same convolutions, flatten and dense), and returns its layers.
+    """
+    rng = np.random.default_rng(seed)
+    layers = [
+        ({"type": "InputLayer"}, {}),
+        ({"type": "BatchNormalization"}, _batch_norm(rng, 1)),
+        ({"type": "Conv2D", "strides": [1, 1], "padding": "valid", "activation": "relu"}, _conv(rng, (3, 3), 1, 4)),
+        ({"type": "BatchNormalization"}, _batch_norm(rng, 4)),
+        ({"type": "Conv2D", "strides": [2, 2], "padding": "same", "activation": "relu"}, _conv(rng, (3, 2), 4, 6)),
+        ({"type": "BatchNormalization"}, _batch_norm(rng, 6)),
+        ({"type": "Flatten"}, {}),
+        ({"type": "Dense", "activation": "relu"}, _dense(rng, 8 * 5 * 6, 16)),
+        ({"type": "Dropout"}, {}),
+        ({"type": "BatchNormalization"}, _batch_norm(rng, 16)),
+        ({"type": "Dense", "activation": "sigmoid"}, _dense(rng, 16, 1)),
+    ]
+    arrays = {f"{i}.{name}": array for i, (_, weights) in enumerate(layers) for name, array in weights.items()}
+    spec = {"version": 1, "input_shape": [18, 11, 1], "layers": [dict(layer, name=f"layer_{i}")
+                                                                 for i, (layer, _) in enumerate(layers)],
+            "grades": GRADES, "label_scale": 8.0, "label_offset": 0.0}
+    np.savez(path, spec=np.array(json.dumps(spec)), **arrays)
+    return layers
+
+def _reference_conv(x, kernel, bias, strides, padding):
+    # Direct convolution, one output cell at a time (TensorFlow's padding)
+    (kh, kw), (sh, sw) = kernel.shape[:2], strides
+    n, h, w, _ = x.shape
+    if padding == "same":
+        ho, wo = -(-h // sh), -(-w // sw)
+        ph, pw = max((ho - 1) * sh + kh - h, 0), max((wo - 1) * sw + kw - w, 0)
+        x = np.pad(x, ((0, 0), (ph // 2, ph - ph // 2), (pw // 2, pw - pw // 2), (0, 0)))
+    else:
+        ho, wo = (h - kh) // sh + 1, (w - kw) // sw + 1
+    out = np.zeros((n, ho, wo, kernel.shape[-1]))
+    for i in range(ho):
+        for j in range(wo):
+            window = x[:, i * sh:i * sh + kh, j * sw:j * sw + kw, :]
+            out[:, i, j] = np.tensordot(window, kernel, axes=([1, 2, 3], [0, 1, 2])) + bias
+    return out
+
+def reference_forward(layers, x):
+    activations = {"linear": lambda v: v, "relu": lambda v: np.maximum(v, 0), "sigmoid": lambda v: 1 / (1 + np.exp(-v))}
+    x = x.astype(np.float64)
+    for layer, weights in layers:
+        if layer["type"] == "BatchNormalization":
+            x = x * weights["scale"] + weights["shift"]
+        elif layer["type"] == "Conv2D":
+            x = activations[layer["activation"]](_reference_conv(x, weights["kernel"], weights["bias"],
+                                                                 layer["strides"], layer["padding"]))
+        elif layer["type"] == "Flatten":
+            x = x.reshape(len(x), -1)
+        elif layer["type"] == "Dense":
+            x = activations[layer["activation"]](x @ weights["kernel"] + weights["bias"])
+    return x.reshape(len(x))
+
+@pytest.mark.parametrize("fold", [True, False])
+def test_forward_pass_matches_the_reference(tmp_path, fold):
+    path = str(tmp_path / "model.npz")
+    layers = export(path)
+    x = np.random.default_rng(1).integers(0, 2, (37, 18, 11, 1)).astype(np.float32)
+
+    model = GradeModel(path, fold=fold)
+    expected = reference_forward(layers, x)
+    np.testing.assert_allclose(model.predict(x, batch_size=8), expected, atol=1e-5)
+    # Masks without the channel axis, and a single route
+    np.testing.assert_allclose(model.predict(x[..., 0]), expected, atol=1e-5)
+    np.testing.assert_allclose(model.predict(x[0, ..., 0]), expected[:1], atol=1e-5)
+
+    grades, index = model.predict_grades(x)
+    np.testing.assert_allclose(index, expected * 8.0, atol=1e-4)
+    assert grades == [GRADES[i] for i in np.clip(np.rint(index), 0, 8).astype(int)]
+
+def test_batch_norms_are_folded(tmp_path):
+    path = str(tmp_path / "model.npz")
+    export(path)
+    kinds = [type(op).__name__ for op in GradeModel(path).ops]
+    # Only the one before the "same" convolution (its padding would be shifted) stays separate
+    assert kinds.count("Affine") == 1
+    assert kinds.count("Affine") < [type(op).__name__ for op in GradeModel(path, fold=False).ops].count("Affine")
+
+def test_wrong_input_shape_is_rejected(tmp_path):
+    path = str(tmp_path / "model.npz")
+    export(path)
+    with pytest.raises(ValueError):
+        GradeModel(path).predict(np.zeros((2, 11, 18)))
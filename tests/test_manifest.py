@@ -0,0 +1,91 @@
+import json
+
+import data_preprocessing.config as config
+from data_preprocessing.manifest import Manifest, forget_stages, upgrade_columns, append_rows
+
+def _images(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"moonboard_{i}.png"
+        path.write_bytes(f"image {i}".encode())
+        paths.append(str(path))
+    return paths
+
+def _process(manifest, paths, extra=None):
+    todo = manifest.pending(paths, extra)
+    for path in todo:
+        manifest.mark_done(path)
+    manifest.flush()
+    return todo
+
+def test_processed_inputs_are_skipped(tmp_path):
+    paths = _images(tmp_path, 4)
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    with Manifest(manifest_path, "crop_header") as manifest:
+        assert _process(manifest, paths) == paths
+        assert manifest.pending(paths) == []
+
+    with Manifest(manifest_path, "crop_header") as manifest:
+        assert len(manifest) == 4
+        assert manifest.pending(paths) == []
+
+def test_changed_content_is_processed_again(tmp_path):
+    paths = _images(tmp_path, 3)
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    with Manifest(manifest_path, "crop_header") as manifest:
+        _process(manifest, paths)
+
+    with open(paths[1], "wb") as f:
+        f.write(b"another capture")
+    with Manifest(manifest_path, "crop_header") as manifest:
+        assert manifest.pending(paths) == [paths[1]]
+
+def test_changed_extra_input_is_processed_again(tmp_path):
+    paths = _images(tmp_path, 3)
+    extra = {path: {"grade": "7A"} for path in paths}
+    with Manifest(str(tmp_path / "manifest.jsonl"), "matrix") as manifest:
+        _process(manifest, paths, extra)
+        assert manifest.pending(paths, extra) == []
+        extra[paths[2]] = {"grade": "7A+"}
+        assert manifest.pending(paths, extra) == [paths[2]]
+
+def test_config_change_invalidates_only_its_stage(tmp_path, monkeypatch):
+    paths = _images(tmp_path, 2)
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    for stage in ("crop_header", "crop_board"):
+        with Manifest(manifest_path, stage) as manifest:
+            _process(manifest, paths)
+
+    y1, y2, x1, x2 = config.HEADER_COORDS
+    monkeypatch.setattr(config, "HEADER_COORDS", (y1, y2 + 1, x1, x2))
+    with Manifest(manifest_path, "crop_header") as manifest:
+        assert manifest.pending(paths) == paths
+    with Manifest(manifest_path, "crop_board") as manifest:
+        assert manifest.pending(paths) == []
+
+def test_truncated_line_and_forgotten_stages(tmp_path):
+    paths = _images(tmp_path, 2)
+    manifest_path = str(tmp_path / "manifest.jsonl")
+    for stage in ("crop_header", "crop_board"):
+        with Manifest(manifest_path, stage) as manifest:
+            _process(manifest, paths)
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        f.write('{"stage": "crop_header", "vers')
+
+    with Manifest(manifest_path, "crop_header") as manifest:
+        assert manifest.pending(paths) == []
+
+    forget_stages(manifest_path, {"crop_header"})
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        assert {json.loads(line)["stage"] for line in f} == {"crop_board"}
+    with Manifest(manifest_path, "crop_header") as manifest:
+        assert manifest.pending(paths) == paths
+
+def test_append_rows_upgrades_older_columns(tmp_path):
+    path = str(tmp_path / "metadata.csv")
+    append_rows(path, [{"filename": "a.png", "grade": "7A"}], ["filename", "grade"])
+    append_rows(path, [{"filename": "b.png", "grade": "6C", "stars": 3}], ["filename", "grade", "stars"])
+
+    with open(path, "r", encoding="utf-8") as f:
+        assert f.read().splitlines() == ["filename,grade,stars", "a.png,7A,", "b.png,6C,3"]
+    assert not upgrade_columns(path, ["filename", "grade", "stars"])
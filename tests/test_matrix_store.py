@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+
+from data_preprocessing.matrix_store import (MATRIX_SHAPE, HOLD, DatasetWriter, load_dataset, load_matrices,
+                                             matrices_path, pack_matrices, unpack_matrices)
+
+COLUMNS = ["filename", "grade"]
+
+def _matrices(count, seed=0):
+    return np.random.default_rng(seed).integers(0, 2, (count, *MATRIX_SHAPE), dtype=np.uint8)
+
+def test_pack_round_trip():
+    matrices = _matrices(7)
+    packed = pack_matrices(matrices)
+    assert packed.shape == (7, 75)
+    np.testing.assert_array_equal(unpack_matrices(packed), matrices)
+
+    masks = matrices[..., HOLD]
+    np.testing.assert_array_equal(unpack_matrices(pack_matrices(masks), masks.shape[1:]), masks)
+
+def test_appended_rows_replace_earlier_ones(tmp_path):
+    csv_path = str(tmp_path / "data.csv")
+    first, second = _matrices(4), _matrices(2, seed=1)
+    with DatasetWriter(csv_path, COLUMNS, append=False) as writer:
+        writer.write([{"filename": f"m_{i}.png", "grade": "7A"} for i in range(4)], first)
+    with DatasetWriter(csv_path, COLUMNS) as writer:
+        writer.write([{"filename": "m_1.png", "grade": "6C"}, {"filename": "m_9.png", "grade": "7B"}], second)
+
+    df, matrices = load_dataset(csv_path, mmap=False)
+    assert df["filename"].tolist() == ["m_0.png", "m_2.png", "m_3.png", "m_1.png", "m_9.png"]
+    assert df["grade"].tolist() == ["7A", "7A", "7A", "6C", "7B"]
+    np.testing.assert_array_equal(matrices, np.concatenate([first[[0, 2, 3]], second]))
+
+    _, holds = load_dataset(csv_path, channel=HOLD)
+    np.testing.assert_array_equal(holds, matrices[..., HOLD])
+
+def test_interrupted_write_is_realigned(tmp_path):
+    csv_path = str(tmp_path / "data.csv")
+    matrices = _matrices(3)
+    with DatasetWriter(csv_path, COLUMNS, append=False) as writer:
+        writer.write([{"filename": f"m_{i}.png", "grade": "7A"} for i in range(3)], matrices)
+
+    # Matrices of a row whose CSV line was never written
+    with open(matrices_path(csv_path), "ab") as f:
+        f.write(pack_matrices(_matrices(1, seed=2)).tobytes())
+    with DatasetWriter(csv_path, COLUMNS) as writer:
+        assert writer.rows == 3
+    assert os.path.getsize(matrices_path(csv_path)) == 3 * 75
+    np.testing.assert_array_equal(load_matrices(csv_path), matrices)
@@ -0,0 +1,110 @@
+import os
+
+import cv2
+import pandas as pd
+import pytest
+import pytesseract
+
+import data_preprocessing.config as config
+import data_preprocessing.ocr_parallel_extractor as extractor
+from data_preprocessing.manifest import Manifest
+from data_preprocessing.matrix_store import load_dataset
+from data_preprocessing.ocr_cache import image_key
+from data_preprocessing.parallel_cropper import read_image
+
+class FakeTesseract:
+    """
+    Stands in for `pytesseract.image_to_data`: returns the header lines of the synthetic corpus
+    ("Route 3" / "Set by synthetic" / "Grade: User 7A+/V5 Setter 7A+/V5") and counts the calls.
+    """
+
+    def __init__(self, grades):
+        self.grades = grades
+        self.calls = 0
+
+    def __call__(self, image, config="", output_type=None):
+        self.calls += 1
+        grade = self.grades[image_key(image)]
+        lines = ["Route", "Set by synthetic", f"Grade: User {grade}/V5 Setter {grade}/V5"]
+        data = {key: [] for key in ("text", "block_num", "par_num", "line_num", "left", "top", "width",
+                                    "height", "conf")}
+        for number, line in enumerate(lines):
+            for i, word in enumerate(line.split()):
+                for key, value in zip(data, (word, 1, 1, number, 10 + 60 * i, 10 + 30 * number, 50, 20, 90)):
+                    data[key].append(value)
+        return data
+
+@pytest.fixture
+def headers(corpus, workdir, monkeypatch):
+    """
+    Header crops of the corpus in config.HEADERS_DIR, with tesseract faked and no grade templates
+    (every header goes to tesseract).
+    """
+    monkeypatch.setattr(config, "BENCHMARK_TEMPLATE", os.path.join(corpus, "template_benchmark.png"))
+    os.makedirs(config.HEADERS_DIR)
+    truth, _ = load_dataset(os.path.join(corpus, "truth.csv"))
+    y1, y2, x1, x2 = config.HEADER_COORDS
+    grades = {}
+    for filename, grade in zip(truth["filename"], truth["grade"]):
+        path = os.path.join(config.HEADERS_DIR, filename)
+        cv2.imwrite(path, cv2.imread(os.path.join(corpus, "raw", filename))[y1:y2, x1:x2])
+        scale = config.HEADER_DECODE_SCALE
+        grades[image_key(extractor._text_image(read_image(path, scale), scale))] = grade
+
+    tesseract = FakeTesseract(grades)
+    monkeypatch.setattr(pytesseract, "image_to_data", tesseract)
+    return truth.set_index("filename"), tesseract
+
+def _extract():
+    with Manifest(config.MANIFEST_PATH, "ocr") as manifest:
+        return extractor.extract_metadata(config.HEADERS_DIR, manifest=manifest, output_csv=config.METADATA_CSV)
+
+def _rederive():
+    with Manifest(config.MANIFEST_PATH, "ocr") as manifest:
+        extractor.rederive_metadata(config.HEADERS_DIR, config.METADATA_CSV, manifest=manifest)
+    return pd.read_csv(config.METADATA_CSV).set_index("filename")
+
+def test_tesseract_runs_once_per_header(headers, monkeypatch):
+    truth, tesseract = headers
+    metadata = _extract().set_index("filename")
+    assert tesseract.calls == len(truth)
+    assert (metadata["grade_method"] == "tesseract").all()
+    assert metadata["grade"].tolist() == truth.loc[metadata.index, "grade"].tolist()
+
+    # Same headers, other stage version: served by the cache
+    monkeypatch.setattr(config, "GRADE_WORD_INDEX", 5)  # "Setter"
+    assert len(_extract()) == len(truth)
+    assert tesseract.calls == len(truth)
+
+def test_rederive_picks_the_grade_again_without_tesseract(headers, monkeypatch):
+    truth, tesseract = headers
+    _extract()
+    calls = tesseract.calls
+
+    # Wrong grade line: every grade is invalid
+    monkeypatch.setattr(config, "GRADE_LINE_INDEX", 1)
+    metadata = _rederive()
+    assert (metadata["grade_flag"] == "invalid").all()
+
+    # Back to the right line, and a star threshold no star reaches
+    monkeypatch.setattr(config, "GRADE_LINE_INDEX", 2)
+    monkeypatch.setattr(extractor, "STAR_MIN_PIXELS", 10 ** 9)
+    metadata = _rederive()
+    assert metadata["grade"].tolist() == truth.loc[metadata.index, "grade"].tolist()
+    assert (metadata["stars"] == 0).all()
+    assert len(metadata) == len(truth)
+    assert tesseract.calls == calls
+
+    # The headers are up to date for the OCR stage
+    assert len(_extract()) == 0
+
+def test_rederive_keeps_template_grades(headers, monkeypatch):
+    truth, tesseract = headers
+    _extract()
+    metadata = pd.read_csv(config.METADATA_CSV)
+    metadata.loc[0, ["raw_grade", "grade_method"]] = ["8C", "template"]
+    metadata.to_csv(config.METADATA_CSV, index=False)
+
+    rederived = _rederive()
+    assert rederived.loc[metadata.loc[0, "filename"], "grade"] == "8C"
+    assert rederived.drop(metadata.loc[0, "filename"])["grade_method"].eq("tesseract").all()
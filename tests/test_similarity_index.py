@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from data_preprocessing.matrix_store import HOLD
+from data_preprocessing.similarity_index import SimilarityIndex
+from data_preprocessing.synthetic import random_route
+
+def _masks(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.stack([random_route(rng)["matrix"][..., HOLD] for _ in range(count)]).astype(bool)
+
+def _brute_force(queries, masks):
+    inter = (queries[:, None] & masks[None]).sum(axis=(2, 3))
+    union = (queries[:, None] | masks[None]).sum(axis=(2, 3))
+    return np.where(union > 0, inter / np.maximum(union, 1), 0), (queries[:, None] ^ masks[None]).sum(axis=(2, 3))
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_batched_adds_match_a_rebuilt_index(tmp_path, mmap):
+    masks = _masks(50)
+    index = SimilarityIndex(str(tmp_path / "index.bin"), mmap=mmap)
+    for start in range(0, len(masks), 7):
+        index.add(masks[start:start + 7], keys=[f"route_{i}" for i in range(start, min(start + 7, len(masks)))])
+
+    reopened = SimilarityIndex(str(tmp_path / "index.bin"), mmap=mmap)
+    assert len(index) == len(reopened) == len(masks)
+    assert index.keys == reopened.keys == [f"route_{i}" for i in range(len(masks))]
+    np.testing.assert_array_equal(index.vectors, reopened.vectors)
+    np.testing.assert_array_equal(index.counts, reopened.counts)
+    np.testing.assert_array_equal(index.counts, masks.sum(axis=(1, 2)))
+
+def test_query_matches_brute_force(tmp_path):
+    masks, queries = _masks(200), _masks(5, seed=1)
+    index = SimilarityIndex(str(tmp_path / "index.bin"))
+    index.add(masks)
+    jaccard, hamming = _brute_force(queries, masks)
+
+    indices, scores = index.query(queries, k=10)
+    np.testing.assert_allclose(scores, np.sort(jaccard, axis=1)[:, ::-1][:, :10], rtol=1e-6)
+    np.testing.assert_allclose(np.take_along_axis(jaccard, indices, axis=1), scores, rtol=1e-6)
+
+    indices, scores = index.query(queries, k=10, metric="hamming")
+    np.testing.assert_array_equal(scores, np.sort(hamming, axis=1)[:, :10])
+    np.testing.assert_array_equal(np.take_along_axis(hamming, indices, axis=1), scores)
+
+def test_near_duplicates_match_brute_force(tmp_path):
+    masks = _masks(120)
+    masks[60:70] = masks[:10]
+    masks[70:75, 0, 0] = ~masks[:5, 0, 0]
+    index = SimilarityIndex(str(tmp_path / "index.bin"))
+    index.add(masks)
+    jaccard, hamming = _brute_force(masks, masks)
+    upper = np.triu(np.ones(jaccard.shape, dtype=bool), k=1)
+
+    i, j, _ = index.near_duplicates(min_jaccard=0.5, block=16)
+    assert set(zip(i.tolist(), j.tolist())) == set(zip(*np.nonzero(upper & (jaccard >= 0.5))))
+    i, j, s = index.near_duplicates(max_hamming=1, block=16)
+    assert set(zip(i.tolist(), j.tolist())) == set(zip(*np.nonzero(upper & (hamming <= 1))))
+    np.testing.assert_array_equal(s, hamming[i, j])
+
+def test_near_duplicates_rejects_a_zero_threshold(tmp_path):
+    index = SimilarityIndex(str(tmp_path / "index.bin"))
+    index.add(_masks(10))
+    with pytest.raises(ValueError):
+        index.near_duplicates(min_jaccard=0)